@@ -0,0 +1,181 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+
+# microbenchmarks of the parsing and formatting hot paths.
+#
+#   ./qa-bench.py                  run all benchmarks
+#   ./qa-bench.py -k ebi           run benchmarks whose name contains "ebi"
+#   ./qa-bench.py -o bench.jsonl   append the results (with the git commit)
+#   ./qa-bench.py -c bench.jsonl   compare with the last recorded result
+#
+# the corpora are fixed (generated with a fixed seed), so the numbers are
+# comparable between commits.  allocations are reported when tracemalloc
+# is available.
+
+'''
+ * Copyright (c) 2012, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import imp
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from optparse import OptionParser
+import quakealert
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+demo = imp.load_source('qa_demo',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qa-demo.py'))
+
+NOW = datetime(2011, 3, 11, 14, 46, 40)
+
+def corpus():
+    c = {}
+    gen = quakealert.AlertGenerator(ebi_max=50, max_reports=1, seed=2011)
+    c['code'] = gen.code_message(NOW)
+    c['decode'] = gen.decode_message(NOW)
+    c['test'] = gen.test_message(NOW)
+    alert = quakealert.QAlert(c['code'])
+    c['codestr'] = alert.code_message()
+    c['header'] = quakealert.mockserver.build_frame(c['code'], 'aN')[:10]
+    for n in (1, 50, 300):
+        gen = quakealert.AlertGenerator(ebi_max=n, max_reports=1, seed=n)
+        p = quakealert.parse('37', quakealert.QAlert(
+                gen.code_message(NOW)).code_message())
+        c['ebi%d' % n] = p.ebistr
+    c['dump'] = quakealert.Parser('37', c['codestr']).dump()
+    return c
+
+def location_db():
+    db = {}
+    for code in xrange(100, 1000):
+        db['%03d' % code] = dict(ja=dict(name=u'震央地名%03d' % code),
+                en=dict(name=u'Epicenter %03d' % code),
+                fr=dict(name=u'Épicentre %03d' % code),
+                kr=dict(name=u'진앙 %03d' % code))
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.write(fd, json.dumps(db))
+    os.close(fd)
+    return path
+
+def benchmarks(c, dbfile):
+    b = []
+    b.append(('QAMessage.header', lambda: quakealert.QAMessage(c['header'])))
+    b.append(('QAlert.init', lambda: quakealert.QAlert(c['code'])))
+    decode = quakealert.QAlert(c['decode'])
+    b.append(('QAlert.decode_message', decode.decode_message))
+    b.append(('QAlert.printable_decode_message',
+              decode.printable_decode_message))
+    b.append(('Parser.dump',
+              lambda: quakealert.Parser('37', c['codestr']).dump()))
+    b.append(('parse', lambda: quakealert.parse('37', c['codestr'])))
+    for n in (1, 50, 300):
+        s = c['ebi%d' % n]
+        b.append(('ebi_parser.%d' % n, lambda s=s: quakealert.ebi_parser(s)))
+        b.append(('EBITable.%d' % n, lambda s=s: quakealert.EBITable(s)))
+    b.append(('dump_rawbuf', lambda: quakealert.dump_rawbuf(c['code'])))
+    ldb = quakealert.LocationDB_real(dbfile)
+    ldb.lookup('100')
+    b.append(('LocationDB_real.lookup', lambda: ldb.lookup('288', 'en')))
+    for locale in ('ja', 'en', 'fr', 'kr'):
+        b.append(('format_code_message.%s' % locale,
+                  lambda l=locale: demo.format_code_message(c['dump'], l)))
+    renderer = quakealert.Renderer()
+    b.append(('Renderer.render', lambda: renderer.render(c['dump'])))
+    sink = quakealert.CallableSink(lambda items: None)
+    b.append(('Sink.emit', lambda: sink.emit(c['codestr'])))
+    return b
+
+def measure(func, mintime=0.2):
+    number = 1
+    while True:
+        t = timeit.timeit(func, number=number)
+        if t >= mintime:
+            break
+        number *= 10 if t < mintime / 10 else 2
+    best = min(timeit.repeat(func, number=number, repeat=3)) / number
+    result = dict(ops=1.0 / best, usec=best * 1e6)
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func()
+        result['alloc_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+                'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def last_record(filename):
+    last = None
+    if os.path.exists(filename):
+        for line in open(filename):
+            if line.strip():
+                last = json.loads(line)
+    return last
+
+def main():
+    op = OptionParser(usage='%prog [-k pattern] [-o file] [-c file]')
+    op.add_option('-k', dest='pattern', default=None,
+            help='run benchmarks whose name contains the pattern')
+    op.add_option('-o', '--output', default=None,
+            help='append the results to the file (json lines)')
+    op.add_option('-c', '--compare', default=None,
+            help='compare with the last result recorded in the file')
+    op.add_option('-t', '--mintime', type='float', default=0.2)
+    opts, args = op.parse_args()
+
+    base = None
+    if opts.compare:
+        base = last_record(opts.compare)
+    dbfile = location_db()
+    results = {}
+    try:
+        for name, func in benchmarks(corpus(), dbfile):
+            if opts.pattern and opts.pattern not in name:
+                continue
+            r = results[name] = measure(func, opts.mintime)
+            line = '%-34s %12.1f ops/s %10.2f usec' % (name, r['ops'],
+                                                       r['usec'])
+            if 'alloc_bytes' in r:
+                line += ' %9d B' % r['alloc_bytes']
+            if base and name in base['results']:
+                line += ' %+7.1f%%' % (
+                    (r['ops'] / base['results'][name]['ops'] - 1) * 100)
+            print line
+            sys.stdout.flush()
+    finally:
+        os.unlink(dbfile)
+    if opts.output:
+        f = open(opts.output, 'a')
+        f.write(json.dumps(dict(commit=git_commit(),
+                date=datetime.now().isoformat(),
+                python=sys.version.split()[0], results=results)) + '\n')
+        f.close()
+
+if __name__ == "__main__":
+    main()
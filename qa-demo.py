@@ -27,62 +27,46 @@ import re
 import sys
 import quakealert
 
+# the phrases of each locale are in quakealert.render.TEMPLATES
+renderer = quakealert.Renderer()
+
 def format_code_message(m, locale='ja'):
-    if not (locale=='ja' or locale=='en' or locale=='fr' or locale=='kr'):
+    if locale not in renderer.locales:
         logging.error("locale:%s is not yet supported.", locale) 
         return None
-    worddict_ja = dict(alert=':第1報', report=':最終報', 
-                       areacode='エリアコード', location='"%s" 地下 %skm', 
-                       mag='M%s 震源 %s. ', 
-                       EMS='予想最大震度 %s', 
-                       EMSn='最大震度未確定')
-    worddict_en = dict(alert=':First Alert', report=':Final Report', 
-                       areacode='AreaCode', location='"%s" under %skm', 
-                       mag='M%s at %s. ', 
-                       EMS='Estimated max seismic# is %s', 
-                       EMSn='Max seismic not yet determind')
-    worddict_fr = dict(alert=u':Première alerte', report=u':Dernier rapport', 
-                       areacode=u'Code régional', location=u'"%s" prof. %skm', 
-                       mag='M%s, %s. ', 
-                       EMS=u'Intensité max estimée: %s', 
-                       EMSn=u'Intensité max non déterminée')
-    worddict_kr = dict(alert=u':초기 경보', report=u':최종 보고', 
-                       areacode=u'지역코드', location=u'"%s" 깊이 %skm', 
-                       mag=u'M%s, %s. ', 
-                       EMS=u'최대 진도 %s 추정', 
-                       EMSn=u'최대 진도 현재 미결정')
-
-    worddict={'ja':worddict_ja, 'en':worddict_en,
-              'fr':worddict_fr, 'kr':worddict_kr}
-    buf = ''
-    try:
-        buf += "[%s" % (m['timestamp'].strftime('%H:%M:%SJST %b%d'))
-    except KeyError:
-        buf += "["
-    if m['is_last']:
-        buf += worddict[locale]['report']
-    elif m['is_first']:
-        buf += worddict[locale]['alert']
-    buf += '] '
-    try:
-        loc = m['location_str'][locale]['name']
-    except (KeyError, TypeError):
-        loc = '%s %s' % (worddict[locale]['areacode'], m['location_code'])
-    location_str = worddict[locale]['location'] % (loc, m['depth'])
-    if len(m['geo']) == 2:
-        location_str += ' (%s,%s)'  % (m['geo'][0], m['geo'][1])
-    buf += worddict[locale]['mag'] % (m['magnitude'], location_str)
-    if m['max_seismic']:
-        buf += worddict[locale]['EMS'] % (m['max_seismic'])
+    return renderer.render(m, (locale,))[locale]
+
+
+def render_worker(p, effective, test):
+    # runs in a worker process of the pipeline mode (QA_WORKERS)
+    lines = renderer.render(p)
+    for locale in renderer.locales:
+        logging.info("formatted code message(locale:%s):%s", locale,
+                lines[locale])
+
+
+def setup_logging(filename):
+    # the log file is written by a sink thread, off the receiving loop
+    handler = quakealert.SinkHandler(quakealert.FileSink(filename))
+    handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)-8s %(message)s",
+            '%a, %d %b %Y %H:%M:%S'))
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+
+
+def output(out, line, key=None):
+    # `out' is a quakealert.Sink, None to print synchronously
+    if out is None:
+        print line
     else:
-        buf += worddict[locale]['EMSn'] 
-    if m['geo']:
-        if len(m['geo']) == 2:
-            buf += ' [%s,%s]' % (m['geo'][0], m['geo'][1])
-    return buf
+        out.emit(line, key)
 
 
-def main(client):
+def main(client, pool=None, journal=None, out=None):
     MAX_CONN_ERROR = 60 
     MAX_ERROR = 30 
 
@@ -97,6 +81,8 @@ def main(client):
         mesg = client.process()
         if mesg is None:
             continue
+        if journal is not None:
+            journal.write(mesg)
         alert = quakealert.QAlert(mesg)
         ts = alert.timestamp()
         if not alert.is_effective():
@@ -107,34 +93,69 @@ def main(client):
         elif alert.is_decode_message():
             buf = alert.printable_decode_message()
             logging.info("decode message recieved:%s", buf.replace('\n', ' ')) 
-            print "[%s] decode message:" % (ts)
-            print buf
+            output(out, "[%s] decode message:\n%s" % (ts, buf))
         elif alert.is_code_message():
             buf = alert.code_message()
             logging.info("code message recieved:%s",buf) 
-            print "[%s] code message: %s" % (ts, buf)
             p = quakealert.Parser(alert.message_type, buf)
-            if p.is_first() or p.is_last():
-                qa = p.dump()
-                for locale in ('ja', 'en', 'fr', 'kr'):
-                    buf = format_code_message(qa, locale=locale)
+            # a backlog keeps only the latest report of each event
+            output(out, "[%s] code message: %s" % (ts, buf), p.id())
+            if pool is not None:
+                pm = p.parse()
+                if pm.is_first() or pm.is_last():
+                    pool.submit(pm, alert)
+            elif p.is_first() or p.is_last():
+                lines = renderer.render(p.parse())
+                for locale in renderer.locales:
                     logging.info("formatted code message(locale:%s):%s", 
-                            locale,buf)
+                            locale, lines[locale])
         else:
             logging.info("unknown message type recieved: %s",
                     alert.typestr.encode('hex'))
-            logging.info("---raw buffer---\n:%s", alert.dump_rawbuf())
+            logging.info("---raw buffer---\n:%s",
+                    quakealert.RawDump(alert.rawmessage))
+
+# distribution server: fill in before running
+QA_SERVER = '<server IP addr>'
+QA_PORT = 0     # <server port>
+# answer healthcheck/checkpoint requests from a dedicated I/O thread, so
+# that logging and formatting of an alert never delay the replies
+QA_IO_THREAD = True
+# keep a second session established and switch over to it at once when
+# the connection is lost
+QA_STANDBY = False
+# pipeline mode: number of worker processes formatting the alerts, 0 to
+# format them in the receiving loop
+QA_WORKERS = 0
+# journal of every received alert (quakealert.Journal), query it with
+# qa-journal.py.  None to disable
+QA_JOURNAL = None
+# log file, written through a quakealert.FileSink
+QA_LOG = '/tmp/qa-demo.out'
 
 def daemon_process():
-    client = quakealert.QAClient('<server IP addr>', <server port>) 
+    pool = None
+    if QA_WORKERS:
+        # forked before any thread is started: a lock held by another
+        # thread at fork() would never be released in the workers.  the
+        # workers start their own log sink.
+        pool = quakealert.WorkerPool(render_worker, workers=QA_WORKERS,
+                                     init=lambda: setup_logging(QA_LOG))
+        pool.start()
 
     # initialize logging
-    logging.basicConfig(level=logging.DEBUG,
-            format="%(asctime)s %(levelname)-8s %(message)s",
-            datefmt='%a, %d %b %Y %H:%M:%S',
-            filename='/tmp/qa-demo.out')
+    setup_logging(QA_LOG)
 
-    main(client)
+    if QA_IO_THREAD:
+        client = quakealert.ThreadedQAClient(QA_SERVER, QA_PORT,
+                                             standby=QA_STANDBY)
+        client.start()
+    else:
+        client = quakealert.QAClient(QA_SERVER, QA_PORT, standby=QA_STANDBY)
+    journal = None
+    if QA_JOURNAL:
+        journal = quakealert.Journal(QA_JOURNAL)
+    main(client, pool, journal, quakealert.FileSink(sys.stdout))
 
 if __name__ == "__main__":
     from daemon import DaemonContext
@@ -0,0 +1,85 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+
+# query a journal written by quakealert.Journal (e.g. by qa-demo.py with
+# QA_JOURNAL set).
+#
+#   ./qa-journal.py journal                        number of records
+#   ./qa-journal.py -e 20110311144640 journal      reports of an event
+#   ./qa-journal.py -s '2011-03-11 14:46' -t '2011-03-11 15:00' journal
+#   ./qa-journal.py -r journal                     rebuild the event index
+
+'''
+ * Copyright (c) 2012, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import time
+from datetime import datetime
+from optparse import OptionParser
+import quakealert
+
+def local_time(s):
+    # 'YYYY-mm-dd HH:MM[:SS]' (local time) -> epoch sec
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(datetime.strptime(s, fmt).timetuple())
+        except ValueError:
+            pass
+    raise ValueError('bad time: %s' % s)
+
+def show(rec):
+    recv = datetime.fromtimestamp(rec.recv_time).strftime('%Y-%m-%d %H:%M:%S')
+    alert = rec.alert()
+    if alert.is_code_message():
+        text = alert.code_message()
+    else:
+        text = alert.printable_decode_message().replace('\n', ' ').strip()
+    print "%s %s %s #%s %s" % (recv, rec.message_type, rec.id or '-',
+            rec.alert_seq if rec.alert_seq is not None else '-', text)
+
+def main():
+    op = OptionParser(usage='%prog [-e id] [-s start] [-t end] [-r] journal')
+    op.add_option('-e', '--event', default=None,
+            help='show the records of an event id')
+    op.add_option('-s', '--start', default=None,
+            help='show the records received from (local time)')
+    op.add_option('-t', '--end', default=None,
+            help='show the records received until (local time)')
+    op.add_option('-r', '--reindex', action='store_true', default=False,
+            help='rebuild the event id index')
+    opts, args = op.parse_args()
+    if len(args) != 1:
+        op.error('journal file is required')
+    if opts.reindex:
+        print "%d records indexed" % quakealert.build_event_index(args[0])
+        return
+    journal = quakealert.JournalReader(args[0])
+    if opts.event:
+        records = journal.event(opts.event)
+    elif opts.start or opts.end:
+        try:
+            start = local_time(opts.start) if opts.start else None
+            end = local_time(opts.end) if opts.end else None
+        except ValueError, e:
+            op.error(str(e))
+        records = journal.range(start, end)
+    else:
+        print "%d records" % len(journal)
+        return
+    for rec in records:
+        show(rec)
+
+if __name__ == "__main__":
+    main()
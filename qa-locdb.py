@@ -0,0 +1,36 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+
+# compile the JSON location DB into the memory-mapped index read by
+# quakealert.LocationDB_mmap.
+#
+#   ./qa-locdb.py quakealert/location_l10n.json quakealert/location_l10n.idx
+
+'''
+ * Copyright (c) 2012, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import sys
+import quakealert
+
+def main():
+    if len(sys.argv) != 3:
+        print "usage: %s location.json location.idx" % sys.argv[0]
+        sys.exit(1)
+    count = quakealert.build_location_index(sys.argv[1], sys.argv[2])
+    print "%s: %d location codes" % (sys.argv[2], count)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+
+# local distribution server for testing quakealert clients.
+#
+#   ./qa-mockserver.py -p 10000 -r 1000 --split 0.1 --disconnect 0.001
+
+'''
+ * Copyright (c) 2012, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+from optparse import OptionParser
+from time import sleep
+import quakealert
+
+def format_latency(name, st):
+    if st['count'] == 0:
+        return '%s: -' % name
+    return '%s: n=%d mean=%.2fms p50=%.2fms p99=%.2fms max=%.2fms' % (
+            name, st['count'], st['mean'] * 1000, st['p50'] * 1000,
+            st['p99'] * 1000, st['max'] * 1000)
+
+def main():
+    op = OptionParser(usage='%prog [options]')
+    op.add_option('-a', '--addr', default='127.0.0.1')
+    op.add_option('-p', '--port', type='int', default=10000)
+    op.add_option('-r', '--rate', type='float', default=1.0,
+            help='alerts/sec (default: 1)')
+    op.add_option('--mix', default='8,1,1',
+            help='ratio of code,decode,test messages (default: 8,1,1)')
+    op.add_option('--hc-interval', type='float', default=60.0,
+            help='healthcheck interval in sec (default: 60)')
+    op.add_option('--cp-interval', type='float', default=30.0,
+            help='eN checkpoint interval in sec, 0 to disable (default: 30)')
+    op.add_option('--no-checkpoint', action='store_true', default=False,
+            help='send alerts as AN instead of aN')
+    op.add_option('--ebi-max', type='int', default=300,
+            help='number of EBI areas in the last report (default: 300)')
+    op.add_option('--split', type='float', default=0.0,
+            help='probability to split a frame into several segments')
+    op.add_option('--stall', type='float', default=0.0,
+            help='probability to stall the stream before a frame')
+    op.add_option('--stall-time', type='float', default=5.0)
+    op.add_option('--disconnect', type='float', default=0.0,
+            help='probability to disconnect in the middle of a frame')
+    op.add_option('-i', '--interval', type='float', default=10.0,
+            help='statistics report interval in sec (default: 10)')
+    opts, args = op.parse_args()
+    logging.basicConfig(level=logging.INFO,
+            format="%(asctime)s %(levelname)-8s %(message)s")
+
+    server = quakealert.QAMockServer(opts.addr, opts.port, rate=opts.rate,
+            mix=[int(x) for x in opts.mix.split(',')],
+            hc_interval=opts.hc_interval, cp_interval=opts.cp_interval,
+            checkpoint=not opts.no_checkpoint, ebi_max=opts.ebi_max,
+            split=opts.split, stall=opts.stall, stall_time=opts.stall_time,
+            disconnect=opts.disconnect)
+    logging.info('listening on %s:%s', server.host, server.port)
+    server.start()
+    try:
+        while(1):
+            sleep(opts.interval)
+            st = server.stats()
+            server.reset_stats()
+            logging.info('clients:%d frames:%d alerts:%d (%.1f/s) '
+                    'checkpoints:%d acks:%d missing:%d bogus:%d splits:%d '
+                    'stalls:%d disconnects:%d connections:%d', st['clients'],
+                    st['frames'], st['alerts'], st['alerts'] / opts.interval,
+                    st['checkpoints'], st['acks'], st['ack_missing'],
+                    st['ack_bogus'],
+                    st['splits'], st['stalls'], st['disconnects'],
+                    st['connections'])
+            logging.info(format_latency('ack latency', st['ack_latency']))
+            logging.info(format_latency('reconnect',
+                                        st['reconnect_latency']))
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2.7
+# -*- coding:utf-8 -*-
+
+# replay a recording made with quakealert.QARecorder through the same
+# processing as qa-demo.py.  with -s 0 (max speed) it reports the
+# throughput of the QAlert -> Parser -> formatting pipeline.
+#
+#   ./qa-replay.py [-s speed] [-v] recording
+
+'''
+ * Copyright (c) 2012, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import imp
+import logging
+import os
+from optparse import OptionParser
+from time import time
+import quakealert
+
+demo = imp.load_source('qa_demo',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qa-demo.py'))
+
+def replay(client, verbose=False):
+    count = dict(alert=0, code=0, decode=0, test=0, formatted=0)
+    for mesg in client:
+        count['alert'] += 1
+        alert = quakealert.QAlert(mesg)
+        if alert.is_test_message():
+            count['test'] += 1
+            buf = alert.printable_decode_message()
+        elif alert.is_decode_message():
+            count['decode'] += 1
+            buf = alert.printable_decode_message()
+        elif alert.is_code_message():
+            count['code'] += 1
+            buf = alert.code_message()
+            p = quakealert.Parser(alert.message_type, buf)
+            qa = p.dump()
+            for locale in ('ja', 'en', 'fr', 'kr'):
+                buf = demo.format_code_message(qa, locale=locale)
+                count['formatted'] += 1
+        else:
+            continue
+        if verbose:
+            print buf
+    return count
+
+def main():
+    op = OptionParser(usage='%prog [-s speed] [-v] recording')
+    op.add_option('-s', '--speed', type='float', default=0.0,
+            help='replay speed, 1 for real time, 0 for max speed (default)')
+    op.add_option('-v', '--verbose', action='store_true', default=False)
+    opts, args = op.parse_args()
+    if len(args) != 1:
+        op.error('recording file is required')
+    logging.basicConfig(level=logging.INFO,
+            format="%(asctime)s %(levelname)-8s %(message)s")
+    client = quakealert.QAReplay(args[0], speed=opts.speed)
+    start = time()
+    count = replay(client, opts.verbose)
+    elapsed = time() - start
+    print "%d frames, %d alerts (code:%d decode:%d test:%d) in %.3f sec" % (
+            client.frames, count['alert'], count['code'], count['decode'],
+            count['test'], elapsed)
+    if elapsed > 0:
+        print "%.1f alerts/sec, %.1f formatted messages/sec" % (
+                count['alert'] / elapsed, count['formatted'] / elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -18,63 +18,121 @@
  * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 '''
 
+import binascii
 import json
 import logging
+import os
 import re
 import socket
 import struct
 import sys
 import unicodedata
-from datetime import datetime,timedelta
+from collections import deque, namedtuple
+from datetime import datetime
 from decimal import Decimal
-from string import ascii_letters, digits, punctuation
-from time import sleep
-
-def dump_rawbuf(rawbuf):
-    index = 0
-    size = 16
-    hexformat  = '{0:' + str(size*3) + '}'
-    charformat = '{0:' + str(size) + '}'
-    result = []
-    if len(rawbuf) < size:
-            size = len(rawbuf)
-    while (index < len(rawbuf)):
-        buf = []
-        cbuf= []
-        for i in range(size):    
-            t = rawbuf[index + i]
-            buf.append(t.encode('hex') + ' ')
-            if (t in ascii_letters or t in digits or 
-                t in punctuation or t == ' '):
-                cbuf.append(t)
-            else:
-                cbuf.append('.')
-        result.append(hexformat.format(''.join(buf)))
-        result.append('|')
-        result.append(charformat.format(''.join(cbuf)))
-        result.append('|\n')
-        index += size
-        if len(rawbuf) - index < size:
-            size = len(rawbuf) - index
-    return ''.join(result)
+from time import sleep, time
+# datetime.strptime() imports _strptime on its first call, which fails in
+# a thread while another one holds the import lock; QAlert parses its time
+# stamp lazily, possibly in any thread
+import _strptime
+
+# stage timing hooks of the parsing classes, see set_metrics()
+_metrics = None
+
+def set_metrics(metrics):
+    '''
+    record the QAlert() and parse() durations to a quakealert.Metrics
+    (None to disable).
+    '''
+    global _metrics
+    _metrics = metrics
+
+# hex dump: '00 11 22 ... |printable chars|' lines of 16 bytes
+_DUMP_CHARS = ''.join(chr(c) if 0x20 <= c < 0x7f else '.' for c in range(256))
+
+def iter_rawbuf(rawbuf, size=16):
+    # 'xx ' per byte: the hexlified digits spread over every third byte
+    h = binascii.hexlify(rawbuf)
+    hexstr = bytearray(' ' * (len(rawbuf) * 3))
+    hexstr[0::3] = h[0::2]
+    hexstr[1::3] = h[1::2]
+    hexstr = str(hexstr)
+    chars = rawbuf.translate(_DUMP_CHARS)
+    width = size * 3
+    line = '%%-%ds|%%-%ds|\n' % (width, size)
+    for i in xrange(0, len(rawbuf), size):
+        yield line % (hexstr[i * 3:i * 3 + width], chars[i:i + size])
+
+def dump_rawbuf(rawbuf, out=None):
+    '''
+    hex dump of rawbuf.  returns the dump, or writes it to `out' (a file)
+    and returns None.
+    '''
+    if out is None:
+        return ''.join(iter_rawbuf(rawbuf))
+    out.writelines(iter_rawbuf(rawbuf))
+
+# hex dump formatted only when converted to a string, e.g. as a logging
+# argument which is not formatted if the level is disabled:
+#
+#   logging.debug('raw buffer:\n%s', RawDump(body))
+class RawDump(object):
+    def __init__(self, rawbuf):
+        self.rawbuf = rawbuf
+
+    def __str__(self):
+        return dump_rawbuf(self.rawbuf)
+
+def dump_frame(mesg, out=None):
+    '''
+    hex dump of a received frame to `out': a logging.Logger (at DEBUG
+    level), a file or sys.stdout (None, True).
+    '''
+    if isinstance(out, logging.Logger):
+        out.debug("=====debug====== (header part)\n%s---(body part)---\n%s",
+                RawDump(mesg.header), RawDump(mesg.body))
+        return
+    if not hasattr(out, 'write'):
+        out = sys.stdout
+    out.write("=====debug====== (header part)\n")
+    dump_rawbuf(mesg.header, out)
+    out.write("\n---(body part)---\n")
+    dump_rawbuf(mesg.body, out)
+    out.write("\n")
+    out.flush()
+
+# message type -> (control, alert, checkpoint reply required)
+QA_MESSAGE_TYPES = {
+    'EN': (True, False, False),
+    'eN': (True, False, True),
+    'AN': (False, True, False),
+    'aN': (False, True, True),
+}
+_QA_OTHER_TYPE = (False, False, False)
 
 class QAMessage(object):
+    __slots__ = ('header', 'body', 'bodylength', 'type', '__flags',
+                 'header_time', 'body_time')
+    QA_COOKIE_LEN = 30
+    QA_LENGTH_LEN = 8
+    # reply buffers are built once per message type
+    _healthcheck_replies = {}
+    _checkpoint_heads = {}
+
     def __init__(self, header, body=None):
-        self.QA_COOKIE_LEN = 30
-        self.QA_LENGTH_LEN = 8
         self.header = header
         self.body = body
-        m = re.match('(\d+)(\w+)', header)
-        if m == None:
+        # fixed format: 8 digits of body length followed by 2 chars of type
+        length = header[:8]
+        mtype = header[8:]
+        if len(header) != 10 or not length.isdigit() or not mtype.isalnum():
             print "unknown header?: %s" % header.encode('hex')
             raise ValueError
-        if (m.end() != 10):
-            raise ValueError
-        if (m.group(1).isdigit()):
-            self.bodylength = int(m.group(1))
-        else:
-            return None
-        self.type = m.group(2)
+        self.bodylength = int(length)
+        self.type = mtype
+        self.__flags = QA_MESSAGE_TYPES.get(mtype, _QA_OTHER_TYPE)
+        # stamped by QAProtocol while a clock is set
+        self.header_time = self.body_time = None
 
     def body_length(self):
         return self.bodylength
@@ -92,16 +150,10 @@ class QAMessage(object):
         return str(len).zfill(self.QA_LENGTH_LEN) + mesg_type
 
     def is_ctrl_message(self):
-        if re.match('EN|eN', self.type):
-            return True
-        else:
-            return False
+        return self.__flags[0]
 
     def is_alert_message(self):
-        if re.match('AN|aN', self.type):
-            return True
-        else:
-            return False
+        return self.__flags[1]
 
     def is_healthcheck_request(self):
         if (self.body != None and self.body == 'chk'):
@@ -110,46 +162,232 @@ class QAMessage(object):
             return False
 
     def healthcheck_reply(self):
-        body = "CHK"
-        head = self.build_header(len(body))
-        return head + body
+        reply = self._healthcheck_replies.get(self.type)
+        if reply is None:
+            body = "CHK"
+            reply = self.build_header(len(body)) + body
+            self._healthcheck_replies[self.type] = reply
+        return reply
 
     def is_require_checkpoint_reply(self):
-        if re.match('aN|eN', self.type):
-            return True
-        else:
-            return False
+        return self.__flags[2]
 
     def checkpoint_reply(self):
         if self.body is None:
             return None
+        cookie = self.body[0:self.QA_COOKIE_LEN]
+        if len(cookie) == self.QA_COOKIE_LEN:
+            head = self._checkpoint_heads.get(self.type)
+            if head is None:
+                head = self.build_header(3 + self.QA_COOKIE_LEN) + 'ACK'
+                self._checkpoint_heads[self.type] = head
+            return head + cookie
         else:
-            cp_body = 'ACK'
-            cp_body += self.body[0:self.QA_COOKIE_LEN]
+            cp_body = 'ACK' + cookie
             head = self.build_header(len(cp_body))
             return head + cp_body
 
+# transport independent framing of the QA stream.
+#
+# bytes read from the server are accumulated in one reusable bytearray and
+# complete frames are cut out of it with memoryview slices, so a body split
+# over several TCP segments is reassembled and several coalesced frames are
+# returned from a single read.
+#
+#   proto = QAProtocol()
+#   for mesg in proto.feed(data):    # or proto.recv_into(so)
+#       ...                          # mesg is a QAMessage with its body
+class QAProtocol(object):
+    def __init__(self, bufsize=65536):
+        self.QA_HEADER_LEN = 10
+        self.QA_LENGTH_LEN = 8
+        self.bufsize = bufsize
+        self.bogus_headers = 0
+        self.broken = False
+        # set a clock (e.g. time.time) to stamp header_time/body_time
+        self.clock = None
+        self.reset()
+
+    def reset(self):
+        self.__buf = bytearray(self.bufsize)
+        self.__view = memoryview(self.__buf)
+        self.__start = 0
+        self.__end = 0
+        self.__need = self.QA_HEADER_LEN
+        self.__header_time = None
+        self.broken = False
+
+    def pending(self):
+        return self.__end - self.__start
+
+    def __reserve(self, size):
+        # make room for at least `size' bytes after the buffered data
+        used = self.__end - self.__start
+        if self.__end + size <= len(self.__buf):
+            return
+        if used + size <= len(self.__buf):
+            self.__buf[0:used] = self.__view[self.__start:self.__end]
+        else:
+            # the bytearray can not be resized while the view is exported
+            buf = bytearray(max(used + size, 2 * len(self.__buf)))
+            buf[0:used] = self.__view[self.__start:self.__end]
+            self.__buf = buf
+            self.__view = memoryview(buf)
+        self.__start = 0
+        self.__end = used
+
+    def recv_into(self, so):
+        '''
+        read from the socket directly into the buffer.  returns the list of
+        complete frames, or None if the peer has closed the connection.
+        '''
+        self.__reserve(max(self.__need - self.pending(), 4096))
+        n = so.recv_into(self.__view[self.__end:])
+        if n == 0:
+            return None
+        self.__end += n
+        return self.__frames()
+
+    def feed(self, data):
+        self.__reserve(len(data))
+        self.__buf[self.__end:self.__end + len(data)] = data
+        self.__end += len(data)
+        return self.__frames()
+
+    def __bogus(self, header):
+        logging.info('bogus header: %s', header.encode('hex'))
+        self.bogus_headers += 1
+        # framing is lost, nothing after this point can be trusted
+        self.__start = self.__end = 0
+        self.__need = self.QA_HEADER_LEN
+        self.broken = True
+
+    def __frames(self):
+        frames = []
+        view = self.__view
+        hlen = self.QA_HEADER_LEN
+        now = self.clock() if self.clock is not None else None
+        while self.__end - self.__start >= hlen:
+            s = self.__start
+            length = view[s:s + self.QA_LENGTH_LEN].tobytes()
+            if not length.isdigit():
+                self.__bogus(view[s:s + hlen].tobytes())
+                break
+            end = s + hlen + int(length)
+            if end > self.__end:
+                self.__need = end - s
+                if self.__header_time is None:
+                    self.__header_time = now
+                break
+            try:
+                mesg = QAMessage(view[s:s + hlen].tobytes(),
+                                 view[s + hlen:end].tobytes())
+            except ValueError:
+                self.__bogus(view[s:s + hlen].tobytes())
+                break
+            if now is not None:
+                mesg.header_time = self.__header_time or now
+                mesg.body_time = now
+                self.__header_time = None
+            frames.append(mesg)
+            self.__start = end
+            self.__need = hlen
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
+        return frames
+
+_LINE_BREAK = re.compile('\r\n|\r|\n')
+
+# an alert body:
+#
+#   line 0      header (cookie)
+#   line 1      type (QA_*_MAGIC)
+#   line 3      basic code: type, origin, drill, time stamp, character
+#   line 4-     message
+#
+# only the offsets of the lines are kept with the body; the lines and the
+# basic code fields are cut out and decoded when they are first used.
 class QAlert(object):
+    __slots__ = ('rawmessage', '__kind', '__typestr', '__basic', '__message',
+                 '__fields', '__time_stamp', '__text', '__printable')
+    QA_CODE_MAGIC   = '\xc5\xb3\xb7\xd4\xbd\xc43 \xb7\xbc\xd6\xb3'
+    QA_DECODE_MAGIC = '\xc5\xb3\xb7\xd4\xbd\xc44 \xb7\xbc\xd6\xb3'
+    QA_TEST_MAGIC   = '\xc5\xb3\xb7\xd4\xbd\xc4\xc3\xbd\xc41 \xb7\xbc\xd6\xb3'
+    QA_TEST2_MAGIC  = '\xc5\xb3\xb7\xd4\xbd\xc4\xc3\xbd\xc491 \xb7\xbc\xd6\xb3'
+    QA_KINDS = {QA_CODE_MAGIC: 'code', QA_DECODE_MAGIC: 'decode',
+                QA_TEST_MAGIC: 'test', QA_TEST2_MAGIC: 'test'}
+
     def __init__(self, body):
-        self.QA_CODE_MAGIC   = '\xc5\xb3\xb7\xd4\xbd\xc43 \xb7\xbc\xd6\xb3'
-        self.QA_DECODE_MAGIC = '\xc5\xb3\xb7\xd4\xbd\xc44 \xb7\xbc\xd6\xb3'
-        self.QA_TEST_MAGIC   = '\xc5\xb3\xb7\xd4\xbd\xc4\xc3\xbd\xc41 \xb7\xbc\xd6\xb3'
-        self.QA_TEST2_MAGIC  = '\xc5\xb3\xb7\xd4\xbd\xc4\xc3\xbd\xc491 \xb7\xbc\xd6\xb3'
+        if _metrics is not None:
+            t = _metrics.clock()
         self.rawmessage = body
-        b = body.splitlines()
-        self.header = b[0]
-        self.typestr = b[1]
-        self.basic = b[3]
-        self.message = b[4:]
-        self.decode_basic_code()
+        # start of lines 1-4
+        starts = []
+        for m in _LINE_BREAK.finditer(body):
+            starts.append(m.end())
+            if len(starts) == 4:
+                break
+        else:
+            # the basic code is the last line
+            starts.append(len(body))
+        if len(starts) < 4 or starts[2] == len(body):
+            raise IndexError('not an alert body')
+        self.__typestr = starts[0]
+        self.__basic = starts[2]
+        self.__message = starts[3]
+        self.__kind = self.QA_KINDS.get(self.typestr)
+        self.__fields = None
+        self.__time_stamp = None
+        self.__text = None
+        self.__printable = None
+        if _metrics is not None:
+            _metrics.observe('qalert', _metrics.clock() - t)
+
+    @property
+    def header(self):
+        return self.rawmessage[:self.__typestr].rstrip('\r\n')
+
+    @property
+    def typestr(self):
+        return self.rawmessage[self.__typestr:self.__basic].splitlines()[0]
+
+    @property
+    def basic(self):
+        return self.rawmessage[self.__basic:self.__message].rstrip('\r\n')
+
+    @property
+    def message(self):
+        return self.rawmessage[self.__message:].splitlines()
 
     def decode_basic_code(self):
-        b = self.basic.split()
-        self.time_stamp = datetime.strptime(b[3], "%y%m%d%H%M%S")
-        self.message_type = b[0]
-        self.data_origin  = b[1]
-        self.drill        = b[2]
-        self.character    = b[4]
+        if self.__fields is None:
+            b = self.basic.split()
+            self.__fields = (b[0], b[1], b[2], b[3], b[4])
+        return self.__fields
+
+    @property
+    def message_type(self):
+        return (self.__fields or self.decode_basic_code())[0]
+
+    @property
+    def data_origin(self):
+        return (self.__fields or self.decode_basic_code())[1]
+
+    @property
+    def drill(self):
+        return (self.__fields or self.decode_basic_code())[2]
+
+    @property
+    def time_stamp(self):
+        if self.__time_stamp is None:
+            self.__time_stamp = datetime.strptime(
+                    (self.__fields or self.decode_basic_code())[3],
+                    "%y%m%d%H%M%S")
+        return self.__time_stamp
+
+    @property
+    def character(self):
+        return (self.__fields or self.decode_basic_code())[4]
 
     def is_effective(self):
         if self.drill == '00':
@@ -157,9 +395,7 @@ class QAlert(object):
         return False
 
     def is_alert(self):
-        if re.match('35|36|37', self.message_type):
-            return True
-        return False
+        return self.message_type[:2] in ('35', '36', '37')
 
     def is_test(self):
         if self.message_type == '38':
@@ -172,20 +408,13 @@ class QAlert(object):
         return False
 
     def is_code_message(self):
-        if self.typestr == self.QA_CODE_MAGIC:
-            return True
-        return False
+        return self.__kind == 'code'
 
-    def is_decode_message(self):    
-        if self.typestr == self.QA_DECODE_MAGIC:
-            return True
-        return False
+    def is_decode_message(self):
+        return self.__kind == 'decode'
 
     def is_test_message(self):
-        if self.typestr == self.QA_TEST_MAGIC or \
-           self.typestr == self.QA_TEST2_MAGIC:
-            return True
-        return False    
+        return self.__kind == 'test'
 
     def timestamp(self):
         return self.time_stamp
@@ -198,51 +427,37 @@ class QAlert(object):
         return ''.join(buf).rstrip()
 
     def decode_message(self):
-        buf = []
-        if self.is_decode_message() or self.is_test_message():
-            for i in self.message[1:-2]:
-                buf.append(unicode(i, 'shift-jis') + '\n')
-        return unicodedata.normalize('NFKC', ''.join(buf))
+        # decoded once, on the first call
+        if self.__text is None:
+            lines = []
+            if self.is_decode_message() or self.is_test_message():
+                lines = self.message[1:-2]
+            if lines:
+                lines.append('')
+            self.__text = unicodedata.normalize('NFKC',
+                    unicode('\n'.join(lines), 'shift-jis'))
+        return self.__text
 
     def printable_decode_message(self):
-        return self.decode_message().replace(' ','').encode('utf-8')
+        if self.__printable is None:
+            self.__printable = \
+                self.decode_message().replace(' ','').encode('utf-8')
+        return self.__printable
 
     def dump_rawbuf(self):
-        index = 0
-        size = 16
-        hexformat  = '{0:' + str(size*3) + '}'
-        charformat = '{0:' + str(size) + '}'
-        result = []
-        if len(self.rawmessage) < size:
-                size = len(self.rawmessage)
-        while (index < len(self.rawmessage)):
-            buf = []
-            cbuf= []
-            for i in range(size):    
-                t = self.rawmessage[index + i]
-                buf.append(t.encode('hex') + ' ')
-                if (t in ascii_letters or t in digits or 
-                    t in punctuation or t == ' '):
-                    cbuf.append(t)
-                else:
-                    cbuf.append('.')
-            result.append(hexformat.format(''.join(buf)))
-            result.append('|')
-            result.append(charformat.format(''.join(cbuf)))
-            result.append('|\n')
-            index += size
-            if len(self.rawmessage) - index < size:
-                size = len(self.rawmessage) - index
-        return ''.join(result)
+        return dump_rawbuf(self.rawmessage)
 
 
+def _is_location_code(codestr):
+    return codestr is not None and len(codestr) >= 3 and codestr[:3].isdigit()
+
 # location code translator: use this class if you dont'have DB file
 class LocationDB(object):
     def __init__(self):
         self.__loaded = False
 
     def lookup(self, codestr, type='any'):
-        if not re.match('\d{3}', codestr):
+        if not _is_location_code(codestr):
             logging.debug('location code error: %s', codestr)
             return None
         if type=='any':
@@ -255,7 +470,8 @@ class LocationDB(object):
 
 # real location code translator: use this class if you have location DB.
 class LocationDB_real(object):
-    def __init__(self, json_file_name='quakealert/location_l10n.json'):
+    def __init__(self, json_file_name=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'location_l10n.json')):
         self.dbfile = json_file_name
         self.__loaded = False
 
@@ -276,7 +492,7 @@ class LocationDB_real(object):
     def lookup(self, codestr, type='any'):
         if not self.__loaded:
             self.__loaddict()
-        if not re.match('\d{3}', codestr):
+        if not _is_location_code(codestr):
             logging.debug('location code error: %s', codestr)
             return None
         try:
@@ -293,34 +509,157 @@ class LocationDB_real(object):
             return None
 
 
-class Parser(object):
-    def __init__(self, message_type, codestr):
-        self.codestr = codestr
-        self.code = self.codestr.split(' ', 14)
-        self.message_type = message_type
-        self.rep = re.compile('([A-Z]+)([\d/]+)')
-        self._ldb = LocationDB()
+_GEO_RE = re.compile('([NSEW])(\d+)')
+_CODE_RE = re.compile('([A-Z]+)([\d/]+)')
+
+def decode_timestamp(s):
+    # fixed format "%y%m%d%H%M%S" without going through strptime
+    if len(s) != 12 or not s.isdigit():
+        raise ValueError('bad timestamp: %s' % s)
+    year = int(s[0:2])
+    year += 2000 if year < 69 else 1900
+    return datetime(year, int(s[2:4]), int(s[4:6]),
+                    int(s[6:8]), int(s[8:10]), int(s[10:12]))
+
+def _tenths_str(v):
+    # integer tenths -> '%3.1f' string
+    if v < 0:
+        return '-%d.%d' % divmod(-v, 10)
+    return '%d.%d' % divmod(v, 10)
+
+def _leading_int(s, start=0):
+    # integer value of the leading digits of s[start:], or None
+    end = start
+    while end < len(s) and s[end].isdigit():
+        end += 1
+    if end == start:
+        return None
+    return int(s[start:end])
+
+
+# result of a single pass parse of a code message.
+#
+# lat, lon and magnitude are kept as integer tenths (N38.1 -> 381,
+# W12.5 -> -125, M6.6 -> 66).  dump() gives the same dictionary as
+# Parser.dump().
+class ParsedEEW(namedtuple('ParsedEEW', 'message_type id timestamp '
+        'alert_condition alert_seq location_code lat lon depth magnitude '
+        'max_seismic rk area rc ebistr')):
+    __slots__ = ()
 
-    def dump(self):
+    def is_last(self):
+        return self.alert_condition == '9'
+
+    def is_first(self):
+        return self.alert_condition != '9' and self.alert_seq == 1
+
+    def geo(self):
+        if self.lat is None or self.lon is None:
+            return []
+        return [_tenths_str(self.lat), _tenths_str(self.lon)]
+
+    def magnitude_str(self):
+        if self.magnitude is not None:
+            return _tenths_str(self.magnitude)
+
+    def ebi(self):
+        if self.ebistr:
+            return self.ebi_table().records()
+
+    def ebi_table(self):
+        return EBITable(self.ebistr, self.timestamp)
+
+    def dump(self, ldb=None):
         d = {}
         d['message_type'] = self.message_type
-        d['id'] = self.id()    
-        d['timestamp'] = self.timestamp()
+        d['id'] = self.id
+        d['timestamp'] = self.timestamp
         d['is_last'] = self.is_last()
         d['is_first'] = self.is_first()
-        d['alert_seq'] = self.alert_seq()
-        d['location_code'] = self.location_code()
-        d['location_str'] = self._ldb.lookup(self.location_code())
+        d['alert_seq'] = self.alert_seq
+        d['location_code'] = self.location_code
+        if ldb is not None and self.location_code is not None:
+            d['location_str'] = ldb.lookup(self.location_code)
+        else:
+            d['location_str'] = None
         d['geo'] = self.geo()
-        d['depth'] = self.depth()
-        d['magnitude'] = self.magnitude()
-        d['max_seismic'] = self.max_seismic()
-        d['area'] = self.area()
-        d['rk'] = self.rk()
-        d['rc'] = self.rc()
+        d['depth'] = self.depth
+        d['magnitude'] = self.magnitude_str()
+        d['max_seismic'] = self.max_seismic
+        d['area'] = self.area
+        d['rk'] = self.rk
+        d['rc'] = self.rc
         d['ebi'] = self.ebi()
         return d
 
+
+def parse(message_type, codestr):
+    '''
+    tokenize a code message once and return a ParsedEEW.
+    '''
+    if _metrics is not None:
+        t = _metrics.clock()
+    code = codestr.split(' ', 14)
+    c = code[1]
+    eid = c[2:] if c[:2] == 'ND' and c[2:3].isdigit() else None
+    c = code[2]
+    cond = seq = None
+    if c[:3] == 'NCN':
+        if c[3:4].isdigit():
+            cond = c[3]
+        seq = _leading_int(c, 4)
+    c = code[5]
+    location = c if len(c) >= 3 and c[:3].isdigit() else None
+    c = code[6]
+    lat = _leading_int(c, 1) if c[:1] in ('N', 'S') else None
+    if lat is not None and c[0] == 'S':
+        lat = -lat
+    c = code[7]
+    lon = _leading_int(c, 1) if c[:1] in ('N', 'S', 'E', 'W') else None
+    if lon is not None and c[0] == 'W':
+        lon = -lon
+    c = code[10]
+    if message_type == '35' or c == '//':
+        seismic = None
+    elif c in ('01', '02', '03', '04', '07'):
+        seismic = c[1]
+    else:
+        seismic = c
+    c = code[11]
+    rk = c[2:] if c[:2] == 'RK' else None
+    c = code[12]
+    area = int(c[2]) if c[:2] == 'RT' and c[2:3] in ('0', '1') else None
+    c = code[13]
+    rc = c[2:] if c[:2] == 'RC' else None
+    ebistr = None
+    if len(code) > 14 and code[14][:3] == 'EBI':
+        ebistr = code[14][3:].strip() or None
+    p = ParsedEEW(message_type, eid, decode_timestamp(code[0]), cond, seq,
+                  location, lat, lon, _leading_int(code[8]),
+                  _leading_int(code[9]), seismic, rk, area, rc, ebistr)
+    if _metrics is not None:
+        _metrics.observe('parse', _metrics.clock() - t)
+    return p
+
+
+_default_ldb = LocationDB()
+
+class Parser(object):
+    def __init__(self, message_type, codestr, ldb=None):
+        self.codestr = codestr
+        self.code = self.codestr.split(' ', 14)
+        self.message_type = message_type
+        self.rep = _CODE_RE
+        # location DBs are shared, pass LocationDB_real/LocationDB_mmap
+        # to get the location names
+        self._ldb = ldb if ldb is not None else _default_ldb
+
+    def parse(self):
+        return parse(self.message_type, self.codestr)
+
+    def dump(self):
+        return self.parse().dump(self._ldb)
+
     def timestamp(self):
         return datetime.strptime(self.code[0], "%y%m%d%H%M%S")
 
@@ -366,9 +705,8 @@ class Parser(object):
 
     def geo(self):
         g = []
-        rp = re.compile('([NSEW])(\d+)')
-        m_lat = rp.match(self.__latitude())
-        m_long = rp.match(self.__longitude())
+        m_lat = _GEO_RE.match(self.__latitude())
+        m_long = _GEO_RE.match(self.__longitude())
         if m_lat is None or m_long is None:
             return g
         latitude = Decimal(m_lat.group(2)) / Decimal(10)
@@ -429,12 +767,14 @@ class Parser(object):
     def ebi(self):
         if not self.__ebistr():
             return None
-        ebi = ebi_parser(self.__ebistr()).ebi
+        return ebi_parser(self.__ebistr(), self.timestamp()).ebi
 
 
 class ebi_parser(object):
-    def __init__(self, str):
+    def __init__(self, str, base=None):
+        # base: report time, gives the date of the arrival times
         self.rawstr = str
+        self.base = base
         self.records = 0
         self.ebi = []
         s = self.rawstr.split()
@@ -466,12 +806,7 @@ class ebi_parser(object):
                     if m.group(i) != '//':
                         seismic.append(m.group(i))
         ebi['seismic'] = seismic
-        if re.match('\d{6}', list[2]):
-            t = datetime.today()
-            d = datetime.strptime('093032',"%H%M%S")
-            ebi['timestamp'] = d.replace(t.year, t.month, t.day)
-        else:
-            ebi['timestamp'] = None
+        ebi['timestamp'] = arrival_time(arrival_seconds(list[2]), self.base)
         if list[3] == '//':
             ebi['condition'] = None
         else:
@@ -488,8 +823,24 @@ class ebi_parser(object):
         return ebi
 
 
+# blocking QA client.
+#
+# connection attempts are raced over the addresses of the server (see
+# quakealert.connect.happy_eyeballs).  with standby=True a second session
+# is kept established in the background and promoted as soon as the
+# primary one is lost, without the reconnect wait; the alerts the standby
+# received and the primary did not are handed out after the promotion.
+#
+#   client = quakealert.QAClient('<server>', <port>, standby=True)
+#   while(1):
+#       mesg = client.process()
 class QAClient(object):
-    def __init__(self, server, port, srcaddr=None):
+    # counters() which only grow, exported as Prometheus counters
+    MONOTONIC_COUNTERS = ('reconnects', 'failovers', 'recovered_alerts',
+                          'bogus_headers', 'link_deadline_misses',
+                          'standby_connects', 'standby_buffered_alerts')
+
+    def __init__(self, server, port, srcaddr=None, standby=False):
         self.QA_HEADER_LEN = 10
         self.TIMEOUT = 120.0
         self.server = server
@@ -501,11 +852,31 @@ class QAClient(object):
         self.last_healthcheck_recved = None
         self.srcaddr = srcaddr
         self.verbose = None
+        self.recorder = None
+        self.metrics = None
+        self.metrics_name = None
+        self.connects = 0
+        self.failovers = 0
+        self.recovered_alerts = 0
+        self.KEEPALIVE = dict(KEEPALIVE)
+        self.health = LinkHealth()
+        self.standby = None
+        if standby:
+            self.standby = StandbySession(server, port, srcaddr, self.TIMEOUT)
+        self.__proto = QAProtocol()
+        self.__alerts = deque()
+        # time of the read the frames being handled came from
+        self.__recv_time = None
+        # alert_key() of the alerts queued lately, to tell which of the
+        # alerts kept by the standby the primary missed
+        self.__seen = deque(maxlen=256)
 
     def __connect(self):
         if (self.connected):
             logging.debug("already connected")
             return True
+        if self.__promote():
+            return True
         # exponencial backoff (up to 60 sec)
         if self.connect_err_count > 0:
             waittime = 2 ** self.connect_err_count
@@ -513,95 +884,121 @@ class QAClient(object):
                 waittime = 60
             logging.error("connection error, wait %s sec", waittime)
             sleep (waittime)
-        for res in socket.getaddrinfo(self.server, self.port, socket.AF_UNSPEC,
-                socket.SOCK_STREAM):
-            af, socktype, proto, canonname, sa = res
-            try:
-                self.so = socket.socket(af, socktype, proto)
-            except socket.error, e:
-                self.so = None
-                logging.error("socket error:%s", e)
-                continue
-            try:
-                self.so.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                self.so.settimeout(self.TIMEOUT)
-                if self.srcaddr != None:
-                    if af == socket.AF_INET:
-                        ''' XXX, supporting ipv4 only, fix it '''
-                        self.so.bind((self.srcaddr, 54322))
-                self.so.connect(sa)
-            except socket.error, e:
-                self.so.close()
-                logging.error("socket error:%s", e)
-                self.so = None
-                continue
-            else:
-                sa, sp = self.so.getsockname()
-                pa, pp = self.so.getpeername()
-                print "connected %s:%s -> %s:%s" % (sa, sp, pa, pp) 
-            break
+        try:
+            self.so = happy_eyeballs(self.server, self.port, self.srcaddr,
+                                     54322, self.TIMEOUT)
+        except socket.error, e:
+            logging.error("socket error:%s", e)
+            self.so = None
+        else:
+            sa, sp = self.so.getsockname()[:2]
+            pa, pp = self.so.getpeername()[:2]
+            print "connected %s:%s -> %s:%s" % (sa, sp, pa, pp) 
         if self.so is None:
             logging.error("could not open socket")
             self.connected = False
             return False
         else:
             logging.info("connected")
+            tune_socket(self.so, **self.KEEPALIVE)
+            self.health.connected(time())
+            self.__proto.reset()
+            self.connects += 1
             self.err_count = 0
             self.connected = True
+            if self.standby is not None:
+                self.standby.start()
             return True
 
+    def __promote(self):
+        # switch over to the standby session, if one is established
+        if self.standby is None:
+            return False
+        taken = self.standby.take()
+        if taken is None:
+            return False
+        so, proto, alerts = taken
+        proto.clock = self.__proto.clock
+        proto.bogus_headers += self.__proto.bogus_headers
+        self.so = so
+        self.__proto = proto
+        logging.info("standby session promoted")
+        for mesg in alerts:
+            key = alert_key(mesg.body)
+            if key not in self.__seen:
+                logging.info("alert recovered from the standby session")
+                self.__seen.append(key)
+                self.__alerts.append(mesg)
+                self.recovered_alerts += 1
+        self.health.connected(time())
+        self.failovers += 1
+        self.connects += 1
+        self.err_count = 0
+        self.connected = True
+        return True
+
     def __close(self):
         if (self.connected):
             self.so.close()
             self.connected = False
+            self.health.disconnected()
 
     def __reconnect(self):
         self.__close()
-        sleep (3)
-        self.__connect()
+        if not self.__promote():
+            self.__connect()
 
-    def __recv(self, len):
-        buf = None
+    def __recv(self):
+        frames = None
         if (self.connected):
+            # wait no longer than the deadline of the link
+            now = time()
+            self.so.settimeout(max(0.01, min(self.TIMEOUT,
+                                             self.health.deadline() - now)))
             try:
-                buf = self.so.recv(len)
+                frames = self.__proto.recv_into(self.so)
             except socket.timeout, e:
-                if self.last_healthcheck_recved is None:
-                    logging.error("the process not yet recived health check \
-                            request, any problem?")
-                    return None
-                delta = datetime.now() - self.last_healthcheck_recved 
-                logging.info("%s sec passed from last healthckeck message \
-                        recieved.", delta.seconds)
-                if delta > timedelta(0, 5 * 60):
-                    logging.error("too long absent of healtcheck reqest. \
-                            try to reconect.")
+                now = time()
+                if self.health.expired(now):
+                    # missed() backs the deadline off, log the one missed
+                    timeout = self.health.timeout()
+                    silence = self.health.missed(now)
+                    logging.error("nothing received for %.1f sec (deadline \
+                            %.1f sec), reconnect", silence, timeout)
                     self.__reconnect()
             except socket.error, e:
-                print "%s" % (e)
-            # as the socket is blocking socket, '' means the socket was 
-            # disconected.
-            if buf == '':
-                logging.error("socket seems to be disconnected by remote peer,\
-                        close local peer")
-                self.connect_err_count += 1
+                # incl. keepalive and user timeout expiry
+                logging.error("socket error:%s", e)
                 self.__close()
-                return None
+            else:
+                # as the socket is blocking socket, no frame list means
+                # the socket was disconected.
+                if frames is None:
+                    logging.error("socket seems to be disconnected by \
+                            remote peer, close local peer")
+                    self.connect_err_count += 1
+                    self.__close()
+                else:
+                    self.__recv_time = time()
+                    self.health.received(self.__recv_time)
         else:
             logging.debug("socket not connected, connect first")
-        return buf
+        return frames
 
     def __send(self, buffer):
         if (self.connected):
             try:
                 self.so.sendall(buffer)
             except socket.error, e:
+                # as on recv: the session is lost
                 logging.error("socket error:%s", e)
+                self.__close()
         else:
             logging.debug("socket not connected, connect first")
 
     def __reply_healthcheck(self, mesg):
         self.last_healthcheck_recved = datetime.now()
+        self.health.healthcheck(time())
         buf = mesg.healthcheck_reply()
         if buf is not None:
             self.__send(buf)
@@ -614,60 +1011,139 @@ class QAClient(object):
     def stop(self):
         self.__close()
 
-    def process(self):
-        if self.connected is not True:
-            status = self.__connect()
-            if status is False:
-                self.connect_err_count += 1
-                return None
-        header = self.__recv(self.QA_HEADER_LEN)
-        if header is None:
-            # socket err (incl. timeout)
-            self.err_count += 1
-            return None
-
-        if self.verbose:
-            try:
-                print "=====debug====== (header part)"
-                print dump_rawbuf(header)
-            except:
-                pass
-
-        if len(header) != self.QA_HEADER_LEN:
-            logging.info('bogus header: %s (len:%s)', header, len(header))
-            # reconnect to server
-            self.__close()
-            return None    
-
-        try:
-            mesg = QAMessage(header)
-        except:
-            logging.info('QAMessage error')
-            self.err_count += 1
-            return None
-
-        body = self.__recv(mesg.body_length())
-        if body is None:
-            self.err_count += 1
-            return None
+    def enable_metrics(self, metrics=None, name=None):
+        '''
+        start stamping each stage of the received messages to a
+        quakealert.Metrics (created if not given), which is returned.
+        the counters of the client are prefixed with name; it defaults
+        to server_port when a shared Metrics is given.
+        '''
+        if name is None:
+            if metrics is None:
+                name = ''
+            else:
+                name = re.sub(r'\W', '_', '%s_%s' % (self.server, self.port))
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.metrics_name = name
+        self.__proto.clock = metrics.clock
+        metrics.add_source(name, self.counters, self.metrics_labels(),
+                           self.MONOTONIC_COUNTERS)
+        return metrics
+
+    def metrics_labels(self):
+        return dict(server='%s:%s' % (self.server, self.port))
+
+    def counters(self):
+        counters = dict(err_count=self.err_count,
+                        connect_err_count=self.connect_err_count,
+                        connected=self.connected,
+                        reconnects=max(0, self.connects - 1),
+                        failovers=self.failovers,
+                        recovered_alerts=self.recovered_alerts,
+                        bogus_headers=self.__proto.bogus_headers,
+                        queued_alerts=len(self.__alerts))
+        counters.update(self.health.snapshot())
+        if self.standby is not None:
+            counters.update(self.standby.counters())
+        return counters
+
+    def stats(self):
+        if self.metrics is not None:
+            return self.metrics.snapshot()
+        return dict(counters=self.counters(), stages={})
+
+    def __handle_message(self, mesg):
+        if self.recorder is not None:
+            self.recorder.write(mesg.header + mesg.body, self.__recv_time)
         if self.verbose:
             try:
-                print "---(body part)---"
-                print dump_rawbuf(body)
-                sys.stdout.flush()
+                dump_frame(mesg, self.verbose)
             except:
                 pass
-
-        mesg.add_body(body)
         # send back healthcheck reply
         if mesg.is_healthcheck_request():
             self.__reply_healthcheck(mesg)
             logging.info('Health Check request: acked')
+            if self.metrics is not None:
+                self.metrics.incr('healthchecks')
+                self.__observe_ack(mesg)
         # send back checkpoint reply
         if mesg.is_require_checkpoint_reply():
             self.__reply_checkpoint(mesg)
             logging.info('CheckPoint request: acked')
+            if self.metrics is not None:
+                self.metrics.incr('checkpoints')
+                self.__observe_ack(mesg)
+        if self.metrics is not None:
+            self.metrics.incr('frames')
+            if mesg.body_time is not None:
+                self.metrics.observe('body',
+                                     mesg.body_time - mesg.header_time)
         # process alert message 
         if mesg.is_alert_message():
-            return mesg.body
+            if self.standby is not None:
+                self.__seen.append(alert_key(mesg.body))
+            self.__alerts.append(mesg)
+
+    def __observe_ack(self, mesg):
+        # frames parsed before enable_metrics() carry no stamps
+        if mesg.body_time is not None:
+            self.metrics.observe('ack', self.metrics.clock() - mesg.body_time)
+
+    def __next_alert(self):
+        mesg = self.__alerts.popleft()
+        if self.metrics is not None:
+            self.metrics.incr('alerts')
+            if mesg.body_time is not None:
+                self.metrics.observe('queue',
+                                     self.metrics.clock() - mesg.body_time)
+        return mesg.body
 
+    def process(self):
+        # several frames can arrive in one read; hand them out one by one
+        if self.__alerts:
+            return self.__next_alert()
+        if self.connected is not True:
+            status = self.__connect()
+            if status is False:
+                self.connect_err_count += 1
+                return None
+        frames = self.__recv()
+        if frames is None:
+            # socket err (incl. timeout)
+            self.err_count += 1
+            return None
+        # replies are sent for every frame before any alert is handed out
+        for mesg in frames:
+            self.__handle_message(mesg)
+        if self.__proto.broken:
+            # reconnect to server
+            self.err_count += 1
+            self.__close()
+        if self.__alerts:
+            return self.__next_alert()
+
+
+from quakealert.async_client import AsyncQAClient
+from quakealert.redundant import RedundantQAClient, alert_key
+from quakealert.tracker import EventTracker
+from quakealert.batch import parse_batch, iter_batches
+from quakealert.record import QARecorder, QAReplay
+from quakealert.mockserver import QAMockServer, AlertGenerator
+from quakealert.metrics import Metrics, Histogram, serve_metrics
+from quakealert.threaded import ThreadedQAClient
+from quakealert.locationdb import LocationDB_mmap, build_location_index
+from quakealert.ebi import EBITable, seismic_rank, seismic_str
+from quakealert.ebi import arrival_seconds, arrival_time
+from quakealert.dispatch import Dispatcher
+from quakealert.pool import WorkerPool, pack_record, unpack_record
+from quakealert.render import Renderer
+from quakealert.journal import Journal, JournalReader, build_event_index
+from quakealert.intensity import SiteIntensity
+from quakealert.geoindex import GeoIndex
+from quakealert.connect import happy_eyeballs, StandbySession
+from quakealert.health import LinkHealth, tune_socket, KEEPALIVE
+from quakealert.sink import Sink, FileSink, RotatingFileSink, UDPSink
+from quakealert.sink import UnixSink, CallableSink, SinkHandler
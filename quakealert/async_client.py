@@ -0,0 +1,365 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import errno
+import heapq
+import logging
+import select
+import socket
+from datetime import datetime
+from time import time
+
+from quakealert import QAProtocol, dump_frame
+from quakealert.health import KEEPALIVE, LinkHealth, tune_socket
+
+def wait_ready(rlist, wlist, now, deadline, timeout=None):
+    if timeout is not None:
+        if deadline is None or now + timeout < deadline:
+            deadline = now + timeout
+    wait = None
+    if deadline is not None:
+        wait = max(0, deadline - now)
+    try:
+        r, w, x = select.select(rlist, wlist, [], wait)
+    except select.error, e:
+        if e.args[0] != errno.EINTR:
+            raise
+        r, w = [], []
+    return r, w
+
+# non-blocking variant of QAClient.
+#
+# nothing in this class sleeps: the connect backoff and the reconnect wait
+# are kept as deadlines and the socket is driven by a select() loop.  other
+# file descriptors (notification sinks, metrics, ...) and timers can be
+# registered to the same loop with add_reader() / call_later(), so they keep
+# running while the client waits for the server.
+#
+#   client = quakealert.AsyncQAClient('<server>', <port>)
+#   for mesg in client:
+#       alert = quakealert.QAlert(mesg)
+class AsyncQAClient(object):
+    def __init__(self, server, port, srcaddr=None):
+        self.TIMEOUT = 120.0
+        self.RECONNECT_WAIT = 3
+        self.server = server
+        self.port = port
+        self.connected = False
+        self.so = None
+        self.connect_err_count = 0
+        self.err_count = 0
+        self.last_healthcheck_recved = None
+        self.srcaddr = srcaddr
+        self.verbose = None
+        self.recorder = None
+        self.KEEPALIVE = dict(KEEPALIVE)
+        self.health = LinkHealth()
+        self.__connecting = False
+        self.__connect_started = 0
+        self.__addrs = []
+        self.__proto = QAProtocol()
+        self.__wbuf = ''
+        self.__last_recv = None
+        self.__next_connect = 0
+        self.__alerts = []
+        self.__readers = {}
+        self.__timers = []
+        self.__running = False
+
+    # --- event loop helpers
+
+    def add_reader(self, fileobj, callback):
+        self.__readers[fileobj] = callback
+
+    def remove_reader(self, fileobj):
+        self.__readers.pop(fileobj, None)
+
+    def call_later(self, delay, callback, *args):
+        heapq.heappush(self.__timers, (time() + delay, callback, args))
+
+    def fileno(self):
+        if self.so is None:
+            return -1
+        return self.so.fileno()
+
+    # --- connection management
+
+    def __backoff(self):
+        # same exponencial backoff as QAClient (up to 60 sec)
+        if self.connect_err_count > 0:
+            waittime = 2 ** self.connect_err_count
+            if (waittime > 60):
+                waittime = 60
+            logging.error("connection error, wait %s sec", waittime)
+            return waittime
+        return 0
+
+    def __schedule_connect(self, delay):
+        self.__next_connect = time() + delay
+
+    def __start_connect(self):
+        if not self.__addrs:
+            try:
+                self.__addrs = socket.getaddrinfo(self.server, self.port,
+                        socket.AF_UNSPEC, socket.SOCK_STREAM)
+            except socket.error, e:
+                logging.error("socket error:%s", e)
+                self.__connect_failed()
+                return
+        while self.__addrs:
+            af, socktype, proto, canonname, sa = self.__addrs.pop(0)
+            try:
+                self.so = socket.socket(af, socktype, proto)
+            except socket.error, e:
+                self.so = None
+                logging.error("socket error:%s", e)
+                continue
+            try:
+                self.so.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.so.setblocking(0)
+                if self.srcaddr != None:
+                    if af == socket.AF_INET:
+                        ''' XXX, supporting ipv4 only, fix it '''
+                        self.so.bind((self.srcaddr, 54322))
+                err = self.so.connect_ex(sa)
+            except socket.error, e:
+                self.so.close()
+                logging.error("socket error:%s", e)
+                self.so = None
+                continue
+            if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                self.__connecting = True
+                self.__connect_started = time()
+                return
+            self.so.close()
+            self.so = None
+            logging.error("socket error:%s", errno.errorcode.get(err, err))
+        self.__connect_failed()
+
+    def __connect_failed(self):
+        logging.error("could not open socket")
+        self.connected = False
+        self.connect_err_count += 1
+        self.__schedule_connect(self.__backoff())
+
+    def __connect_done(self):
+        err = self.so.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        self.__connecting = False
+        if err != 0:
+            logging.error("socket error:%s", errno.errorcode.get(err, err))
+            self.so.close()
+            self.so = None
+            if self.__addrs:
+                self.__start_connect()
+            else:
+                self.__connect_failed()
+            return
+        sa, sp = self.so.getsockname()[:2]
+        pa, pp = self.so.getpeername()[:2]
+        logging.info("connected %s:%s -> %s:%s", sa, sp, pa, pp)
+        tune_socket(self.so, **self.KEEPALIVE)
+        self.__addrs = []
+        self.__proto.reset()
+        self.__wbuf = ''
+        self.__last_recv = time()
+        self.health.connected(self.__last_recv)
+        self.err_count = 0
+        self.connected = True
+
+    def __close(self):
+        if self.so is not None:
+            self.so.close()
+            self.so = None
+        self.connected = False
+        self.__connecting = False
+        self.health.disconnected()
+
+    def __reconnect(self):
+        self.__close()
+        self.__schedule_connect(self.RECONNECT_WAIT)
+
+    def __socket_error(self, e):
+        # as QAClient: the session is lost, close it and connect again
+        logging.error("socket error:%s", e)
+        self.err_count += 1
+        self.__close()
+        self.__schedule_connect(self.__backoff())
+
+    def stop(self):
+        self.__close()
+        self.__running = False
+
+    # --- protocol handling
+
+    def __send(self, buffer):
+        if (self.connected):
+            self.__wbuf += buffer
+            self.__flush()
+        else:
+            logging.debug("socket not connected, connect first")
+
+    def __flush(self):
+        try:
+            n = self.so.send(self.__wbuf)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self.__socket_error(e)
+            return
+        self.__wbuf = self.__wbuf[n:]
+
+    def __handle_read(self):
+        try:
+            frames = self.__proto.recv_into(self.so)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self.__socket_error(e)
+            return
+        if frames is None:
+            logging.error("socket seems to be disconnected by remote peer,\
+                    close local peer")
+            self.connect_err_count += 1
+            self.__close()
+            self.__schedule_connect(self.__backoff())
+            return
+        self.__last_recv = time()
+        self.health.received(self.__last_recv)
+        for mesg in frames:
+            if self.recorder is not None:
+                self.recorder.write(mesg.header + mesg.body, self.__last_recv)
+            if self.verbose:
+                dump_frame(mesg, self.verbose)
+            self.__handle_message(mesg)
+        if self.__proto.broken:
+            # framing is lost, start over with a fresh session
+            self.err_count += 1
+            self.__reconnect()
+
+    def __handle_message(self, mesg):
+        # send back healthcheck reply
+        if mesg.is_healthcheck_request():
+            self.last_healthcheck_recved = datetime.now()
+            self.health.healthcheck(time())
+            self.__send(mesg.healthcheck_reply())
+            logging.info('Health Check request: acked')
+        # send back checkpoint reply
+        if mesg.is_require_checkpoint_reply():
+            buf = mesg.checkpoint_reply()
+            if buf is not None:
+                self.__send(buf)
+            logging.info('CheckPoint request: acked')
+        if mesg.is_alert_message():
+            self.__alerts.append(mesg.body)
+
+    def __check_idle(self, now):
+        if not self.health.expired(now):
+            return
+        self.err_count += 1
+        # missed() backs the deadline off, log the one missed
+        timeout = self.health.timeout()
+        silence = self.health.missed(now)
+        logging.error("nothing received for %.1f sec (deadline %.1f sec), \
+                reconnect", silence, timeout)
+        self.__close()
+        self.__schedule_connect(0)
+
+    # --- main loop
+
+    def __next_deadline(self):
+        deadlines = []
+        if self.__timers:
+            deadlines.append(self.__timers[0][0])
+        if self.so is None:
+            deadlines.append(self.__next_connect)
+        elif self.__connecting:
+            deadlines.append(self.__connect_started + self.TIMEOUT)
+        elif self.connected:
+            deadlines.append(self.health.deadline())
+        if not deadlines:
+            return None
+        return min(deadlines)
+
+    def prepare(self, now):
+        '''
+        first half of a loop round: returns the lists of files to be
+        watched for reading and writing, and the absolute time of the
+        next internal deadline (or None).
+        '''
+        if self.so is None and now >= self.__next_connect:
+            self.__start_connect()
+        rlist = self.__readers.keys()
+        wlist = []
+        if self.so is not None:
+            if self.__connecting:
+                wlist.append(self.so)
+            else:
+                rlist.append(self.so)
+                if self.__wbuf:
+                    wlist.append(self.so)
+        return rlist, wlist, self.__next_deadline()
+
+    def dispatch(self, r, w, now):
+        '''
+        second half of a loop round: handles the ready files and expired
+        deadlines, and returns the alert bodies received in the round.
+        '''
+        for f in r:
+            if f is self.so:
+                self.__handle_read()
+            elif f in self.__readers:
+                self.__readers[f](f)
+        if self.so is not None and self.so in w:
+            if self.__connecting:
+                self.__connect_done()
+            elif self.__wbuf:
+                self.__flush()
+        if self.__connecting and \
+                now - self.__connect_started >= self.TIMEOUT:
+            logging.error("socket error:connect timed out")
+            self.so.close()
+            self.so = None
+            self.__connecting = False
+            if self.__addrs:
+                self.__start_connect()
+            else:
+                self.__connect_failed()
+        elif self.connected:
+            self.__check_idle(now)
+        while self.__timers and self.__timers[0][0] <= now:
+            when, callback, args = heapq.heappop(self.__timers)
+            callback(*args)
+        alerts, self.__alerts = self.__alerts, []
+        return alerts
+
+    def run_once(self, timeout=None):
+        '''
+        run one round of the event loop and return the alert bodies
+        received in the round.  it blocks at most `timeout' seconds
+        (or until the next internal deadline).
+        '''
+        now = time()
+        rlist, wlist, deadline = self.prepare(now)
+        r, w = wait_ready(rlist, wlist, now, deadline, timeout)
+        return self.dispatch(r, w, time())
+
+    def __iter__(self):
+        self.__running = True
+        while self.__running:
+            for body in self.run_once():
+                yield body
@@ -0,0 +1,175 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+from itertools import islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# number of space separated fields needed up to max_seismic
+_MIN_FIELDS = 11
+_EMPTY_ROW = [''] * _MIN_FIELDS
+
+def _column(rows, k, width):
+    # field k of every row as a (n, width + 1) byte matrix.  the extra
+    # column is zero only if the field is not longer than `width'.
+    col = numpy.array([r[k] for r in rows], dtype='S%d' % (width + 1))
+    return col.view(numpy.uint8).reshape(len(rows), width + 1)
+
+def _exact(b, width):
+    return (b[:, width] == 0) & (b[:, width - 1] != 0)
+
+def _digits(b, start, width):
+    d = b[:, start:start + width].astype(numpy.int64) - 48
+    ok = ((d >= 0) & (d <= 9)).all(axis=1)
+    val = (d * 10 ** numpy.arange(width - 1, -1, -1)).sum(axis=1)
+    return val, ok
+
+def _unknown(b, width):
+    # '//', '///': field present but value not determined
+    return (b[:, :width] == ord('/')).all(axis=1) & (b[:, width] == 0)
+
+def _timestamps(b):
+    yy, ok = _digits(b, 0, 2)
+    mo, ok2 = _digits(b, 2, 2)
+    dd, ok3 = _digits(b, 4, 2)
+    hms, ok4 = _digits(b, 6, 6)
+    hh, ms = numpy.divmod(hms, 10000)
+    mi, ss = numpy.divmod(ms, 100)
+    ok &= ok2 & ok3 & ok4 & _exact(b, 12)
+    ok &= (mo >= 1) & (mo <= 12) & (dd >= 1) & (dd <= 31)
+    ok &= (hh < 24) & (mi < 60) & (ss < 60)
+    year = numpy.where(yy < 69, 2000 + yy, 1900 + yy)
+    mo = numpy.where(ok, mo, 1)
+    dd = numpy.where(ok, dd, 1)
+    ts = (year - 1970).astype('datetime64[Y]').astype('datetime64[M]')
+    ts = ts + (mo - 1).astype('timedelta64[M]')
+    ts = ts.astype('datetime64[D]') + (dd - 1).astype('timedelta64[D]')
+    # reject Feb 30 etc.: the day must not roll over into the next month
+    ok &= ts.astype('datetime64[M]') == \
+          (year - 1970).astype('datetime64[Y]').astype('datetime64[M]') + \
+          (mo - 1).astype('timedelta64[M]')
+    ts = ts.astype('datetime64[s]') + \
+         (hh * 3600 + mi * 60 + ss).astype('timedelta64[s]')
+    return ts, ok
+
+def parse_batch(codestrs, message_type='37'):
+    '''
+    parse many code messages at once into columnar numpy arrays.
+
+    returns a dict of arrays of the same length:
+      id             int64   event id (ND field)
+      timestamp      datetime64[s]
+      alert_seq      int16
+      condition      int8    9 for the last report
+      location_code  int16
+      lat, lon       int16   in 0.1 degree, south and west are negative
+      depth          int16   km, -1 if not determined
+      magnitude      int16   in 0.1, -1 if not determined
+      max_seismic    S2      as Parser.max_seismic(), '' if none
+      valid          bool    False for malformed rows (other columns are 0)
+    '''
+    if numpy is None:
+        raise ImportError('parse_batch() requires numpy')
+    rows = []
+    for c in codestrs:
+        r = c.split(' ', 14)
+        rows.append(r if len(r) >= _MIN_FIELDS else _EMPTY_ROW)
+    n = len(rows)
+
+    ts, valid = _timestamps(_column(rows, 0, 12))
+
+    b = _column(rows, 1, 16)
+    eid, ok = _digits(b, 2, 14)
+    valid &= ok & _exact(b, 16) & (b[:, 0] == ord('N')) & \
+             (b[:, 1] == ord('D'))
+
+    b = _column(rows, 2, 6)
+    cond, ok = _digits(b, 3, 1)
+    seq, ok2 = _digits(b, 4, 2)
+    valid &= ok & ok2 & _exact(b, 6) & (b[:, 0] == ord('N')) & \
+             (b[:, 1] == ord('C')) & (b[:, 2] == ord('N'))
+
+    b = _column(rows, 5, 3)
+    location, ok = _digits(b, 0, 3)
+    valid &= ok & _exact(b, 3)
+
+    b = _column(rows, 6, 4)
+    lat, ok = _digits(b, 1, 3)
+    south = b[:, 0] == ord('S')
+    valid &= ok & _exact(b, 4) & ((b[:, 0] == ord('N')) | south)
+    lat = numpy.where(south, -lat, lat)
+
+    b = _column(rows, 7, 5)
+    lon, ok = _digits(b, 1, 4)
+    west = b[:, 0] == ord('W')
+    valid &= ok & _exact(b, 5) & ((b[:, 0] == ord('E')) | west)
+    lon = numpy.where(west, -lon, lon)
+
+    b = _column(rows, 8, 3)
+    depth, ok = _digits(b, 0, 3)
+    unknown = _unknown(b, 3)
+    valid &= (ok & _exact(b, 3)) | unknown
+    depth = numpy.where(unknown, -1, depth)
+
+    b = _column(rows, 9, 2)
+    mag, ok = _digits(b, 0, 2)
+    unknown = _unknown(b, 2)
+    valid &= (ok & _exact(b, 2)) | unknown
+    mag = numpy.where(unknown, -1, mag)
+
+    b = _column(rows, 10, 2)
+    seismic = b[:, :2].copy()
+    # '01'..'04', '07' -> '1'..'4', '7'
+    lead0 = (b[:, 0] == ord('0')) & numpy.in1d(b[:, 1], bytearray('12347'))
+    seismic[lead0, 0] = b[lead0, 1]
+    seismic[lead0, 1] = 0
+    seismic[_unknown(b, 2)] = 0
+    if message_type == '35':
+        seismic[:] = 0
+    seismic = seismic.view('S2').reshape(n)
+
+    def column(a, dtype, fill=0):
+        return numpy.where(valid, a, fill).astype(dtype)
+
+    return dict(id=column(eid, numpy.int64),
+                timestamp=numpy.where(valid, ts,
+                                      numpy.datetime64(0, 's')),
+                alert_seq=column(seq, numpy.int16),
+                condition=column(cond, numpy.int8),
+                location_code=column(location, numpy.int16),
+                lat=column(lat, numpy.int16),
+                lon=column(lon, numpy.int16),
+                depth=column(depth, numpy.int16),
+                magnitude=column(mag, numpy.int16),
+                max_seismic=numpy.where(valid, seismic, ''),
+                valid=valid)
+
+def iter_batches(codestrs, size=65536, message_type='37'):
+    '''
+    parse_batch() over an iterable of any length (e.g. an archive file),
+    `size' lines at a time.
+    '''
+    it = iter(codestrs)
+    while True:
+        chunk = [line.rstrip('\r\n') for line in islice(it, size)]
+        if not chunk:
+            break
+        yield parse_batch(chunk, message_type)
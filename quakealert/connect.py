@@ -0,0 +1,288 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import errno
+import logging
+import select
+import socket
+import threading
+from collections import deque
+from time import time
+
+from quakealert import QAProtocol
+from quakealert.health import KEEPALIVE, LinkHealth, tune_socket
+
+# RFC 8305 "Connection Attempt Delay": the next address is tried when the
+# previous attempt has not completed within this time (sec)
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+def _interleave(addrinfo):
+    # RFC 8305 section 4: alternate the address families, starting with
+    # the family of the first address returned by the resolver
+    families = []
+    for res in addrinfo:
+        for f in families:
+            if f[0][0] == res[0]:
+                f.append(res)
+                break
+        else:
+            families.append([res])
+    result = []
+    while families:
+        for f in families:
+            result.append(f.pop(0))
+        families = [f for f in families if f]
+    return result
+
+def happy_eyeballs(host, port, srcaddr=None, srcport=0, timeout=120.0,
+                   delay=CONNECTION_ATTEMPT_DELAY):
+    '''
+    connect to `host' by racing non-blocking connects to its addresses,
+    started `delay' sec apart (at once when an attempt fails).  the first
+    one to complete wins, the others are closed.  returns the connected
+    socket with `timeout' set, raises socket.error when no address could
+    be reached within `timeout' sec.
+    '''
+    addrs = _interleave(socket.getaddrinfo(host, port, socket.AF_UNSPEC,
+                                           socket.SOCK_STREAM))
+    deadline = time() + timeout
+    next_attempt = 0
+    pending = {}
+    error = socket.error('no address for %s' % host)
+    winner = None
+    try:
+        while winner is None:
+            now = time()
+            if addrs and (now >= next_attempt or not pending):
+                af, socktype, proto, canonname, sa = addrs.pop(0)
+                try:
+                    so = socket.socket(af, socktype, proto)
+                except socket.error, e:
+                    logging.error("socket error:%s", e)
+                    error = e
+                    continue
+                try:
+                    so.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    so.setblocking(0)
+                    if srcaddr is not None and af == socket.AF_INET:
+                        ''' XXX, supporting ipv4 only, fix it '''
+                        so.bind((srcaddr, srcport))
+                    err = so.connect_ex(sa)
+                except socket.error, e:
+                    so.close()
+                    logging.error("socket error:%s", e)
+                    error = e
+                    continue
+                if err == 0:
+                    winner = so
+                    break
+                if err not in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    so.close()
+                    error = socket.error(err, errno.errorcode.get(err, err))
+                    logging.error("socket error:%s", error)
+                    continue
+                pending[so] = sa
+                next_attempt = now + delay
+                continue
+            if not pending or now >= deadline:
+                break
+            wait = deadline - now
+            if addrs:
+                wait = min(wait, next_attempt - now)
+            r, w, x = select.select([], pending.keys(), pending.keys(),
+                                    max(wait, 0))
+            for so in set(w) | set(x):
+                err = so.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    winner = so
+                    del pending[so]
+                    break
+                logging.error("socket error:%s (%s)",
+                              errno.errorcode.get(err, err), pending[so])
+                error = socket.error(err, errno.errorcode.get(err, err))
+                so.close()
+                del pending[so]
+                next_attempt = 0
+    finally:
+        for so in pending:
+            so.close()
+    if winner is None:
+        if time() >= deadline:
+            raise socket.timeout('connect to %s timed out' % host)
+        raise error
+    winner.setblocking(1)
+    winner.settimeout(timeout)
+    return winner
+
+
+# warm standby session for QAClient (standby=True).
+#
+# a second session to the server is kept established by a background
+# thread, which answers its healthcheck and checkpoint requests and drops
+# it when its link health deadline is missed.  the primary session
+# delivers the alerts; the last `backlog' alerts received on the standby
+# (within `ttl' seconds) are kept, so that the ones the primary missed
+# before it was found dead can be recovered on takeover.  when the
+# primary session is lost, take() hands the standby over at once, with
+# the kept alerts, and a new standby is built in the background.
+#
+#   standby = StandbySession('<server>', <port>)
+#   standby.start()
+#   so, proto, alerts = standby.take()   # None if no standby is ready
+class StandbySession(object):
+    def __init__(self, server, port, srcaddr=None, timeout=120.0,
+                 backlog=64, ttl=600):
+        self.server = server
+        self.port = port
+        # the primary session owns the fixed source port
+        self.srcaddr = srcaddr
+        self.TIMEOUT = timeout
+        self.KEEPALIVE = dict(KEEPALIVE)
+        self.health = LinkHealth()
+        self.connects = 0
+        self.connect_err_count = 0
+        self.buffered_alerts = 0
+        self.ttl = ttl
+        self.__alerts = deque(maxlen=backlog)
+        self.__so = None
+        self.__proto = None
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__thread = None
+        self.__running = False
+
+    def ready(self):
+        return self.__so is not None
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='quakealert-standby')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def take(self):
+        '''
+        hand the standby session over: (socket, QAProtocol, alerts) or
+        None.  alerts are the QAMessages kept from the standby, oldest
+        first.
+        '''
+        with self.__lock:
+            so, proto = self.__so, self.__proto
+            self.__so = self.__proto = None
+            if so is None:
+                return None
+            limit = time() - self.ttl
+            alerts = [mesg for t, mesg in self.__alerts if t >= limit]
+            self.__alerts.clear()
+        return so, proto, alerts
+
+    def close(self):
+        self.__running = False
+        self.__wakeup.set()
+        with self.__lock:
+            if self.__so is not None:
+                self.__so.close()
+            self.__so = self.__proto = None
+        if self.__thread is not None:
+            self.__thread.join(self.TIMEOUT)
+            self.__thread = None
+
+    def counters(self):
+        return dict(standby_ready=self.ready(),
+                    standby_link_state=self.health.state(time()),
+                    standby_connects=self.connects,
+                    standby_connect_err_count=self.connect_err_count,
+                    standby_buffered_alerts=self.buffered_alerts)
+
+    def __connect(self):
+        try:
+            so = happy_eyeballs(self.server, self.port, self.srcaddr,
+                                timeout=self.TIMEOUT)
+        except socket.error, e:
+            logging.error("standby: socket error:%s", e)
+            self.connect_err_count += 1
+            # same exponencial backoff as QAClient (up to 60 sec)
+            self.__wakeup.wait(min(2 ** self.connect_err_count, 60))
+            self.__wakeup.clear()
+            return
+        logging.info("standby: connected")
+        tune_socket(so, **self.KEEPALIVE)
+        self.health.connected(time())
+        self.connects += 1
+        self.connect_err_count = 0
+        with self.__lock:
+            if self.__running:
+                self.__so, self.__proto = so, QAProtocol()
+            else:
+                so.close()
+
+    def __service(self, so):
+        try:
+            r, w, x = select.select([so], [], [], 1.0)
+        except (select.error, socket.error):
+            r = []
+        with self.__lock:
+            # taken over meanwhile
+            if self.__so is not so:
+                return
+            if not r:
+                now = time()
+                if self.health.expired(now):
+                    silence = self.health.missed(now)
+                    logging.error("standby: nothing received for %.1f sec",
+                                  silence)
+                    self.__drop(so)
+                return
+            try:
+                frames = self.__proto.recv_into(so)
+                if frames is not None:
+                    self.health.received(time())
+                for mesg in frames or ():
+                    if mesg.is_healthcheck_request():
+                        self.health.healthcheck(time())
+                        so.sendall(mesg.healthcheck_reply())
+                    if mesg.is_require_checkpoint_reply():
+                        buf = mesg.checkpoint_reply()
+                        if buf is not None:
+                            so.sendall(buf)
+                    if mesg.is_alert_message():
+                        self.__alerts.append((time(), mesg))
+                        self.buffered_alerts += 1
+            except socket.error, e:
+                logging.error("standby: socket error:%s", e)
+                frames = None
+            if frames is None or self.__proto.broken:
+                logging.error("standby: session lost")
+                self.__drop(so)
+
+    def __drop(self, so):
+        # called with the lock held
+        so.close()
+        self.__so = self.__proto = None
+        self.health.disconnected()
+
+    def __run(self):
+        while self.__running:
+            so = self.__so
+            if so is None:
+                self.__connect()
+            else:
+                self.__service(so)
@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+from bisect import bisect_right
+from itertools import count
+
+from quakealert.ebi import SEISMIC_SCALE, seismic_rank
+
+REPORTS = ('first', 'middle', 'last')
+
+def _tenths(v):
+    # magnitude ('6.6' or 6.6) -> integer tenths
+    if v is None:
+        return None
+    return int(round(float(v) * 10))
+
+def _choices(flag):
+    # None: either, True/False: only that value
+    if flag is None:
+        return (False, True)
+    return (bool(flag),)
+
+
+# routes alerts to many subscribers with declarative filters.
+#
+#   d = quakealert.Dispatcher()
+#   d.subscribe('user-1', areas=['222', '223'], min_seismic='5-')
+#   d.subscribe(callback, min_magnitude='6.0', last=True)
+#   for subscriber in d.match(pmesg.parse(), alert):
+#       ...
+#
+# every condition of a filter must hold:
+#
+#   areas          any of the EBI area codes is listed (default: any)
+#   min_magnitude  magnitude is known and not smaller (default: any)
+#   min_seismic    max_seismic is known and not smaller (default: any)
+#   drill          False: effective alerts only (default), True: drills
+#                  only, None: both (QAlert.is_effective())
+#   test           same for test messages (QAlert.is_test_message())
+#   first, last    True: only the first / the last report (default: all)
+#
+# filters are compiled into an index:
+#
+#   area code (or None) -> report category -> seismic threshold
+#       -> subscribers sorted by magnitude threshold
+#
+# so match() only visits the areas of the alert and the thresholds at or
+# below its values, and every entry it reaches is a match.
+class Dispatcher(object):
+    def __init__(self):
+        self.alerts = 0
+        self.matched = 0
+        self.__ids = count(1)
+        self.__subscribers = {}
+        self.__index = {}
+
+    def __len__(self):
+        return len(self.__subscribers)
+
+    def subscribe(self, subscriber, areas=None, min_magnitude=None,
+                  min_seismic=None, drill=False, test=False, first=None,
+                  last=None):
+        '''
+        register a subscriber (any object, e.g. a callback or a key) and
+        return the subscription id for unsubscribe().
+        '''
+        if areas is not None:
+            areas = set(int(a) for a in areas)
+            if not areas:
+                raise ValueError('empty area list')
+        mag = _tenths(min_magnitude)
+        if mag is None:
+            mag = -1
+        if min_seismic is None:
+            slot = 0
+        else:
+            rank = seismic_rank(min_seismic)
+            if not 0 <= rank < len(SEISMIC_SCALE):
+                raise ValueError('unknown seismic intensity: %s' %
+                                 min_seismic)
+            slot = rank + 1
+        reports = [r for r, f in (('first', first), ('last', last)) if f]
+        if not reports:
+            reports = REPORTS
+        sid = next(self.__ids)
+        keys = []
+        for area in (areas or (None,)):
+            for d in _choices(drill):
+                for t in _choices(test):
+                    for r in reports:
+                        keys.append((area, (d, t, r), slot))
+        for area, cat, slot in keys:
+            cats = self.__index.setdefault(area, {})
+            slots = cats.get(cat)
+            if slots is None:
+                slots = cats[cat] = [None] * (len(SEISMIC_SCALE) + 1)
+            if slots[slot] is None:
+                slots[slot] = ([], [])
+            thresholds, sids = slots[slot]
+            i = bisect_right(thresholds, mag)
+            thresholds.insert(i, mag)
+            sids.insert(i, sid)
+        self.__subscribers[sid] = (subscriber, mag, keys)
+        return sid
+
+    def unsubscribe(self, sid):
+        subscriber, mag, keys = self.__subscribers.pop(sid)
+        for area, cat, slot in keys:
+            cats = self.__index[area]
+            thresholds, sids = cats[cat][slot]
+            i = sids.index(sid)
+            del thresholds[i]
+            del sids[i]
+            if not sids:
+                cats[cat][slot] = None
+                if not any(cats[cat]):
+                    del cats[cat]
+                    if not cats:
+                        del self.__index[area]
+
+    def __alert_values(self, p, alert):
+        if hasattr(p, 'parse'):
+            p = p.parse()
+        if isinstance(p, dict):
+            mag = _tenths(p['magnitude'])
+            seismic = p['max_seismic']
+            areas = [e['location_code'] for e in p['ebi'] or ()
+                     if 'location_code' in e]
+            is_first, is_last = p['is_first'], p['is_last']
+        else:
+            mag = p.magnitude
+            seismic = p.max_seismic
+            areas = p.ebi_table().codes if p.ebistr else ()
+            is_first, is_last = p.is_first(), p.is_last()
+        report = 'last' if is_last else 'first' if is_first else 'middle'
+        if alert is None:
+            cat = (False, False, report)
+        else:
+            cat = (not alert.is_effective(), alert.is_test_message(), report)
+        return (-1 if mag is None else mag, seismic_rank(seismic),
+                set(int(a) for a in areas), cat)
+
+    def match(self, p, alert=None):
+        '''
+        subscribers of an alert: p is a ParsedEEW, a Parser or a dump()
+        dict, alert the QAlert it came from (None: effective, not test).
+        '''
+        mag, rank, areas, cat = self.__alert_values(p, alert)
+        sids = set()
+        for area in [None] + [a for a in areas if a in self.__index]:
+            slots = self.__index.get(area, {}).get(cat)
+            if slots is None:
+                continue
+            for slot in slots[:rank + 2]:
+                if slot is not None:
+                    thresholds, subs = slot
+                    sids.update(subs[:bisect_right(thresholds, mag)])
+        self.alerts += 1
+        self.matched += len(sids)
+        logging.debug('alert matched %d subscribers', len(sids))
+        subscribers = self.__subscribers
+        return [subscribers[sid][0] for sid in sorted(sids)]
+
+    def counters(self):
+        return dict(subscribers=len(self.__subscribers),
+                    alerts=self.alerts, matched=self.matched)
@@ -0,0 +1,238 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+from array import array
+from datetime import datetime, timedelta
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from quakealert import ebi_parser
+
+# seismic intensity codes of the EBI list in increasing order.  the table
+# keeps the rank (index in this tuple), -1 for '//' (not determined, or
+# "and above" for the lower bound).
+SEISMIC_SCALE = ('0', '1', '2', '3', '4', '5-', '5+', '6-', '6+', '7')
+_SEISMIC_RANK = dict((s, i) for i, s in enumerate(SEISMIC_SCALE))
+_SEISMIC_RANK.update(('0' + s, i) for i, s in enumerate(SEISMIC_SCALE[:5]))
+_SEISMIC_RANK['07'] = SEISMIC_SCALE.index('7')
+
+NO_AREA = -1
+NOT_REACHED, REACHED = 0, 1
+
+def seismic_rank(s):
+    '''
+    rank of a seismic intensity ('5-', '05', '5', ...), -1 if unknown.
+    '''
+    if isinstance(s, (int, long)):
+        return s
+    return _SEISMIC_RANK.get(s, -1)
+
+def seismic_str(rank):
+    if 0 <= rank < len(SEISMIC_SCALE):
+        return SEISMIC_SCALE[rank]
+
+def arrival_seconds(s):
+    # 'HHMMSS' -> seconds of the day, -1 if not given ('//////')
+    if len(s) != 6 or not s.isdigit():
+        return -1
+    return int(s[0:2]) * 3600 + int(s[2:4]) * 60 + int(s[4:6])
+
+def arrival_time(sec, base=None):
+    '''
+    seconds of the day -> datetime on the date of `base' (the report
+    time, default today).  None if sec is negative.
+    '''
+    if sec < 0:
+        return None
+    if base is None:
+        base = datetime.today()
+    t = datetime(base.year, base.month, base.day) + timedelta(seconds=sec)
+    # arrival after midnight of a report just before it
+    if t < base - timedelta(hours=12):
+        t += timedelta(days=1)
+    return t
+
+
+# EBI (per area forecast) list decoded into parallel typed arrays, one row
+# per area:
+#
+#   codes        area code (int)
+#   max_seismic  rank in SEISMIC_SCALE, -1 if not determined
+#   min_seismic  rank in SEISMIC_SCALE, -1 if not determined / "and above"
+#   arrival      arrival time of the main shock in seconds of the day, -1
+#                if not given (already arrived)
+#   condition    condition field (e.g. 0, 1, 10, 11), -1 if not given
+#   reached      REACHED, NOT_REACHED or -1
+#
+# rows are kept in message order.  a record the arrays cannot hold as
+# ebi_parser() reads it (e.g. an area code other than 3 digits, an
+# unknown intensity) keeps the ebi_parser() entry as is; its area code is
+# NO_AREA unless it is 3 digits, the other columns are filled as far as
+# they can be read.  records ebi_parser() drops are skipped.  the area
+# code index is a fixed table of 1000 entries, so index() and
+# `code in table' are O(1):
+#
+#   t = quakealert.parse('37', codestr).ebi_table()
+#   t.get('222')          # same dict as an ebi_parser() entry
+#   t.areas_at_least('5-')
+class EBITable(object):
+    def __init__(self, ebistr=None, base=None):
+        # base: report time, gives the date of the arrival times
+        self.base = base
+        self.codes = array('h')
+        self.max_seismic = array('b')
+        self.min_seismic = array('b')
+        self.arrival = array('i')
+        self.condition = array('b')
+        self.reached = array('b')
+        self.skipped = 0
+        self.__irregular = {}
+        self.__index = array('h', [NO_AREA]) * 1000
+        if ebistr:
+            self.__parse(ebistr)
+
+    def __parse(self, ebistr):
+        s = ebistr.split()
+        if len(s) % 4 != 0:
+            raise ValueError('EBI field count %d' % len(s))
+        rank = _SEISMIC_RANK.get
+        index = self.__index
+        codes, smax, smin, arrival, condition, reached = [], [], [], [], [], []
+        for i in xrange(0, len(s), 4):
+            code, seismic, t, cond = s[i:i + 4]
+            hi = seismic[1:3]
+            lo = seismic[3:5]
+            regular = len(seismic) == 5 and seismic[0] == 'S' and \
+                      (hi == '//' or hi in _SEISMIC_RANK) and \
+                      (lo == '//' or lo in _SEISMIC_RANK)
+            if len(code) == 3 and code.isdigit():
+                c = int(code)
+            else:
+                c = NO_AREA
+                regular = False
+            if cond == '//':
+                condition.append(-1)
+                reached.append(-1)
+            elif 1 <= len(cond) <= 2 and cond.isdigit():
+                condition.append(int(cond))
+                reached.append(REACHED if cond[1:] == '1' else
+                               NOT_REACHED if cond[1:] == '0' else -1)
+            else:
+                condition.append(-1)
+                reached.append(-1)
+                regular = False
+            if not regular:
+                entry = ebi_parser(' '.join(s[i:i + 4]), self.base).ebi
+                if not entry:
+                    logging.debug('EBI record %s skipped',
+                                  ' '.join(s[i:i + 4]))
+                    self.skipped += 1
+                    condition.pop()
+                    reached.pop()
+                    continue
+                self.__irregular[len(codes)] = entry[0]
+            if c != NO_AREA and index[c] == NO_AREA:
+                index[c] = len(codes)
+            codes.append(c)
+            smax.append(rank(hi, -1))
+            smin.append(rank(lo, -1))
+            arrival.append(arrival_seconds(t))
+        self.codes.fromlist(codes)
+        self.max_seismic.fromlist(smax)
+        self.min_seismic.fromlist(smin)
+        self.arrival.fromlist(arrival)
+        self.condition.fromlist(condition)
+        self.reached.fromlist(reached)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return self.index(code) != NO_AREA
+
+    def index(self, code):
+        '''
+        row of an area code (str or int), NO_AREA if not listed.
+        '''
+        try:
+            c = int(code)
+        except (TypeError, ValueError):
+            return NO_AREA
+        if not 0 <= c < 1000:
+            return NO_AREA
+        return self.__index[c]
+
+    def arrival_time(self, i):
+        '''
+        arrival time of row i as a datetime on the date of the report.
+        '''
+        return arrival_time(self.arrival[i], self.base)
+
+    def record(self, i):
+        # same dict as an ebi_parser() entry
+        if i in self.__irregular:
+            return dict(self.__irregular[i])
+        seismic = []
+        for rank in (self.max_seismic[i], self.min_seismic[i]):
+            if rank >= 0:
+                seismic.append(SEISMIC_SCALE[rank])
+        e = dict(location_code='%03d' % self.codes[i], seismic=seismic,
+                 timestamp=self.arrival_time(i))
+        if self.condition[i] < 0:
+            e['condition'] = None
+        else:
+            e['condition'] = self.condition[i]
+            if self.reached[i] >= 0:
+                e['reached'] = self.reached[i] == REACHED
+        return e
+
+    def get(self, code, default=None):
+        i = self.index(code)
+        if i == NO_AREA:
+            return default
+        return self.record(i)
+
+    def records(self):
+        return [self.record(i) for i in xrange(len(self.codes))]
+
+    def rows_at_least(self, seismic):
+        '''
+        rows whose forecast maximum intensity is `seismic' or above.
+        '''
+        rank = seismic_rank(seismic)
+        if rank < 0:
+            raise ValueError('unknown seismic intensity: %s' % seismic)
+        if not self.codes:
+            return []
+        if numpy is not None:
+            a = numpy.frombuffer(self.max_seismic, dtype=numpy.int8)
+            return numpy.flatnonzero(a >= rank).tolist()
+        return [i for i, v in enumerate(self.max_seismic) if v >= rank]
+
+    def areas_at_least(self, seismic):
+        '''
+        area codes ('%03d') whose forecast maximum intensity is `seismic'
+        or above.
+        '''
+        codes = self.codes
+        return ['%03d' % codes[i] for i in self.rows_at_least(seismic)
+                if codes[i] != NO_AREA]
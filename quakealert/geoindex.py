@@ -0,0 +1,324 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EARTH_RADIUS = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+def distance(lat0, lon0, lat1, lon1):
+    '''
+    great circle distance (km) between two points (degree).
+    '''
+    p0, p1 = math.radians(lat0), math.radians(lat1)
+    a = math.sin((p1 - p0) / 2) ** 2 + math.cos(p0) * math.cos(p1) * \
+        math.sin(math.radians(lon1 - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def epicenter(p):
+    '''
+    (lat, lon) of a ParsedEEW or Parser.dump() dict, None if unknown.
+    '''
+    if isinstance(p, dict):
+        geo = p['geo']
+        if len(geo) != 2:
+            return None
+        return float(geo[0]), float(geo[1])
+    if p.lat is None or p.lon is None:
+        return None
+    return p.lat / 10.0, p.lon / 10.0
+
+def _inside(lat, lon, vertices):
+    # even-odd rule
+    inside = False
+    lat1, lon1 = vertices[-1]
+    for lat2, lon2 in vertices:
+        if (lat2 > lat) != (lat1 > lat) and \
+           lon < (lon1 - lon2) * (lat - lat2) / (lat1 - lat2) + lon2:
+            inside = not inside
+        lat1, lon1 = lat2, lon2
+    return inside
+
+
+# grid bucket index of points (sites, subscribers) for radius, bounding
+# box and polygon queries, e.g. around the epicenter of an alert.
+#
+#   idx = quakealert.GeoIndex()
+#   idx.insert('site-1', 35.68, 139.77)
+#   idx.insert_many(keys, lats, lons)      # at startup
+#   idx.near(pmesg.parse(), 100)           # keys within 100 km
+#   idx.delete('site-1')
+#
+# points are kept in cells of `cell' degrees (a divisor of 360), each a
+# list of keys and arrays of coordinates; the columns wrap around at the
+# antimeridian, so -179.9 and 180.1 share a cell.  a query takes the cells
+# entirely inside the
+# area as a whole and tests only the points of the cells on its border
+# (with numpy when available), so the cost follows the size of the answer
+# rather than the number of points.  insert and delete touch one cell.
+class GeoIndex(object):
+    def __init__(self, cell=0.1):
+        self.cell = cell
+        self.columns = int(round(360 / cell))
+        self.__cells = {}
+        self.__where = {}
+
+    def __len__(self):
+        return len(self.__where)
+
+    def __contains__(self, key):
+        return key in self.__where
+
+    def __cell(self, lat, lon):
+        return (int(math.floor(lat / self.cell)),
+                int(math.floor(lon / self.cell)) % self.columns)
+
+    def insert(self, key, lat, lon):
+        '''
+        add a point, or move it if the key is already indexed.
+        '''
+        if key in self.__where:
+            self.delete(key)
+        c = self.__cell(lat, lon)
+        bucket = self.__cells.get(c)
+        if bucket is None:
+            bucket = self.__cells[c] = ([], array('d'), array('d'))
+        bucket[0].append(key)
+        bucket[1].append(lat)
+        bucket[2].append(lon)
+        self.__where[key] = c
+
+    def insert_many(self, keys, lats, lons):
+        for key, lat, lon in zip(keys, lats, lons):
+            self.insert(key, float(lat), float(lon))
+
+    def delete(self, key):
+        c = self.__where.pop(key)
+        keys, lats, lons = self.__cells[c]
+        i = keys.index(key)
+        del keys[i]
+        del lats[i]
+        del lons[i]
+        if not keys:
+            del self.__cells[c]
+
+    def location(self, key):
+        keys, lats, lons = self.__cells[self.__where[key]]
+        i = keys.index(key)
+        return lats[i], lons[i]
+
+    def __range(self, lat_min, lon_min, lat_max, lon_max):
+        # cells overlapping a bounding box, with their keys and corners
+        # (longitudes counted from lon_min)
+        size = self.cell
+        n = self.columns
+        i0 = int(math.floor(lat_min / size))
+        i1 = int(math.floor(lat_max / size))
+        j0 = int(math.floor(lon_min / size))
+        width = min(int(math.floor(lon_max / size)) - j0, n - 1)
+        cells = self.__cells
+        if (i1 - i0 + 1) * (width + 1) > len(cells):
+            candidates = [(c, j0 + (c[1] - j0) % n) for c in cells
+                          if i0 <= c[0] <= i1 and (c[1] - j0) % n <= width]
+        else:
+            candidates = [((i, j % n), j) for i in xrange(i0, i1 + 1)
+                          for j in xrange(j0, j0 + width + 1)
+                          if (i, j % n) in cells]
+        for c, j in candidates:
+            yield c, cells[c], (c[0] * size, j * size,
+                                (c[0] + 1) * size, (j + 1) * size)
+
+    def bbox(self, lat_min, lon_min, lat_max, lon_max):
+        '''
+        keys of the points in the bounding box (degree, inclusive).
+        '''
+        result = []
+        for c, (keys, lats, lons), (b0, l0, b1, l1) in \
+                self.__range(lat_min, lon_min, lat_max, lon_max):
+            if lat_min <= b0 and b1 <= lat_max and \
+               lon_min <= l0 and l1 <= lon_max:
+                result.extend(keys)
+            elif numpy is not None and len(keys) > 16:
+                la = numpy.frombuffer(lats, dtype=numpy.float64)
+                lo = numpy.frombuffer(lons, dtype=numpy.float64)
+                hit = (la >= lat_min) & (la <= lat_max) & \
+                      ((lo - lon_min) % 360 <= lon_max - lon_min)
+                result.extend(keys[i] for i in numpy.flatnonzero(hit))
+            else:
+                result.extend(k for k, la, lo in zip(keys, lats, lons)
+                              if lat_min <= la <= lat_max and
+                                 (lo - lon_min) % 360 <= lon_max - lon_min)
+        return result
+
+    def __points(self, bucket, lat, lon, km, result):
+        keys, lats, lons = bucket
+        if numpy is not None and len(keys) > 16:
+            la = numpy.radians(numpy.frombuffer(lats, dtype=numpy.float64))
+            lo = numpy.radians(numpy.frombuffer(lons, dtype=numpy.float64))
+            p0 = math.radians(lat)
+            a = numpy.sin((la - p0) / 2) ** 2 + math.cos(p0) * \
+                numpy.cos(la) * numpy.sin((lo - math.radians(lon)) / 2) ** 2
+            d = 2 * EARTH_RADIUS * numpy.arcsin(
+                    numpy.minimum(1.0, numpy.sqrt(a)))
+            result.extend(keys[i] for i in numpy.flatnonzero(d <= km))
+        else:
+            result.extend(k for k, la, lo in zip(keys, lats, lons)
+                          if distance(lat, lon, la, lo) <= km)
+
+    def radius(self, lat, lon, km):
+        '''
+        keys of the points within `km' of (lat, lon).
+        '''
+        # row by row (cells of one latitude band): the cells within the
+        # inner longitude span are entirely in the circle, the points of
+        # the cells between the inner and the outer span are tested.  the
+        # circle is widest at the parallel its tangent meridians touch;
+        # when it contains a pole, every longitude of a row is searched.
+        cos_d = math.cos(km / EARTH_RADIUS)
+        p0 = math.radians(lat)
+        sin0, cos0 = math.sin(p0), math.cos(p0)
+        if abs(sin0) < cos_d:
+            widest = math.degrees(math.asin(sin0 / cos_d))
+        else:
+            widest = None
+
+        def span(b):
+            # longitude offset (degree) at which the parallel b is `km'
+            # away, None if it is farther at any longitude
+            p = math.radians(b)
+            if cos0 * math.cos(p) <= 0:
+                return None
+            c = (cos_d - sin0 * math.sin(p)) / (cos0 * math.cos(p))
+            if c >= 1:
+                return None
+            if c <= -1:
+                return 180.0
+            return math.degrees(math.acos(c))
+
+        size = self.cell
+        n = self.columns
+        cells = self.__cells
+        dlat = km / KM_PER_DEGREE
+        result = []
+        for i in xrange(max(int(math.floor((lat - dlat) / size)),
+                            int(math.floor(-90.0 / size))),
+                        min(int(math.floor((lat + dlat) / size)),
+                            int(math.floor(90.0 / size))) + 1):
+            b0, b1 = i * size, (i + 1) * size
+            edges = [w for w in (span(b0), span(b1)) if w is not None]
+            if widest is None:
+                outer = 180.0
+            else:
+                w = span(min(max(widest, b0), b1))
+                if w is None:
+                    continue
+                outer = max(edges + [w]) + size
+            # the span is widest inside the band, so its least is at an edge
+            inner = None if len(edges) < 2 else min(edges)
+            j0 = int(math.floor((lon - outer) / size))
+            j1 = int(math.floor((lon + outer) / size))
+            if j1 - j0 >= n:
+                # the whole row, each column once
+                j0 = int(math.floor((lon - 180.0) / size))
+                j1 = j0 + n - 1
+            if inner is not None:
+                k0 = int(math.ceil((lon - inner) / size))
+                k1 = int(math.floor((lon + inner) / size)) - 1
+            else:
+                k0, k1 = j1 + 1, j1
+            for j in xrange(j0, j1 + 1):
+                bucket = cells.get((i, j % n))
+                if bucket is None:
+                    continue
+                if k0 <= j <= k1:
+                    result.extend(bucket[0])
+                else:
+                    self.__points(bucket, lat, lon, km, result)
+        return result
+
+    def near(self, p, km):
+        '''
+        keys within `km' of the epicenter of a ParsedEEW or dump() dict.
+        '''
+        e = epicenter(p)
+        if e is None:
+            return []
+        return self.radius(e[0], e[1], km)
+
+    def __border(self, vertices):
+        # cells whose inside the edges of the polygon pass through
+        size = self.cell
+        border = set(self.__cell(a, b) for a, b in vertices)
+        for (a0, b0), (a1, b1) in zip(vertices, vertices[1:] + vertices[:1]):
+            # the edge is cut at every grid line, the middle of each piece
+            # lies in one cell
+            ts = [0.0, 1.0]
+            for v0, v1 in ((a0, a1), (b0, b1)):
+                if v0 == v1:
+                    continue
+                lo, hi = sorted((v0, v1))
+                for n in xrange(int(math.floor(lo / size)) + 1,
+                                int(math.ceil(hi / size))):
+                    ts.append((n * size - v0) / (v1 - v0))
+            ts.sort()
+            for t0, t1 in zip(ts, ts[1:]):
+                t = (t0 + t1) / 2
+                border.add(self.__cell(a0 + (a1 - a0) * t,
+                                       b0 + (b1 - b0) * t))
+        return border
+
+    def polygon(self, vertices):
+        '''
+        keys of the points inside a polygon, a list of (lat, lon).
+        '''
+        vertices = [(float(a), float(b)) for a, b in vertices]
+        if len(vertices) < 3:
+            raise ValueError('polygon needs 3 vertices at least')
+        edges = zip(vertices, vertices[1:] + vertices[:1])
+        border = self.__border(vertices)
+        result = []
+        for c, (keys, lats, lons), (b0, l0, b1, l1) in self.__range(
+                min(v[0] for v in vertices), min(v[1] for v in vertices),
+                max(v[0] for v in vertices), max(v[1] for v in vertices)):
+            if c not in border:
+                # the cell is entirely inside or outside
+                if _inside((b0 + b1) / 2, (l0 + l1) / 2, vertices):
+                    result.extend(keys)
+                continue
+            if numpy is not None and len(keys) > 16:
+                la = numpy.frombuffer(lats, dtype=numpy.float64)
+                lo = numpy.frombuffer(lons, dtype=numpy.float64)
+                inside = numpy.zeros(len(keys), dtype=bool)
+                for (lat1, lon1), (lat2, lon2) in edges:
+                    if lat1 == lat2:
+                        continue
+                    cross = ((lat2 > la) != (lat1 > la)) & \
+                        (lo < (lon1 - lon2) * (la - lat2) / (lat1 - lat2) +
+                         lon2)
+                    inside ^= cross
+                result.extend(keys[i] for i in numpy.flatnonzero(inside))
+            else:
+                result.extend(k for k, la, lo in zip(keys, lats, lons)
+                              if _inside(la, lo, vertices))
+        return result
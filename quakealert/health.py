@@ -0,0 +1,168 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+import socket
+import sys
+from time import time
+
+# TCP keepalive: probe after `idle' sec of silence, every `interval' sec,
+# `count' times.  user_timeout (sec): abort the connection when sent data
+# (healthcheck/checkpoint replies) stays unacknowledged that long.
+KEEPALIVE = dict(idle=10, interval=2, count=3, user_timeout=10)
+
+# option numbers missing from the socket module of older Pythons (Linux)
+_LINUX_TCP_OPTIONS = dict(TCP_KEEPIDLE=4, TCP_KEEPINTVL=5, TCP_KEEPCNT=6,
+                          TCP_USER_TIMEOUT=18)
+
+def _tcp_option(name):
+    opt = getattr(socket, name, None)
+    if opt is None and sys.platform.startswith('linux'):
+        opt = _LINUX_TCP_OPTIONS.get(name)
+    return opt
+
+def tune_socket(so, idle=10, interval=2, count=3, user_timeout=10):
+    '''
+    enable TCP keepalive and TCP_USER_TIMEOUT (see KEEPALIVE) on a
+    connected socket.  options the platform does not have are skipped.
+    '''
+    so.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # TCP_KEEPALIVE is the idle time on macOS
+    for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPALIVE', idle),
+                        ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count),
+                        ('TCP_USER_TIMEOUT', user_timeout and
+                                             int(user_timeout * 1000))):
+        opt = _tcp_option(name)
+        if opt is None or value is None:
+            continue
+        try:
+            so.setsockopt(socket.IPPROTO_TCP, opt, value)
+        except socket.error, e:
+            logging.debug("%s not set: %s", name, e)
+
+
+# health of the link to a distribution server.
+#
+# the interval of the healthcheck requests is learned per provider (a
+# smoothed mean and deviation, as RFC 6298 does for the RTT), and the link
+# is declared dead when nothing at all has been received for
+#
+#   interval * (1 + margin) + 4 * deviation      (at least min_timeout)
+#
+# after the last byte.  until two healthchecks in a row have been seen,
+# `initial' sec are allowed.  the learned interval is kept over
+# reconnects, and as in RFC 6298 the allowance is doubled (up to 8 times)
+# on every missed deadline until an interval is measured again, so that a
+# provider whose interval grew is still learned.
+#
+#   health = LinkHealth()
+#   health.connected(now)
+#   health.received(now)         # on every read
+#   health.healthcheck(now)      # on every healthcheck request
+#   if health.expired(now):
+#       <reconnect>
+class LinkHealth(object):
+    def __init__(self, initial=300.0, margin=0.5, min_timeout=0.5):
+        self.initial = initial
+        self.margin = margin
+        self.min_timeout = min_timeout
+        self.interval = None
+        self.deviation = 0.0
+        self.healthchecks = 0
+        self.deadline_misses = 0
+        self.connected_at = None
+        self.last_byte = None
+        self.last_healthcheck = None
+        self.backoff = 1
+
+    def connected(self, now):
+        # the learned interval and backoff are kept over sessions; a gap
+        # between healthchecks spans no reconnect
+        self.connected_at = self.last_byte = now
+        self.last_healthcheck = None
+
+    def disconnected(self):
+        self.connected_at = None
+
+    def received(self, now):
+        self.last_byte = now
+
+    def healthcheck(self, now):
+        if self.last_healthcheck is not None:
+            gap = now - self.last_healthcheck
+            if self.interval is None:
+                self.interval = gap
+                self.deviation = gap / 2
+            else:
+                self.deviation += (abs(gap - self.interval) -
+                                   self.deviation) / 4
+                self.interval += (gap - self.interval) / 8
+            self.backoff = 1
+        self.last_healthcheck = self.last_byte = now
+        self.healthchecks += 1
+
+    def timeout(self):
+        if self.interval is None:
+            return self.initial * self.backoff
+        return self.backoff * max(self.min_timeout,
+                                  self.interval * (1 + self.margin) +
+                                  4 * self.deviation)
+
+    def deadline(self):
+        if self.last_byte is None:
+            return None
+        return self.last_byte + self.timeout()
+
+    def expired(self, now):
+        return self.connected_at is not None and \
+               now - self.last_byte >= self.timeout()
+
+    def missed(self, now):
+        '''
+        record a missed deadline; returns the silence (sec) for logging.
+        '''
+        self.deadline_misses += 1
+        self.backoff = min(self.backoff * 2, 8)
+        return now - self.last_byte
+
+    def state(self, now):
+        if self.connected_at is None:
+            return 'disconnected'
+        silence = now - self.last_byte
+        if silence >= self.timeout():
+            return 'dead'
+        if self.interval is None:
+            return 'learning'
+        if silence > self.interval:
+            return 'late'
+        return 'healthy'
+
+    def snapshot(self, now=None):
+        if now is None:
+            now = time()
+        since_byte = since_healthcheck = None
+        if self.connected_at is not None:
+            since_byte = now - self.last_byte
+            if self.last_healthcheck is not None:
+                since_healthcheck = now - self.last_healthcheck
+        return dict(link_state=self.state(now),
+                    link_since_last_byte=since_byte,
+                    link_since_last_healthcheck=since_healthcheck,
+                    link_healthcheck_interval=self.interval,
+                    link_timeout=self.timeout(),
+                    link_deadline_misses=self.deadline_misses)
@@ -0,0 +1,435 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import calendar
+import heapq
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from datetime import datetime
+from time import time
+
+from quakealert import QAlert, parse
+
+# journal files:
+#
+#   <name>       "QAJRNL1\n", then records:
+#                JOURNAL_HEAD | alert body (length bytes)
+#   <name>.idx   one JOURNAL_INDEX entry per record in write order, the
+#                time key never decreases, so time ranges are a bisect
+#   <name>.eid   "QAJEID1\n" | number of records covered (uint64) |
+#                JOURNAL_EVENT entries sorted by event id.  records after
+#                the covered ones are looked up in .idx.
+#
+# the header of a record keeps the parsed fields needed to select alerts
+# without decoding the body.
+JOURNAL_MAGIC = 'QAJRNL1\n'
+JOURNAL_EID_MAGIC = 'QAJEID1\n'
+# length, receive time, alert time (epoch sec), event id (0: none),
+# alert_seq (-1: none), flags, message type
+JOURNAL_HEAD = struct.Struct('>Idqqhb2s')
+# time key, event id, offset of the record
+JOURNAL_INDEX = struct.Struct('>dqQ')
+# event id, record number
+JOURNAL_EVENT = struct.Struct('>qQ')
+JOURNAL_EID_HEAD = struct.Struct('>8sQ')
+
+# records written (and fsynced) at once at most
+JOURNAL_BATCH = 1024
+
+FLAG_EFFECTIVE = 1
+FLAG_TEST = 2
+FLAG_CODE = 4
+FLAG_DECODE = 8
+FLAG_LAST = 16
+
+def _event_id(eid):
+    if eid is None or not str(eid).isdigit():
+        return 0
+    return int(eid)
+
+
+# a record read back from a journal
+class JournalRecord(namedtuple('JournalRecord', 'recv_time timestamp id '
+        'alert_seq message_type flags body')):
+    __slots__ = ()
+
+    def is_effective(self):
+        return bool(self.flags & FLAG_EFFECTIVE)
+
+    def is_test_message(self):
+        return bool(self.flags & FLAG_TEST)
+
+    def is_last(self):
+        return bool(self.flags & FLAG_LAST)
+
+    def alert(self):
+        return QAlert(self.body)
+
+
+def _header(body, recv_time):
+    # parsed fields of a body; a body which does not parse is kept with
+    # empty fields
+    eid, seq, flags, mtype, ts = 0, -1, 0, '', 0
+    try:
+        alert = QAlert(body)
+        ts = calendar.timegm(alert.timestamp().timetuple())
+        mtype = alert.message_type[:2]
+        if alert.is_effective():
+            flags |= FLAG_EFFECTIVE
+        if alert.is_test_message():
+            flags |= FLAG_TEST
+        if alert.is_decode_message():
+            flags |= FLAG_DECODE
+        if alert.is_code_message():
+            flags |= FLAG_CODE
+            p = parse(alert.message_type, alert.code_message())
+            eid = _event_id(p.id)
+            if p.alert_seq is not None:
+                seq = p.alert_seq
+            if p.is_last():
+                flags |= FLAG_LAST
+    except Exception, e:
+        logging.info('journal: alert not parsed: %s', e)
+    return JOURNAL_HEAD.pack(len(body), recv_time, ts, eid, seq, flags,
+                             mtype), eid
+
+
+# append-only alert journal.
+#
+#   journal = quakealert.Journal('/var/db/qa/journal')
+#   journal.write(body)          # returns at once
+#   ...
+#   journal.close()
+#
+# write() only queues the body.  a background thread parses the queued
+# alerts, appends them in batches and fsyncs at most `fsync_interval' sec
+# after a write, so the receiving loop is never blocked by the disk.  the
+# event id index is rebuilt every `reindex' records and on close().
+class Journal(object):
+    def __init__(self, filename, fsync_interval=1.0, reindex=4096):
+        self.filename = filename
+        self.fsync_interval = fsync_interval
+        self.reindex = reindex
+        self.written = 0
+        self.errors = 0
+        self.__queue = []
+        self.__cond = threading.Condition()
+        self.__closing = False
+        self.__open()
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='quakealert-journal')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __open(self):
+        idx = open(self.filename + '.idx', 'ab+')
+        data = open(self.filename, 'ab+')
+        size = os.fstat(idx.fileno()).st_size
+        # drop what a crash left after the last complete record
+        size -= size % JOURNAL_INDEX.size
+        self.__key = 0.0
+        end = len(JOURNAL_MAGIC)
+        if size:
+            idx.seek(size - JOURNAL_INDEX.size)
+            self.__key, eid, offset = JOURNAL_INDEX.unpack(
+                idx.read(JOURNAL_INDEX.size))
+            data.seek(offset)
+            length = JOURNAL_HEAD.unpack(data.read(JOURNAL_HEAD.size))[0]
+            end = offset + JOURNAL_HEAD.size + length
+        idx.truncate(size)
+        if os.fstat(data.fileno()).st_size == 0:
+            # a reader opened at once must find the header
+            data.write(JOURNAL_MAGIC)
+            data.flush()
+            os.fsync(data.fileno())
+        else:
+            data.truncate(end)
+        self.__offset = end
+        self.__records = size // JOURNAL_INDEX.size
+        self.__indexed = _eid_count(self.filename)
+        self.__idx = idx
+        self.__data = data
+
+    def write(self, body, recv_time=None):
+        if recv_time is None:
+            recv_time = time()
+        with self.__cond:
+            if self.__closing:
+                raise ValueError('journal is closed')
+            self.__queue.append((body, recv_time))
+            self.__cond.notify()
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while not self.__queue and not self.__closing:
+                    self.__cond.wait()
+                if not self.__queue:
+                    break
+                # let the batch grow for a while, but not longer than the
+                # fsync latency bound
+                deadline = time() + self.fsync_interval / 2
+                while not self.__closing and \
+                      len(self.__queue) < JOURNAL_BATCH:
+                    wait = deadline - time()
+                    if wait <= 0:
+                        break
+                    self.__cond.wait(wait)
+                batch, self.__queue = self.__queue, []
+            try:
+                self.__append(batch)
+            except (IOError, OSError):
+                logging.exception('journal: write error')
+                self.errors += len(batch)
+            if self.__records - self.__indexed >= self.reindex:
+                self.__reindex()
+        self.__reindex()
+
+    def __append(self, batch):
+        data = []
+        index = []
+        offset = self.__offset
+        for body, recv_time in batch:
+            head, eid = _header(body, recv_time)
+            self.__key = max(self.__key, recv_time)
+            index.append(JOURNAL_INDEX.pack(self.__key, eid, offset))
+            data.append(head)
+            data.append(body)
+            offset += len(head) + len(body)
+        # data first: an index entry never points past the data
+        self.__data.write(''.join(data))
+        self.__data.flush()
+        os.fsync(self.__data.fileno())
+        self.__idx.write(''.join(index))
+        self.__idx.flush()
+        os.fsync(self.__idx.fileno())
+        self.__offset = offset
+        self.__records += len(batch)
+        self.written += len(batch)
+
+    def __reindex(self):
+        if self.__records == self.__indexed:
+            return
+        try:
+            self.__indexed = build_event_index(self.filename, resume=True)
+        except (IOError, OSError):
+            logging.exception('journal: event index error')
+
+    def pending(self):
+        return len(self.__queue)
+
+    def close(self):
+        with self.__cond:
+            self.__closing = True
+            self.__cond.notify()
+        self.__thread.join()
+        self.__data.close()
+        self.__idx.close()
+
+
+def _eid_count(filename):
+    try:
+        f = open(filename + '.eid', 'rb')
+    except IOError:
+        return 0
+    try:
+        magic, count = JOURNAL_EID_HEAD.unpack(
+            f.read(JOURNAL_EID_HEAD.size))
+    except struct.error:
+        return 0
+    finally:
+        f.close()
+    return count if magic == JOURNAL_EID_MAGIC else 0
+
+def _eid_entries(filename):
+    # the records covered by the event id index and its entries
+    try:
+        f = open(filename + '.eid', 'rb')
+    except IOError:
+        return 0, []
+    try:
+        buf = f.read()
+    finally:
+        f.close()
+    try:
+        magic, count = JOURNAL_EID_HEAD.unpack_from(buf, 0)
+    except struct.error:
+        return 0, []
+    if magic != JOURNAL_EID_MAGIC:
+        return 0, []
+    return count, [JOURNAL_EVENT.unpack_from(buf, off) for off in
+                   xrange(JOURNAL_EID_HEAD.size, len(buf),
+                          JOURNAL_EVENT.size)]
+
+def build_event_index(filename, resume=False):
+    '''
+    (re)build the event id index of a journal from its .idx file, and
+    return the number of records covered.  with resume=True only the
+    records after the ones the current index covers are read.
+    '''
+    start, entries = 0, []
+    if resume:
+        start, entries = _eid_entries(filename)
+    f = open(filename + '.idx', 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if start * JOURNAL_INDEX.size > size:
+            # the journal was truncated under the index, start over
+            start, entries = 0, []
+        f.seek(start * JOURNAL_INDEX.size)
+        idx = f.read()
+    finally:
+        f.close()
+    count = start + len(idx) // JOURNAL_INDEX.size
+    if resume and start == count:
+        return count
+    new = []
+    for n in xrange(start, count):
+        key, eid, offset = JOURNAL_INDEX.unpack_from(
+            idx, (n - start) * JOURNAL_INDEX.size)
+        if eid:
+            new.append((eid, n))
+    new.sort()
+    entries = list(heapq.merge(entries, new))
+    tmp = filename + '.eid.tmp'
+    f = open(tmp, 'wb')
+    f.write(JOURNAL_EID_HEAD.pack(JOURNAL_EID_MAGIC, count))
+    f.write(''.join(JOURNAL_EVENT.pack(eid, n) for eid, n in entries))
+    f.close()
+    os.rename(tmp, filename + '.eid')
+    return count
+
+
+def _map(filename):
+    f = open(filename, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+def _bisect(buf, st, start, n, value):
+    # first entry in [start, n) whose first field is >= value
+    lo, hi = start, n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if st.unpack_from(buf, st.size * mid)[0] < value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+# reader of a journal.  the files are memory-mapped, so queries only touch
+# the pages of the records they return.
+#
+#   j = quakealert.JournalReader('/var/db/qa/journal')
+#   for rec in j.event('20110311144640'):
+#       print rec.recv_time, rec.alert_seq
+#   for rec in j.range(start, end):      # receive time, epoch sec
+#       ...
+#
+# the reader sees the journal as of its creation (or the last refresh()).
+class JournalReader(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.__maps = []
+        self.refresh()
+
+    def refresh(self):
+        self.close()
+        self.__data = _map(self.filename)
+        if self.__data[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+            raise ValueError('%s: not a journal' % self.filename)
+        self.__idx = _map(self.filename + '.idx')
+        self.__count = len(self.__idx) // JOURNAL_INDEX.size
+        self.__eid = ''
+        self.__eid_count = 0
+        self.__eid_covered = 0
+        if os.path.exists(self.filename + '.eid'):
+            eid = _map(self.filename + '.eid')
+            magic, covered = JOURNAL_EID_HEAD.unpack_from(eid, 0)
+            if magic == JOURNAL_EID_MAGIC and covered <= self.__count:
+                self.__eid = buffer(eid, JOURNAL_EID_HEAD.size)
+                self.__eid_count = len(self.__eid) // JOURNAL_EVENT.size
+                self.__eid_covered = covered
+            self.__maps.append(eid)
+        self.__maps.extend((self.__data, self.__idx))
+
+    def close(self):
+        for m in self.__maps:
+            if isinstance(m, mmap.mmap):
+                m.close()
+        self.__maps = []
+
+    def __len__(self):
+        return self.__count
+
+    def record(self, n):
+        key, eid, offset = JOURNAL_INDEX.unpack_from(self.__idx,
+                                                     JOURNAL_INDEX.size * n)
+        (length, recv_time, ts, eid, seq, flags, mtype) = \
+            JOURNAL_HEAD.unpack_from(self.__data, offset)
+        start = offset + JOURNAL_HEAD.size
+        return JournalRecord(recv_time, datetime.utcfromtimestamp(ts),
+                             str(eid) if eid else None,
+                             seq if seq >= 0 else None, mtype.rstrip('\0'),
+                             flags, self.__data[start:start + length])
+
+    def __iter__(self):
+        for n in xrange(self.__count):
+            yield self.record(n)
+
+    def range(self, start=None, end=None):
+        '''
+        records received in [start, end) (epoch sec, None: open).
+        '''
+        lo = 0 if start is None else \
+             _bisect(self.__idx, JOURNAL_INDEX, 0, self.__count, start)
+        hi = self.__count if end is None else \
+             _bisect(self.__idx, JOURNAL_INDEX, lo, self.__count, end)
+        for n in xrange(lo, hi):
+            yield self.record(n)
+
+    def event(self, eid):
+        '''
+        records of an event id (Parser.id()), in write order.
+        '''
+        eid = _event_id(eid)
+        if not eid:
+            return []
+        found = []
+        i = _bisect(self.__eid, JOURNAL_EVENT, 0, self.__eid_count, eid)
+        while i < self.__eid_count:
+            e, n = JOURNAL_EVENT.unpack_from(self.__eid,
+                                             JOURNAL_EVENT.size * i)
+            if e != eid:
+                break
+            found.append(n)
+            i += 1
+        # records written after the last index rebuild
+        for n in xrange(self.__eid_covered, self.__count):
+            if JOURNAL_INDEX.unpack_from(self.__idx,
+                    JOURNAL_INDEX.size * n)[1] == eid:
+                found.append(n)
+        return [self.record(n) for n in found]
@@ -0,0 +1,174 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import json
+import logging
+import mmap
+import os
+import struct
+
+# compiled location index:
+#
+#   header   "QALOC1\0\0" | number of codes (uint32) | reserved (uint32)
+#   table    1000 entries (code 000..999), one (offset, length) uint32 pair
+#            per locale in LOCALES order; offset 0xffffffff if absent
+#   pool     UTF-8 names
+#
+# the table has a fixed size, so a lookup is one unpack at code * entry
+# size.  the file is memory-mapped read only and shared through the page
+# cache by every process using it.
+LOC_INDEX_MAGIC = 'QALOC1\0\0'
+LOC_HEADER = struct.Struct('<8sII')
+LOCALES = ('ja', 'en', 'fr', 'kr')
+LOC_ENTRY = struct.Struct('<' + 'II' * len(LOCALES))
+LOC_CODES = 1000
+LOC_ABSENT = 0xffffffff
+
+DEFAULT_INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'location_l10n.idx')
+
+def _name(value):
+    # LocationDB_real entries are {'name': ...} per locale
+    if isinstance(value, dict):
+        value = value.get('name')
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    return value.encode('utf-8')
+
+def build_location_index(json_file_name, index_file_name):
+    '''
+    compile the JSON location DB (as read by LocationDB_real) into the
+    binary index read by LocationDB_mmap.  returns the number of codes.
+    '''
+    db = json.load(open(json_file_name))
+    table = [(LOC_ABSENT, 0) * len(LOCALES)] * LOC_CODES
+    pool = []
+    pool_len = 0
+    count = 0
+    for code, entry in sorted(db.iteritems()):
+        if len(code) != 3 or not code.isdigit():
+            logging.info('location code %s skipped', code)
+            continue
+        row = []
+        for loc in LOCALES:
+            name = _name(entry.get(loc))
+            if name is None:
+                row.extend((LOC_ABSENT, 0))
+            else:
+                row.extend((pool_len, len(name)))
+                pool.append(name)
+                pool_len += len(name)
+        table[int(code)] = tuple(row)
+        count += 1
+    base = LOC_HEADER.size + LOC_ENTRY.size * LOC_CODES
+    tmp = index_file_name + '.tmp'
+    f = open(tmp, 'wb')
+    f.write(LOC_HEADER.pack(LOC_INDEX_MAGIC, count, 0))
+    for row in table:
+        row = [v + base if i % 2 == 0 and v != LOC_ABSENT else v
+               for i, v in enumerate(row)]
+        f.write(LOC_ENTRY.pack(*row))
+    f.write(''.join(pool))
+    f.close()
+    # replace atomically, readers keep their mapping of the old file
+    os.rename(tmp, index_file_name)
+    return count
+
+
+# location code translator backed by the compiled index.  lookup() answers
+# as LocationDB_real does: {'ja': {'name': ...}, ...} for 'any', {'name':
+# ...} for a locale (KeyError if the code has no name in it), None for a
+# code that is not listed.  the dicts returned are the caller's own.
+class LocationDB_mmap(object):
+    def __init__(self, index_file_name=DEFAULT_INDEX):
+        self.dbfile = index_file_name
+        self.__mm = None
+        # decoded names per code, in LOCALES order (None if absent)
+        self.__cache = {}
+
+    def __load(self):
+        try:
+            f = open(self.dbfile, 'rb')
+        except IOError, (errno, strerror):
+            logging.error('Location DB loading error: I/O error(%s): %s',
+                    errno, strerror)
+            return False
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        magic, count, reserved = LOC_HEADER.unpack_from(mm, 0)
+        if magic != LOC_INDEX_MAGIC or \
+           len(mm) < LOC_HEADER.size + LOC_ENTRY.size * LOC_CODES:
+            logging.error('Location DB error: %s is not a location index',
+                    self.dbfile)
+            mm.close()
+            return False
+        self.__mm = mm
+        return True
+
+    def close(self):
+        if self.__mm is not None:
+            self.__mm.close()
+            self.__mm = None
+        self.__cache.clear()
+
+    def __names(self, codestr):
+        # names of an exact 3 digit code, as LocationDB_real keys its DB
+        if codestr is None or len(codestr) != 3 or not codestr.isdigit():
+            logging.debug('location code error: %s', codestr)
+            return None
+        if self.__mm is None and not self.__load():
+            return None
+        entry = LOC_ENTRY.unpack_from(self.__mm, LOC_HEADER.size +
+                                      LOC_ENTRY.size * int(codestr))
+        names = []
+        for i in xrange(0, len(entry), 2):
+            off = entry[i]
+            if off == LOC_ABSENT:
+                names.append(None)
+            else:
+                names.append(self.__mm[off:off + entry[i + 1]].decode('utf-8'))
+        if names.count(None) == len(names):
+            logging.debug('location entry for %s is not found', codestr)
+            return None
+        return tuple(names)
+
+    def lookup(self, codestr, type='any'):
+        try:
+            names = self.__cache[codestr]
+        except (KeyError, TypeError):
+            names = self.__names(codestr)
+            if names is not None:
+                self.__cache[codestr] = names
+        if names is None:
+            return None
+        if type=='any':
+            return dict((loc, dict(name=name))
+                        for loc, name in zip(LOCALES, names)
+                        if name is not None)
+        elif type in LOCALES:
+            name = names[LOCALES.index(type)]
+            if name is None:
+                raise KeyError(type)
+            return dict(name=name)
+        else:
+            logging.debug('no such location type: %s', type)
+            return None
@@ -0,0 +1,227 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from time import time
+
+# bucket boundaries (sec) of the exported Prometheus histograms
+PROMETHEUS_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                      0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                      5.0, 10.0)
+
+def _index(v):
+    # log-linear bucket of a value in usec: exact below 128, 64 sub-buckets
+    # per power of two above (relative error < 1.6%)
+    if v < 128:
+        return v
+    e = v.bit_length() - 7
+    return 128 + (e - 1) * 64 + ((v >> e) - 64)
+
+def _lower(i):
+    if i < 128:
+        return i
+    e = (i - 128) // 64 + 1
+    return ((i - 128) % 64 + 64) << e
+
+def _labels(labels):
+    # '{k="v",...}' with the values escaped, '' if none
+    if not labels:
+        return ''
+    items = []
+    for k, v in sorted(labels.iteritems()):
+        v = str(v).replace('\\', r'\\').replace('"', r'\"')
+        items.append('%s="%s"' % (k, v.replace('\n', r'\n')))
+    return '{%s}' % ','.join(items)
+
+
+# HDR style latency histogram with a fixed relative precision.  values are
+# recorded in sec and kept as sparse usec buckets.
+class Histogram(object):
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.__buckets = {}
+
+    def record(self, seconds):
+        v = int(seconds * 1e6)
+        if v < 0:
+            v = 0
+        i = _index(v)
+        self.__buckets[i] = self.__buckets.get(i, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        limit = self.count * p / 100.0
+        n = 0
+        for i in sorted(self.__buckets):
+            n += self.__buckets[i]
+            if n >= limit:
+                return _lower(i) / 1e6
+        return self.max
+
+    def cumulative(self, bounds):
+        # number of values <= each bound (sec)
+        result = []
+        items = sorted(self.__buckets.iteritems())
+        n = 0
+        k = 0
+        for b in bounds:
+            limit = b * 1e6
+            while k < len(items) and _lower(items[k][0]) <= limit:
+                n += items[k][1]
+                k += 1
+            result.append(n)
+        return result
+
+    def summary(self):
+        if self.count == 0:
+            return dict(count=0)
+        return dict(count=self.count, mean=self.sum / self.count,
+                    max=self.max, p50=self.percentile(50),
+                    p90=self.percentile(90), p99=self.percentile(99))
+
+
+# per stage latency histograms and counters.
+#
+# stages recorded by the library:
+#   body        header received -> body complete
+#   ack         body complete -> healthcheck/checkpoint reply sent
+#   queue       body complete -> handed out by process()
+#   qalert      QAlert() construction
+#   parse       code message parse (parse(), Parser.dump())
+#
+# other objects can register a source, a function returning a dict of
+# counters which is included in snapshot() (prefixed with the name of the
+# source) and the Prometheus output (with the labels of the source, e.g.
+# quakealert_reconnects_total{server="..."}).  counters of incr() and the
+# source counters listed as monotonic are exported as Prometheus
+# counters, the others as gauges.
+class Metrics(object):
+    def __init__(self, clock=time):
+        self.clock = clock
+        self.counters = {}
+        self.histograms = {}
+        self.__sources = []
+        self.__lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self.__lock:
+            h = self.histograms.get(stage)
+            if h is None:
+                h = self.histograms[stage] = Histogram()
+            h.record(seconds)
+
+    def incr(self, name, n=1):
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_source(self, name, func, labels=None, monotonic=()):
+        self.__sources.append((name, func, labels or {}, frozenset(monotonic)))
+
+    def __counters(self):
+        counters = dict(self.counters)
+        for name, func, labels, monotonic in self.__sources:
+            for k, v in func().iteritems():
+                counters['%s_%s' % (name, k) if name else k] = v
+        return counters
+
+    def __families(self, prefix):
+        # metric name -> (type, [(labels, value)])
+        families = {}
+        def add(k, v, labels, counter):
+            if isinstance(v, bool):
+                v = int(v)
+            elif not isinstance(v, (int, long, float)):
+                return
+            if counter:
+                name, kind = '%s_%s_total' % (prefix, k), 'counter'
+            else:
+                name, kind = '%s_%s' % (prefix, k), 'gauge'
+            families.setdefault(name, (kind, []))[1].append((labels, v))
+        for k, v in self.counters.iteritems():
+            add(k, v, {}, True)
+        for name, func, labels, monotonic in self.__sources:
+            for k, v in func().iteritems():
+                add(k, v, labels, k in monotonic)
+        return families
+
+    def snapshot(self):
+        with self.__lock:
+            return dict(counters=self.__counters(),
+                        stages=dict((k, h.summary())
+                                    for k, h in self.histograms.iteritems()))
+
+    def prometheus(self, prefix='quakealert'):
+        lines = []
+        with self.__lock:
+            for name, (kind, samples) in sorted(
+                    self.__families(prefix).iteritems()):
+                lines.append('# TYPE %s %s' % (name, kind))
+                for labels, v in sorted(samples):
+                    lines.append('%s%s %s' % (name, _labels(labels), v))
+            name = '%s_stage_seconds' % prefix
+            if self.histograms:
+                lines.append('# TYPE %s histogram' % name)
+            for stage, h in sorted(self.histograms.iteritems()):
+                for b, n in zip(PROMETHEUS_BUCKETS,
+                                h.cumulative(PROMETHEUS_BUCKETS)):
+                    lines.append('%s_bucket{stage="%s",le="%s"} %d' % (
+                        name, stage, b, n))
+                lines.append('%s_bucket{stage="%s",le="+Inf"} %d' % (
+                    name, stage, h.count))
+                lines.append('%s_sum{stage="%s"} %r' % (name, stage, h.sum))
+                lines.append('%s_count{stage="%s"} %d' % (
+                    name, stage, h.count))
+        return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.prometheus()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('metrics: ' + format, *args)
+
+
+def serve_metrics(metrics, port=9200, addr='127.0.0.1'):
+    '''
+    expose the metrics in Prometheus text format on http://addr:port/metrics
+    from a background thread.  returns the HTTPServer (shutdown() to stop).
+    '''
+    server = HTTPServer((addr, port), _MetricsHandler)
+    server.metrics = metrics
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
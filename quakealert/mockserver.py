@@ -0,0 +1,440 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import errno
+import logging
+import random
+import select
+import socket
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from time import time
+
+from quakealert import QAProtocol, QAlert
+
+QA_COOKIE_LEN = 30
+
+# synthetic alert bodies in the distribution format.
+#
+# the first line of every body is a 30 byte serial which the client sends
+# back as the checkpoint cookie.  code messages follow the report sequence
+# of an earthquake: alert_seq 1..N of one event id, growing magnitude and
+# EBI list, the last one with the final report condition.
+class AlertGenerator(object):
+    def __init__(self, ebi_max=300, max_reports=15, seed=None):
+        self.ebi_max = ebi_max
+        self.max_reports = max_reports
+        self.rand = random.Random(seed)
+        self.serial = 0
+        self.__event = None
+
+    def __cookie(self):
+        self.serial += 1
+        return ('QAMOCK%024d' % self.serial)[:QA_COOKIE_LEN]
+
+    def __new_event(self, now):
+        r = self.rand
+        origin = now - timedelta(seconds=r.randint(5, 20))
+        self.__event = dict(origin=origin, seq=0,
+                reports=r.randint(1, self.max_reports),
+                location=r.randint(100, 999), lat=r.randint(240, 450),
+                lon=r.randint(1230, 1480), depth=r.randint(0, 600),
+                mag=r.randint(30, 60),
+                areas=r.sample(xrange(100, 1000),
+                               min(self.ebi_max, 900)))
+
+    def code_message(self, now=None):
+        if now is None:
+            now = datetime.now()
+        r = self.rand
+        if self.__event is None:
+            self.__new_event(now)
+        ev = self.__event
+        ev['seq'] += 1
+        ev['mag'] = min(ev['mag'] + r.randint(0, 3), 90)
+        last = ev['seq'] >= ev['reports']
+        if last:
+            self.__event = None
+        nebi = max(1, self.ebi_max * ev['seq'] // ev['reports'])
+        ebi = []
+        for code in ev['areas'][:nebi]:
+            ebi.append('%03d S%s%s %s %s' % (code,
+                r.choice(('04', '5-', '5+', '6-')), r.choice(('03', '04')),
+                (now + timedelta(seconds=r.randint(0, 60))).strftime(
+                    '%H%M%S'),
+                r.choice(('00', '01', '10', '11'))))
+        lines = [self.__cookie(),
+                 QAlert.QA_CODE_MAGIC,
+                 '',
+                 '37 03 00 %s C11' % now.strftime('%y%m%d%H%M%S'),
+                 now.strftime('%y%m%d%H%M%S'),
+                 'ND%s NCN%s%02d JD////////////// JN///' % (
+                     ev['origin'].strftime('%Y%m%d%H%M%S'),
+                     '9' if last else '0', ev['seq'] % 100),
+                 '%03d N%03d E%04d %03d %02d %s RK66204 RT10/// RC0////' % (
+                     ev['location'], ev['lat'], ev['lon'], ev['depth'],
+                     ev['mag'], r.choice(('04', '5-', '5+', '6-', '//'))),
+                 'EBI ' + ' '.join(ebi),
+                 '9999=',
+                 '', '']
+        return '\n'.join(lines)
+
+    def __text_message(self, magic, now):
+        if now is None:
+            now = datetime.now()
+        text = u'緊急地震速報（予報） ｶﾝｿｸﾃﾞｰﾀ 第%d報' % self.serial
+        lines = [self.__cookie(),
+                 magic,
+                 '',
+                 '37 03 00 %s C11' % now.strftime('%y%m%d%H%M%S'),
+                 'title',
+                 text.encode('shift-jis'),
+                 '9999=',
+                 '', '']
+        return '\n'.join(lines)
+
+    def checkpoint_message(self):
+        return self.__cookie() + '\n'
+
+    def decode_message(self, now=None):
+        return self.__text_message(QAlert.QA_DECODE_MAGIC, now)
+
+    def test_message(self, now=None):
+        return self.__text_message(QAlert.QA_TEST_MAGIC, now)
+
+
+def build_frame(body, mesg_type):
+    return str(len(body)).zfill(8) + mesg_type + body
+
+
+class _Session(object):
+    def __init__(self, so, addr, now):
+        self.so = so
+        self.addr = addr
+        self.proto = QAProtocol()
+        self.outq = deque()        # (send at, data, message kind, cookie)
+        self.wbuf = ''
+        self.connected_at = now
+        self.pending_chk = deque()
+        self.pending_ack = {}      # cookie -> (sent at, message type)
+
+
+# local distribution server speaking the QA protocol, for testing and load
+# testing the clients without a live provider.
+#
+#   server = quakealert.QAMockServer(port=0, rate=1000)
+#   server.start()                       # background thread
+#   client = quakealert.QAClient('127.0.0.1', server.port)
+#
+# rate is in alerts/sec; mix gives the ratio of code, decode and test
+# messages.  checkpoint requests (eN with a bare cookie) are sent every
+# cp_interval sec, and every ACK must carry a pending cookie in a reply of
+# the same type as the request.  faults can be injected per frame: split
+# (probability to send a frame in several TCP segments), stall (probability
+# to hold the stream for stall_time sec) and disconnect (probability to
+# close the connection in the middle of a frame).  stats() reports ack latency and reconnect time.
+class QAMockServer(object):
+    def __init__(self, host='127.0.0.1', port=0, rate=1.0,
+                 mix=(8, 1, 1), hc_interval=60.0, cp_interval=30.0,
+                 checkpoint=True,
+                 split=0.0, stall=0.0, stall_time=5.0, disconnect=0.0,
+                 ebi_max=300, seed=None):
+        self.rate = rate
+        self.mix = mix
+        self.hc_interval = hc_interval
+        self.cp_interval = cp_interval
+        self.checkpoint = checkpoint
+        self.split = split
+        self.stall = stall
+        self.stall_time = stall_time
+        self.disconnect = disconnect
+        self.ACK_TIMEOUT = 10.0
+        self.generator = AlertGenerator(ebi_max=ebi_max, seed=seed)
+        self.rand = random.Random(seed)
+        self.__listen = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__listen.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__listen.bind((host, port))
+        self.__listen.listen(5)
+        self.host, self.port = self.__listen.getsockname()[:2]
+        self.__sessions = []
+        self.__running = False
+        self.__thread = None
+        self.__last_disconnect = None
+        self.__lock = threading.Lock()
+        self.__stats = dict(connections=0, frames=0, alerts=0, bytes=0,
+                healthchecks=0, checkpoints=0, acks=0, ack_missing=0,
+                ack_bogus=0,
+                splits=0, stalls=0, disconnects=0)
+        self.__ack_latency = deque(maxlen=100000)
+        self.__reconnect_latency = deque(maxlen=10000)
+
+    # --- statistics
+
+    def __count(self, key, n=1):
+        self.__stats[key] += n
+
+    @staticmethod
+    def __summary(values):
+        if not values:
+            return dict(count=0)
+        v = sorted(values)
+        return dict(count=len(v), min=v[0], max=v[-1],
+                    mean=sum(v) / len(v), p50=v[len(v) // 2],
+                    p99=v[min(len(v) - 1, int(len(v) * 0.99))])
+
+    def stats(self):
+        with self.__lock:
+            st = dict(self.__stats)
+            st['ack_latency'] = self.__summary(self.__ack_latency)
+            st['reconnect_latency'] = \
+                    self.__summary(self.__reconnect_latency)
+            st['clients'] = len(self.__sessions)
+        return st
+
+    def reset_stats(self):
+        with self.__lock:
+            for k in self.__stats:
+                self.__stats[k] = 0
+            self.__ack_latency.clear()
+            self.__reconnect_latency.clear()
+
+    # --- sending
+
+    def __queue(self, s, data, now, kind=None, cookie=None):
+        r = self.rand
+        if s.outq:
+            now = max(now, s.outq[-1][0])
+        if self.stall and r.random() < self.stall:
+            self.__count('stalls')
+            now += self.stall_time
+        if self.disconnect and r.random() < self.disconnect:
+            s.outq.append((now, data[:r.randint(1, len(data))], None, None))
+            s.outq.append((now, None, None, None))
+            return
+        if self.split and r.random() < self.split and len(data) > 1:
+            self.__count('splits')
+            cuts = sorted(r.sample(xrange(1, len(data)),
+                                   min(len(data) - 1, r.randint(1, 4))))
+            start = 0
+            for cut in cuts:
+                s.outq.append((now, data[start:cut], None, None))
+                # a short gap so that the pieces leave as separate segments
+                now += 0.001
+                start = cut
+            s.outq.append((now, data[start:], kind, cookie))
+        else:
+            s.outq.append((now, data, kind, cookie))
+
+    def __send_healthcheck(self, s, now):
+        self.__queue(s, build_frame('chk', 'EN'), now, 'chk')
+
+    def __send_checkpoint(self, s, body, now):
+        self.__queue(s, build_frame(body, 'eN'), now, 'checkpoint',
+                     body[:QA_COOKIE_LEN])
+
+    def __send_alert(self, s, body, now):
+        mtype = 'aN' if self.checkpoint else 'AN'
+        self.__queue(s, build_frame(body, mtype), now, 'alert',
+                     body[:QA_COOKIE_LEN] if self.checkpoint else None)
+
+    def __next_body(self):
+        total = float(sum(self.mix))
+        x = self.rand.random() * total
+        if x < self.mix[0]:
+            return self.generator.code_message()
+        if x < self.mix[0] + self.mix[1]:
+            return self.generator.decode_message()
+        return self.generator.test_message()
+
+    def __flush(self, s, now):
+        while True:
+            if not s.wbuf:
+                if not s.outq or s.outq[0][0] > now:
+                    return True
+                at, data, kind, cookie = s.outq.popleft()
+                if data is None:
+                    self.__count('disconnects')
+                    return False
+                s.wbuf = data
+                if kind == 'chk':
+                    s.pending_chk.append(now)
+                    self.__count('healthchecks')
+                elif kind == 'checkpoint':
+                    self.__count('checkpoints')
+                    s.pending_ack[cookie] = (now, 'eN')
+                elif kind == 'alert':
+                    self.__count('alerts')
+                    if cookie is not None:
+                        s.pending_ack[cookie] = (now, 'aN')
+                if kind is not None:
+                    self.__count('frames')
+            try:
+                n = s.so.send(s.wbuf)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                logging.info('mock server: send error %s: %s', s.addr, e)
+                return False
+            self.__count('bytes', n)
+            s.wbuf = s.wbuf[n:]
+            if s.wbuf:
+                return True
+
+    # --- receiving
+
+    def __handle_reply(self, s, mesg, now):
+        body = mesg.body
+        if body == 'CHK':
+            if s.pending_chk:
+                self.__ack_latency.append(now - s.pending_chk.popleft())
+                self.__count('acks')
+            else:
+                self.__count('ack_bogus')
+        elif body[:3] == 'ACK':
+            cookie = body[3:3 + QA_COOKIE_LEN]
+            pending = s.pending_ack.get(cookie)
+            if pending is None or pending[1] != mesg.type:
+                self.__count('ack_bogus')
+            else:
+                del s.pending_ack[cookie]
+                self.__ack_latency.append(now - pending[0])
+                self.__count('acks')
+        else:
+            self.__count('ack_bogus')
+
+    def __read(self, s, now):
+        try:
+            frames = s.proto.recv_into(s.so)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            return False
+        if frames is None or s.proto.broken:
+            return False
+        for mesg in frames:
+            self.__handle_reply(s, mesg, now)
+        return True
+
+    # --- connection handling
+
+    def __accept(self, now):
+        so, addr = self.__listen.accept()
+        so.setblocking(0)
+        so.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s = _Session(so, addr, now)
+        self.__sessions.append(s)
+        self.__count('connections')
+        if self.__last_disconnect is not None:
+            self.__reconnect_latency.append(now - self.__last_disconnect)
+            self.__last_disconnect = None
+        logging.info('mock server: connected from %s:%s', addr[0], addr[1])
+        self.__send_healthcheck(s, now)
+
+    def __close(self, s, now):
+        s.so.close()
+        self.__sessions.remove(s)
+        self.__count('ack_missing', len(s.pending_ack) + len(s.pending_chk))
+        self.__last_disconnect = now
+        logging.info('mock server: %s:%s closed', s.addr[0], s.addr[1])
+
+    def __expire_acks(self, s, now):
+        limit = now - self.ACK_TIMEOUT
+        while s.pending_chk and s.pending_chk[0] < limit:
+            s.pending_chk.popleft()
+            self.__count('ack_missing')
+        for cookie, pending in s.pending_ack.items():
+            if pending[0] < limit:
+                del s.pending_ack[cookie]
+                self.__count('ack_missing')
+
+    def serve_forever(self):
+        self.__running = True
+        now = time()
+        next_alert = now
+        next_hc = now + self.hc_interval
+        next_cp = now + (self.cp_interval or 0)
+        while self.__running:
+            now = time()
+            deadlines = [next_hc]
+            if self.cp_interval:
+                deadlines.append(next_cp)
+            if self.rate:
+                deadlines.append(next_alert)
+            rlist = [self.__listen] + [s.so for s in self.__sessions]
+            wlist = []
+            for s in self.__sessions:
+                if s.wbuf:
+                    wlist.append(s.so)
+                elif s.outq:
+                    deadlines.append(s.outq[0][0])
+            wait = max(0, min(min(deadlines) - now, 0.1))
+            try:
+                r, w, x = select.select(rlist, wlist, [], wait)
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            now = time()
+            with self.__lock:
+                if self.__listen in r:
+                    self.__accept(now)
+                for s in list(self.__sessions):
+                    if s.so in r and not self.__read(s, now):
+                        self.__close(s, now)
+                if now >= next_hc:
+                    next_hc = now + self.hc_interval
+                    for s in self.__sessions:
+                        self.__send_healthcheck(s, now)
+                if self.cp_interval and now >= next_cp:
+                    next_cp = now + self.cp_interval
+                    body = self.generator.checkpoint_message()
+                    for s in self.__sessions:
+                        self.__send_checkpoint(s, body, now)
+                if self.rate and self.__sessions:
+                    # catch up at most one second worth of alerts
+                    n = 0
+                    while next_alert <= now and n < max(1, self.rate):
+                        body = self.__next_body()
+                        for s in self.__sessions:
+                            self.__send_alert(s, body, now)
+                        next_alert += 1.0 / self.rate
+                        n += 1
+                    if next_alert < now:
+                        next_alert = now
+                elif self.rate:
+                    next_alert = now
+                for s in list(self.__sessions):
+                    if not self.__flush(s, now):
+                        self.__close(s, now)
+                    else:
+                        self.__expire_acks(s, now)
+        for s in list(self.__sessions):
+            self.__close(s, time())
+        self.__listen.close()
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
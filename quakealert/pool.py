@@ -0,0 +1,273 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import calendar
+import errno
+import fcntl
+import logging
+import mmap
+import multiprocessing
+import os
+import select
+import struct
+from datetime import datetime
+from time import time
+
+from quakealert import ParsedEEW
+
+# fixed record of a parsed alert in a shared memory slot:
+#
+#   message_type id alert_condition max_seismic rk rc location_code
+#   timestamp (epoch sec) alert_seq lat lon depth magnitude area
+#   effective test ebi_len | EBI string (ebi_len bytes)
+#
+# strings are NUL padded ('' for None), integers use NONE for None.
+RECORD = struct.Struct('<2s16s1s2s8s8s8sdhhhhhbBBI')
+NONE = -32768
+# slot index passed through the pipes
+SLOT = struct.Struct('<I')
+STOP = 0xffffffff
+# per worker counters kept in shared memory: processed, errors, busy sec,
+# time of the last update
+WORKER_STATS = struct.Struct('<QQdd')
+
+def _int(v):
+    return NONE if v is None else v
+
+def _none(v):
+    return None if v == NONE else v
+
+def _str(v):
+    return v.rstrip('\0') or None
+
+def pack_record(p, effective, test, buf, offset, size):
+    '''
+    write a ParsedEEW into buf[offset:offset + size].  an EBI list which
+    does not fit is cut at an area boundary; returns False in that case.
+    '''
+    ebistr = p.ebistr or ''
+    room = size - RECORD.size
+    fits = len(ebistr) <= room
+    if not fits:
+        tokens = ebistr[:room + 1].split()
+        if ebistr[room] != ' ':
+            # the last area is cut
+            tokens = tokens[:-1]
+        ebistr = ' '.join(tokens[:len(tokens) // 4 * 4])
+    RECORD.pack_into(buf, offset, p.message_type or '', p.id or '',
+            p.alert_condition or '', p.max_seismic or '', p.rk or '',
+            p.rc or '', p.location_code or '',
+            calendar.timegm(p.timestamp.timetuple()), _int(p.alert_seq),
+            _int(p.lat), _int(p.lon), _int(p.depth), _int(p.magnitude),
+            _int(p.area), bool(effective), bool(test), len(ebistr))
+    start = offset + RECORD.size
+    buf[start:start + len(ebistr)] = ebistr
+    return fits
+
+def unpack_record(buf, offset):
+    '''
+    read a record written by pack_record(): (ParsedEEW, effective, test)
+    '''
+    (mtype, eid, cond, seismic, rk, rc, location, ts, seq, lat, lon,
+     depth, mag, area, effective, test, ebi_len) = \
+        RECORD.unpack_from(buf, offset)
+    start = offset + RECORD.size
+    ebistr = str(buf[start:start + ebi_len]) or None
+    p = ParsedEEW(_str(mtype), _str(eid), datetime.utcfromtimestamp(ts),
+                  _str(cond), _none(seq), _str(location), _none(lat),
+                  _none(lon), _none(depth), _none(mag), _str(seismic),
+                  _str(rk), _none(area), _str(rc), ebistr)
+    return p, bool(effective), bool(test)
+
+def _read_slot(fd):
+    data = ''
+    while len(data) < SLOT.size:
+        try:
+            chunk = os.read(fd, SLOT.size - len(data))
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if not chunk:
+            return STOP
+        data += chunk
+    return SLOT.unpack(data)[0]
+
+
+# fan-out of parsed alerts to a pool of worker processes.
+#
+# alerts are written as fixed records (see RECORD) into slots of an
+# anonymous shared memory mapping; only the 4 byte slot index goes through
+# a pipe, nothing is pickled.  a worker copies the record out, returns
+# the slot and calls handler(p, effective, test) with the ParsedEEW, so
+# rendering, sink writes and notifications run in parallel while the
+# intake only packs a record.
+#
+#   pool = quakealert.WorkerPool(handler, workers=4)
+#   pool.start()
+#   pool.submit(pmesg.parse(), alert)
+#   ...
+#   pool.shutdown()
+#
+# submit() returns False (and counts the alert as dropped) when no slot
+# becomes free within `timeout' sec.  stats() gives per worker throughput,
+# updated by the workers in shared memory after every alert.  start() the
+# pool before any thread (client I/O, sinks), the workers are forked.
+class WorkerPool(object):
+    def __init__(self, handler, workers=None, slots=256, slot_size=16384,
+                 init=None):
+        if slot_size <= RECORD.size:
+            raise ValueError('slot_size must be larger than %d' %
+                             RECORD.size)
+        self.handler = handler
+        self.init = init
+        self.workers = workers or multiprocessing.cpu_count()
+        self.slots = slots
+        self.slot_size = slot_size
+        self.submitted = 0
+        self.dropped = 0
+        self.truncated = 0
+        self.started = None
+        self.__stats_offset = slots * slot_size
+        self.__mm = mmap.mmap(-1, self.__stats_offset +
+                              WORKER_STATS.size * self.workers)
+        self.__free = range(slots)
+        self.__procs = []
+        self.__task_r, self.__task_w = os.pipe()
+        self.__free_r, self.__free_w = os.pipe()
+        flags = fcntl.fcntl(self.__free_r, fcntl.F_GETFL)
+        fcntl.fcntl(self.__free_r, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def __worker(self, n):
+        os.close(self.__task_w)
+        os.close(self.__free_r)
+        if self.init is not None:
+            self.init()
+        mm = self.__mm
+        stats_offset = self.__stats_offset + WORKER_STATS.size * n
+        processed = errors = 0
+        busy = 0.0
+        while True:
+            slot = _read_slot(self.__task_r)
+            if slot == STOP:
+                break
+            p, effective, test = unpack_record(mm, slot * self.slot_size)
+            os.write(self.__free_w, SLOT.pack(slot))
+            t = time()
+            try:
+                self.handler(p, effective, test)
+            except Exception:
+                logging.exception('worker %d: handler error', n)
+                errors += 1
+            now = time()
+            busy += now - t
+            processed += 1
+            WORKER_STATS.pack_into(mm, stats_offset, processed, errors,
+                                   busy, now)
+
+    def start(self):
+        if self.__procs:
+            return
+        self.started = time()
+        for n in xrange(self.workers):
+            proc = multiprocessing.Process(target=self.__worker, args=(n,),
+                                           name='quakealert-worker-%d' % n)
+            proc.daemon = True
+            proc.start()
+            self.__procs.append(proc)
+
+    def __reclaim(self, timeout=0):
+        if timeout > 0 and not self.__free:
+            select.select([self.__free_r], [], [], timeout)
+        try:
+            data = os.read(self.__free_r, SLOT.size * self.slots)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        for i in xrange(0, len(data), SLOT.size):
+            self.__free.append(SLOT.unpack_from(data, i)[0])
+
+    def submit(self, p, alert=None, timeout=0):
+        '''
+        hand a ParsedEEW (and the QAlert it came from) to the workers.
+        '''
+        self.__reclaim()
+        if not self.__free:
+            deadline = time() + timeout
+            while not self.__free:
+                wait = deadline - time()
+                if wait <= 0:
+                    self.dropped += 1
+                    logging.error('worker pool full, alert dropped')
+                    return False
+                self.__reclaim(wait)
+        slot = self.__free.pop()
+        if alert is None:
+            effective, test = True, False
+        else:
+            effective, test = alert.is_effective(), alert.is_test_message()
+        if not pack_record(p, effective, test, self.__mm,
+                           slot * self.slot_size, self.slot_size):
+            self.truncated += 1
+            logging.error('EBI list of %s truncated to fit a slot', p.id)
+        os.write(self.__task_w, SLOT.pack(slot))
+        self.submitted += 1
+        return True
+
+    def pending(self):
+        self.__reclaim()
+        return self.slots - len(self.__free)
+
+    def stats(self):
+        now = time()
+        workers = []
+        for n in xrange(self.workers):
+            processed, errors, busy, updated = WORKER_STATS.unpack_from(
+                self.__mm, self.__stats_offset + WORKER_STATS.size * n)
+            elapsed = now - self.started if self.started else 0.0
+            workers.append(dict(processed=processed, errors=errors,
+                    busy=busy, rate=processed / elapsed if elapsed else 0.0,
+                    utilization=busy / elapsed if elapsed else 0.0))
+        return dict(submitted=self.submitted, dropped=self.dropped,
+                    truncated=self.truncated, pending=self.pending(),
+                    workers=workers)
+
+    def counters(self):
+        st = self.stats()
+        return dict(submitted=st['submitted'], dropped=st['dropped'],
+                    truncated=st['truncated'], pending=st['pending'],
+                    processed=sum(w['processed'] for w in st['workers']),
+                    errors=sum(w['errors'] for w in st['workers']))
+
+    def shutdown(self, timeout=10.0):
+        '''
+        let the workers finish the queued alerts and stop them.  returns
+        the final stats().
+        '''
+        for proc in self.__procs:
+            os.write(self.__task_w, SLOT.pack(STOP))
+        deadline = time() + timeout
+        for proc in self.__procs:
+            proc.join(max(0, deadline - time()))
+            if proc.is_alive():
+                logging.error('%s did not stop, terminated', proc.name)
+                proc.terminate()
+        st = self.stats()
+        self.__procs = []
+        return st
@@ -0,0 +1,177 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+import os
+import struct
+import threading
+from datetime import datetime
+from time import sleep, time
+
+from quakealert import QAMessage
+
+# recording file format:
+#
+#   "QAREC1\n"
+#   repeated: receive time (double, sec) | frame length (uint32) | frame
+#
+# a frame is the raw header + body as read from the server, healthcheck
+# and checkpoint requests included.
+QA_RECORD_MAGIC = 'QAREC1\n'
+QA_RECORD_HEAD = struct.Struct('>dI')
+
+# appends the frames to a recording.  the file is flushed at most
+# `flush_interval' sec after a write, by a timer when no further frame
+# arrives, and on close().
+#
+#   client.recorder = quakealert.QARecorder('/tmp/qa.rec')
+class QARecorder(object):
+    def __init__(self, filename, flush_interval=1.0):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.frames = 0
+        empty = not os.path.exists(filename) or \
+                os.path.getsize(filename) == 0
+        self.__f = open(filename, 'ab')
+        if empty:
+            self.__f.write(QA_RECORD_MAGIC)
+            self.__f.flush()
+        self.__lock = threading.Lock()
+        self.__timer = None
+        self.__last_flush = time()
+
+    def write(self, frame, recv_time=None):
+        if recv_time is None:
+            recv_time = time()
+        with self.__lock:
+            self.__f.write(QA_RECORD_HEAD.pack(recv_time, len(frame)))
+            self.__f.write(frame)
+            self.frames += 1
+            now = time()
+            if now - self.__last_flush >= self.flush_interval:
+                self.__flush(now)
+            elif self.__timer is None:
+                self.__timer = threading.Timer(
+                    self.__last_flush + self.flush_interval - now,
+                    self.__timed_flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def __flush(self, now):
+        # called with the lock held
+        self.__f.flush()
+        self.__last_flush = now
+
+    def __timed_flush(self):
+        with self.__lock:
+            self.__timer = None
+            if not self.__f.closed:
+                self.__flush(time())
+
+    def close(self):
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            if not self.__f.closed:
+                self.__f.flush()
+                self.__f.close()
+
+
+def read_records(filename):
+    '''
+    iterate (receive time, frame) pairs of a recording.
+    '''
+    f = open(filename, 'rb')
+    try:
+        if f.read(len(QA_RECORD_MAGIC)) != QA_RECORD_MAGIC:
+            raise ValueError('%s: not a QA recording' % filename)
+        while True:
+            head = f.read(QA_RECORD_HEAD.size)
+            if len(head) < QA_RECORD_HEAD.size:
+                break
+            recv_time, length = QA_RECORD_HEAD.unpack(head)
+            frame = f.read(length)
+            if len(frame) < length:
+                logging.info('%s: truncated record at the end', filename)
+                break
+            yield recv_time, frame
+    finally:
+        f.close()
+
+
+# replays a recording with the same process() interface as QAClient.
+#
+#   client = quakealert.QAReplay('/tmp/qa.rec', speed=10)   # 10x
+#   client = quakealert.QAReplay('/tmp/qa.rec', speed=None) # max speed
+#
+# process() returns None (and sets `eof') once the recording is exhausted.
+class QAReplay(object):
+    def __init__(self, filename, speed=1.0):
+        self.filename = filename
+        self.speed = speed
+        self.connected = True
+        self.connect_err_count = 0
+        self.err_count = 0
+        self.last_healthcheck_recved = None
+        self.verbose = None
+        self.eof = False
+        self.frames = 0
+        self.__records = read_records(filename)
+        self.__first = None
+        self.__start = None
+
+    def __wait(self, recv_time):
+        if not self.speed:
+            return
+        now = time()
+        if self.__first is None:
+            self.__first = recv_time
+            self.__start = now
+            return
+        delay = self.__start + (recv_time - self.__first) / self.speed - now
+        if delay > 0:
+            sleep(delay)
+
+    def process(self):
+        for recv_time, frame in self.__records:
+            self.__wait(recv_time)
+            self.frames += 1
+            try:
+                mesg = QAMessage(frame[:10], frame[10:])
+            except ValueError:
+                self.err_count += 1
+                continue
+            if mesg.is_healthcheck_request():
+                self.last_healthcheck_recved = \
+                        datetime.fromtimestamp(recv_time)
+            if mesg.is_alert_message():
+                return mesg.body
+        self.eof = True
+        self.connected = False
+        return None
+
+    def stop(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            body = self.process()
+            if body is None:
+                break
+            yield body
@@ -0,0 +1,157 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import hashlib
+import logging
+from collections import deque, OrderedDict
+from time import time
+
+from quakealert import QAlert, QAMessage, Parser
+from quakealert.async_client import AsyncQAClient, wait_ready
+
+def alert_key(body):
+    '''
+    identity of an alert body: (event id, alert_seq) for code messages,
+    hash of the body after the cookie for decode/test messages or
+    unparsable ones.  the cookie is per session and left out so that
+    copies from different servers get the same key.
+    '''
+    try:
+        alert = QAlert(body)
+        if alert.is_code_message():
+            p = Parser(alert.message_type, alert.code_message())
+            eid = p.id()
+            seq = p.alert_seq()
+            if eid is not None and seq is not None:
+                return (eid, seq)
+    except (IndexError, ValueError, AttributeError):
+        pass
+    return hashlib.sha1(body[QAMessage.QA_COOKIE_LEN:]).digest()
+
+
+# client keeping sessions to several distribution servers at once.
+#
+# every session answers its own healthcheck and checkpoint requests; only
+# the first copy of each alert is handed to the caller, so the delivery
+# latency is the minimum over the providers.  for every later copy the lag
+# behind the first arrival is recorded per server.  listing the same
+# server twice raises ValueError.
+#
+#   client = quakealert.RedundantQAClient([('<server1>', <port1>),
+#                                          ('<server2>', <port2>)])
+#   while(1):
+#       mesg = client.process()
+class RedundantQAClient(object):
+    def __init__(self, servers, srcaddr=None, max_keys=4096, ttl=600):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.sessions = []
+        self.__stats = OrderedDict()
+        for server, port in servers:
+            # the stats are per server, one session each
+            name = '%s:%s' % (server, port)
+            if name in self.__stats:
+                raise ValueError('duplicated server: %s' % name)
+            self.sessions.append(AsyncQAClient(server, port, srcaddr))
+            self.__stats[name] = dict(first=0, dup=0, lag_total=0.0,
+                                      lag_max=0.0)
+        self.__seen = OrderedDict()
+        self.__alerts = deque()
+        self.__running = False
+
+    def __expire(self, now):
+        while self.__seen:
+            key, (arrived, name) = next(self.__seen.iteritems())
+            if len(self.__seen) <= self.max_keys and now - arrived < self.ttl:
+                break
+            del self.__seen[key]
+
+    def __arrived(self, name, body, now):
+        key = alert_key(body)
+        first = self.__seen.get(key)
+        if first is None:
+            self.__seen[key] = (now, name)
+            self.__stats[name]['first'] += 1
+            return True
+        lag = now - first[0]
+        st = self.__stats[name]
+        st['dup'] += 1
+        st['lag_total'] += lag
+        if lag > st['lag_max']:
+            st['lag_max'] = lag
+        logging.debug("duplicated alert from %s (%.3f sec behind %s)",
+                name, lag, first[1])
+        return False
+
+    def run_once(self, timeout=None):
+        '''
+        run one round of the event loop over all sessions and return the
+        alert bodies seen for the first time in the round.
+        '''
+        now = time()
+        rlist = []
+        wlist = []
+        deadline = None
+        for session in self.sessions:
+            r, w, d = session.prepare(now)
+            rlist.extend(r)
+            wlist.extend(w)
+            if d is not None and (deadline is None or d < deadline):
+                deadline = d
+        r, w = wait_ready(rlist, wlist, now, deadline, timeout)
+        now = time()
+        alerts = []
+        for session, name in zip(self.sessions, self.__stats):
+            for body in session.dispatch(r, w, now):
+                if self.__arrived(name, body, now):
+                    alerts.append(body)
+        self.__expire(now)
+        return alerts
+
+    def process(self):
+        if not self.__alerts:
+            self.__alerts.extend(self.run_once())
+        if self.__alerts:
+            return self.__alerts.popleft()
+
+    def stats(self):
+        '''
+        per server counters: alerts delivered first, duplicates, the
+        total/max lag (sec) of the duplicates behind the first copy, and
+        the link health (LinkHealth.snapshot()).
+        '''
+        result = {}
+        for session, name in zip(self.sessions, self.__stats):
+            st = dict(self.__stats[name])
+            st['connected'] = session.connected
+            st['connect_err_count'] = session.connect_err_count
+            st['err_count'] = session.err_count
+            st.update(session.health.snapshot())
+            result[name] = st
+        return result
+
+    def stop(self):
+        for session in self.sessions:
+            session.stop()
+        self.__running = False
+
+    def __iter__(self):
+        self.__running = True
+        while self.__running:
+            for body in self.run_once():
+                yield body
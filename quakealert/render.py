@@ -0,0 +1,200 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+from collections import deque
+
+# phrases of the formatted code message.  '%s' marks the values.
+TEMPLATES = {
+    'ja': dict(alert=u':第1報', report=u':最終報',
+               areacode=u'エリアコード', location=u'"%s" 地下 %skm',
+               mag=u'M%s 震源 %s. ',
+               EMS=u'予想最大震度 %s',
+               EMSn=u'最大震度未確定'),
+    'en': dict(alert=u':First Alert', report=u':Final Report',
+               areacode=u'AreaCode', location=u'"%s" under %skm',
+               mag=u'M%s at %s. ',
+               EMS=u'Estimated max seismic# is %s',
+               EMSn=u'Max seismic not yet determind'),
+    'fr': dict(alert=u':Première alerte', report=u':Dernier rapport',
+               areacode=u'Code régional', location=u'"%s" prof. %skm',
+               mag=u'M%s, %s. ',
+               EMS=u'Intensité max estimée: %s',
+               EMSn=u'Intensité max non déterminée'),
+    'kr': dict(alert=u':초기 경보', report=u':최종 보고',
+               areacode=u'지역코드', location=u'"%s" 깊이 %skm',
+               mag=u'M%s, %s. ',
+               EMS=u'최대 진도 %s 추정',
+               EMSn=u'최대 진도 현재 미결정'),
+}
+
+# strftime('%b') of the C locale, independent of the process locale
+_MONTHS = (None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
+           'Sep', 'Oct', 'Nov', 'Dec')
+
+def _u(v):
+    # '%s' % v as unicode
+    if isinstance(v, unicode):
+        return v
+    if isinstance(v, str):
+        return v.decode('utf-8')
+    return unicode(v)
+
+def _compile(template):
+    # split the phrases at '%s', rendering concatenates the pieces
+    t = dict((k, tuple(v.split(u'%s'))) for k, v in template.iteritems())
+    # end of the '[...] ' header for the first, last and other reports
+    t['close'] = {'alert': t['alert'][0] + u'] ',
+                  'report': t['report'][0] + u'] ', None: u'] '}
+    return t
+
+
+# formatter of code messages into one line per locale, the same text as
+# format_code_message() of qa-demo.py (as unicode).
+#
+# the phrases are compiled once per locale.  render() formats all the
+# locales in one pass over the alert; the location names (per location
+# code) and the hypocenter part (per event id, while location, depth and
+# geo stay the same; the last `max_events' events) are kept in caches, so
+# the successive reports of an event only format the time, the magnitude
+# and the intensity.
+#
+#   r = quakealert.Renderer(ldb=quakealert.LocationDB_mmap())
+#   for locale, line in r.render(pmesg.parse()).iteritems():
+#       ...
+class Renderer(object):
+    def __init__(self, locales=('ja', 'en', 'fr', 'kr'), ldb=None,
+                 max_events=256):
+        for locale in locales:
+            if locale not in TEMPLATES:
+                raise ValueError('locale:%s is not yet supported.' % locale)
+        self.locales = tuple(locales)
+        self.ldb = ldb
+        self.max_events = max_events
+        self.hits = 0
+        self.misses = 0
+        self.__templates = dict((l, _compile(TEMPLATES[l]))
+                                for l in TEMPLATES)
+        self.__names = {}
+        self.__events = {}
+        self.__order = deque()
+        # parts shared by the locales of the last alert
+        self.__last = (None, None)
+
+    def __location_names(self, code, location_str):
+        # location name of each locale, None for the area code fallback
+        names = self.__names.get(code)
+        if names is not None:
+            return names
+        if location_str is None and self.ldb is not None and \
+           code is not None:
+            location_str = self.ldb.lookup(code)
+        if location_str is None:
+            # not cached: a later dump() may carry the names
+            return {}
+        names = {}
+        for locale in TEMPLATES:
+            try:
+                names[locale] = _u(location_str[locale]['name'])
+            except (KeyError, TypeError):
+                pass
+        self.__names[code] = names
+        return names
+
+    def __hypocenter(self, eid, code, location_str, depth, geo, locales):
+        names = self.__location_names(code, location_str)
+        key = (code, depth, tuple(geo), bool(names))
+        ev = self.__events.get(eid)
+        if ev is not None and ev[0] == key and \
+           all(l in ev[1] for l in locales):
+            self.hits += 1
+            return ev[1]
+        self.misses += 1
+        strs = {} if ev is None or ev[0] != key else ev[1]
+        depth = _u(depth)
+        geo_str = u' (%s,%s)' % (geo[0], geo[1]) if len(geo) == 2 else u''
+        for locale in locales:
+            t = self.__templates[locale]
+            loc = names.get(locale)
+            if loc is None:
+                loc = t['areacode'][0] + u' ' + _u(code)
+            p = t['location']
+            strs[locale] = p[0] + loc + p[1] + depth + p[2] + geo_str
+        if eid is not None:
+            if ev is None:
+                # events are short lived, the oldest one goes first
+                self.__order.append(eid)
+                if len(self.__order) > self.max_events:
+                    del self.__events[self.__order.popleft()]
+            self.__events[eid] = (key, strs)
+        return strs
+
+    def render(self, m, locales=None):
+        '''
+        format a ParsedEEW (or Parser.dump() dict) in each locale.
+        returns {locale: unicode}.
+        '''
+        if locales is None:
+            locales = self.locales
+        elif not all(l in TEMPLATES for l in locales):
+            for l in locales:
+                if l not in TEMPLATES:
+                    logging.error("locale:%s is not yet supported.", l)
+            locales = [l for l in locales if l in TEMPLATES]
+        if isinstance(m, dict):
+            ts = m.get('timestamp')
+            eid, code = m['id'], m['location_code']
+            location_str = m['location_str']
+            depth, geo = m['depth'], m['geo']
+            magnitude, seismic = m['magnitude'], m['max_seismic']
+            is_first, is_last = m['is_first'], m['is_last']
+        else:
+            ts = m.timestamp
+            eid, code = m.id, m.location_code
+            location_str = None
+            depth, geo = m.depth, m.geo()
+            magnitude, seismic = m.magnitude_str(), m.max_seismic
+            is_first, is_last = m.is_first(), m.is_last()
+        hypo = self.__hypocenter(eid, code, location_str, depth, geo,
+                                 locales)
+        key = (ts, magnitude, seismic, tuple(geo))
+        if self.__last[0] == key:
+            head, magnitude, seismic, tail = self.__last[1]
+        else:
+            if ts is not None:
+                head = u'[%02d:%02d:%02dJST %s%02d' % (ts.hour, ts.minute,
+                        ts.second, _MONTHS[ts.month], ts.day)
+            else:
+                head = u'['
+            magnitude = _u(magnitude)
+            if seismic:
+                seismic = _u(seismic)
+            tail = u' [%s,%s]' % (geo[0], geo[1]) if len(geo) == 2 else u''
+            self.__last = (key, (head, magnitude, seismic, tail))
+        report = 'report' if is_last else 'alert' if is_first else None
+        result = {}
+        for locale in locales:
+            t = self.__templates[locale]
+            p = t['mag']
+            if seismic:
+                ems = t['EMS'][0] + seismic + t['EMS'][1]
+            else:
+                ems = t['EMSn'][0]
+            result[locale] = head + t['close'][report] + p[0] + magnitude + \
+                             p[1] + hypo[locale] + p[2] + ems + tail
+        return result
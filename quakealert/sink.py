@@ -0,0 +1,358 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+import os
+import socket
+import threading
+from collections import deque
+from time import time
+
+def _encode(item):
+    if isinstance(item, unicode):
+        return item.encode('utf-8')
+    return str(item)
+
+
+# asynchronous output sink.
+#
+# emit() only queues an item; a background thread hands the queued items
+# to write_batch() in batches, so a slow disk or a slow consumer never
+# holds the receiving loop (or the healthcheck/checkpoint replies) back.
+#
+# items emitted with a key (e.g. the event id of a code message) coalesce:
+# while a report of an event is still queued, a later report of the same
+# event replaces it in place, and a sink falling behind writes the latest
+# report of every event instead of the whole backlog.  beyond `maxsize'
+# queued items the oldest ones are dropped.  emit() returns False when it
+# had to drop an item.
+#
+#   out = quakealert.FileSink(sys.stdout)
+#   out.emit(line, key=p.id())
+#   ...
+#   out.counters()    # emitted, written, coalesced, dropped, errors
+#   out.close()
+#
+# subclasses implement write_batch(items).
+class Sink(object):
+    def __init__(self, maxsize=4096, batch=256, linger=0.0):
+        self.maxsize = maxsize
+        self.batch = batch
+        self.linger = linger
+        self.emitted = 0
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.errors = 0
+        self.batches = 0
+        # cells [key, item] in arrival order, and the queued cell per key
+        self.__queue = deque()
+        self.__keys = {}
+        self.__busy = False
+        self.__cond = threading.Condition(threading.Lock())
+        self.__closing = False
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='quakealert-sink')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def emit(self, item, key=None):
+        with self.__cond:
+            if self.__closing:
+                raise ValueError('sink is closed')
+            self.emitted += 1
+            if key is not None:
+                cell = self.__keys.get(key)
+                if cell is not None:
+                    cell[1] = item
+                    self.coalesced += 1
+                    return True
+            cell = [key, item]
+            self.__queue.append(cell)
+            if key is not None:
+                self.__keys[key] = cell
+            kept = True
+            while len(self.__queue) > self.maxsize:
+                old = self.__queue.popleft()
+                if old[0] is not None:
+                    del self.__keys[old[0]]
+                self.dropped += 1
+                kept = False
+            # the writer waits for the first item, or for a full batch
+            if len(self.__queue) in (1, self.batch):
+                self.__cond.notify_all()
+            return kept
+
+    def write_batch(self, items):
+        raise NotImplementedError
+
+    def __take(self):
+        n = min(self.batch, len(self.__queue))
+        items = []
+        for i in xrange(n):
+            key, item = self.__queue.popleft()
+            if key is not None:
+                del self.__keys[key]
+            items.append(item)
+        return items
+
+    def __run(self):
+        failing = False
+        while True:
+            with self.__cond:
+                while not self.__queue and not self.__closing:
+                    self.__cond.wait()
+                if not self.__queue:
+                    break
+                if self.linger > 0:
+                    deadline = time() + self.linger
+                    while not self.__closing and \
+                          len(self.__queue) < self.batch:
+                        wait = deadline - time()
+                        if wait <= 0:
+                            break
+                        self.__cond.wait(wait)
+                items = self.__take()
+                self.__busy = True
+            try:
+                self.write_batch(items)
+                self.written += len(items)
+                self.batches += 1
+                failing = False
+            except Exception:
+                # logged once per failing streak: the logging output may
+                # well go through this sink
+                if not failing:
+                    logging.exception('sink: write error')
+                failing = True
+                self.errors += len(items)
+            with self.__cond:
+                self.__busy = False
+                self.__cond.notify_all()
+
+    def pending(self):
+        return len(self.__queue)
+
+    def flush(self, timeout=None):
+        '''
+        wait until the queued items are written.  returns False on timeout.
+        '''
+        if timeout is not None:
+            deadline = time() + timeout
+        with self.__cond:
+            while self.__queue or self.__busy:
+                if not self.__thread.is_alive():
+                    return False
+                wait = None
+                if timeout is not None:
+                    wait = deadline - time()
+                    if wait <= 0:
+                        return False
+                self.__cond.wait(wait)
+        return True
+
+    def close(self):
+        with self.__cond:
+            self.__closing = True
+            self.__cond.notify_all()
+        self.__thread.join()
+
+    def counters(self):
+        return dict(emitted=self.emitted, written=self.written,
+                    coalesced=self.coalesced, dropped=self.dropped,
+                    errors=self.errors, batches=self.batches,
+                    pending=len(self.__queue))
+
+
+# lines to a file (name or file object), one write() per batch.
+class FileSink(Sink):
+    def __init__(self, target, fsync=False, **kwargs):
+        if isinstance(target, basestring):
+            self.file = open(target, 'ab')
+            self.__own = True
+        else:
+            self.file = target
+            self.__own = False
+        self.fsync = fsync
+        Sink.__init__(self, **kwargs)
+
+    def write_batch(self, items):
+        self.file.write(''.join(_encode(i) + '\n' for i in items))
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        Sink.close(self)
+        if self.__own:
+            self.file.close()
+
+
+# FileSink rotated when it would grow over `max_bytes': <name> becomes
+# <name>.1, <name>.1 becomes <name>.2, ... up to <name>.<backups>.
+class RotatingFileSink(FileSink):
+    def __init__(self, filename, max_bytes=16 << 20, backups=5, **kwargs):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.rotations = 0
+        FileSink.__init__(self, filename, **kwargs)
+
+    def __rotate(self):
+        self.file.close()
+        for n in xrange(self.backups - 1, 0, -1):
+            src = '%s.%d' % (self.filename, n)
+            if os.path.exists(src):
+                os.rename(src, '%s.%d' % (self.filename, n + 1))
+        if self.backups > 0:
+            os.rename(self.filename, self.filename + '.1')
+        else:
+            os.unlink(self.filename)
+        self.file = open(self.filename, 'ab')
+        self.rotations += 1
+
+    def write_batch(self, items):
+        data = ''.join(_encode(i) + '\n' for i in items)
+        size = self.file.tell()
+        if size > 0 and size + len(data) > self.max_bytes:
+            self.__rotate()
+        self.file.write(data)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def counters(self):
+        counters = FileSink.counters(self)
+        counters['rotations'] = self.rotations
+        return counters
+
+
+# lines as datagrams: as many lines as fit in `max_datagram' bytes are
+# sent in one datagram, separated by '\n'.  a line longer than that is
+# dropped and counted as oversized, the rest of the batch is sent.
+class _DatagramSink(Sink):
+    def __init__(self, family, address, max_datagram=1400, **kwargs):
+        self.address = address
+        self.max_datagram = max_datagram
+        self.oversized = 0
+        self.so = socket.socket(family, socket.SOCK_DGRAM)
+        Sink.__init__(self, **kwargs)
+
+    def write_batch(self, items):
+        buf = []
+        size = 0
+        for item in items:
+            line = _encode(item)
+            if len(line) > self.max_datagram:
+                self.oversized += 1
+                continue
+            if buf and size + 1 + len(line) > self.max_datagram:
+                self.so.sendto('\n'.join(buf), self.address)
+                buf = []
+                size = 0
+            buf.append(line)
+            size += len(line) + (size > 0)
+        if buf:
+            self.so.sendto('\n'.join(buf), self.address)
+
+    def counters(self):
+        counters = Sink.counters(self)
+        counters['oversized'] = self.oversized
+        return counters
+
+    def close(self):
+        Sink.close(self)
+        if self.so is not None:
+            self.so.close()
+
+
+class UDPSink(_DatagramSink):
+    def __init__(self, host, port, **kwargs):
+        family, socktype, proto, canonname, sa = socket.getaddrinfo(host,
+                port, socket.AF_UNSPEC, socket.SOCK_DGRAM)[0]
+        _DatagramSink.__init__(self, family, sa, **kwargs)
+
+
+# unix domain socket at `path': datagrams (as UDPSink), or with
+# stream=True one connection, lines separated by '\n' and reconnected
+# on the next batch after an error.
+class UnixSink(_DatagramSink):
+    def __init__(self, path, stream=False, **kwargs):
+        self.stream = stream
+        self.__conn = None
+        if stream:
+            self.address = path
+            self.oversized = 0
+            self.so = None
+            Sink.__init__(self, **kwargs)
+        else:
+            _DatagramSink.__init__(self, socket.AF_UNIX, path, **kwargs)
+
+    def write_batch(self, items):
+        if not self.stream:
+            return _DatagramSink.write_batch(self, items)
+        if self.__conn is None:
+            so = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                so.connect(self.address)
+            except socket.error:
+                so.close()
+                raise
+            self.__conn = so
+        try:
+            self.__conn.sendall(''.join(_encode(i) + '\n' for i in items))
+        except socket.error:
+            self.__conn.close()
+            self.__conn = None
+            raise
+
+    def close(self):
+        _DatagramSink.close(self)
+        if self.__conn is not None:
+            self.__conn.close()
+
+
+# func(items) per batch, e.g. a notification API taking many messages.
+class CallableSink(Sink):
+    def __init__(self, func, **kwargs):
+        self.func = func
+        Sink.__init__(self, **kwargs)
+
+    def write_batch(self, items):
+        self.func(items)
+
+
+# logging handler writing the formatted records through a sink.
+#
+#   handler = quakealert.SinkHandler(quakealert.FileSink('/tmp/qa.log'))
+#   handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+#   logging.getLogger().addHandler(handler)
+class SinkHandler(logging.Handler):
+    def __init__(self, sink, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.sink = sink
+
+    def emit(self, record):
+        try:
+            self.sink.emit(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.sink.close()
+        logging.Handler.close(self)
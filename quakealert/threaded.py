@@ -0,0 +1,197 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+import threading
+from collections import deque
+from time import time
+
+from quakealert import QAClient
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+# QAClient with a dedicated protocol I/O thread.
+#
+# the I/O thread owns the socket and answers healthcheck and checkpoint
+# requests as soon as they arrive, whatever the consumer is doing; stop()
+# and the counter setters only leave a request it carries out after its
+# current read.  alert bodies are passed through a bounded queue; when
+# the consumer falls behind, `overflow' decides what happens to a new
+# alert on a full queue:
+#
+#   drop_oldest   discard the oldest queued alert (default)
+#   drop_newest   discard the new alert
+#   block         hold the I/O thread until there is room (acks wait too)
+#
+#   client = quakealert.ThreadedQAClient('<server>', <port>)
+#   client.start()
+#   while(1):
+#       mesg = client.process()
+class ThreadedQAClient(object):
+    def __init__(self, server, port, srcaddr=None, maxsize=1024,
+                 overflow='drop_oldest', standby=False):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('unknown overflow policy: %s' % overflow)
+        self.client = QAClient(server, port, srcaddr, standby)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.TIMEOUT = 1.0
+        self.dropped = 0
+        self.max_depth = 0
+        self.enqueued = 0
+        self.__queue = deque()
+        self.__cond = threading.Condition()
+        self.__thread = None
+        self.__running = False
+        # requests of the consumer, carried out by the I/O thread
+        self.__stop = threading.Event()
+        self.__assign = {}
+
+    # the counters of the inner client, so that code written for QAClient
+    # (e.g. qa-demo.py main()) keeps working; a value set is read back
+    # until the I/O thread has assigned it
+    def __get_err_count(self):
+        return self.__assign.get('err_count', self.client.err_count)
+    def __set_err_count(self, v):
+        self.__assign['err_count'] = v
+    err_count = property(__get_err_count, __set_err_count)
+
+    def __get_connect_err_count(self):
+        return self.__assign.get('connect_err_count',
+                                 self.client.connect_err_count)
+    def __set_connect_err_count(self, v):
+        self.__assign['connect_err_count'] = v
+    connect_err_count = property(__get_connect_err_count,
+                                 __set_connect_err_count)
+
+    @property
+    def connected(self):
+        return self.client.connected
+
+    @property
+    def health(self):
+        return self.client.health
+
+    def __put(self, body):
+        with self.__cond:
+            if len(self.__queue) >= self.maxsize:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    logging.error("alert queue full, new alert dropped")
+                    return
+                elif self.overflow == 'drop_oldest':
+                    self.__queue.popleft()
+                    self.dropped += 1
+                    logging.error("alert queue full, oldest alert dropped")
+                else:
+                    while len(self.__queue) >= self.maxsize and \
+                          self.__running:
+                        self.__cond.wait(self.TIMEOUT)
+            self.__queue.append(body)
+            self.enqueued += 1
+            if len(self.__queue) > self.max_depth:
+                self.max_depth = len(self.__queue)
+            self.__cond.notify_all()
+
+    def __requests(self):
+        if self.__stop.is_set():
+            self.__stop.clear()
+            self.client.stop()
+        while self.__assign:
+            name, v = self.__assign.popitem()
+            setattr(self.client, name, v)
+
+    def __run(self):
+        while self.__running:
+            self.__requests()
+            try:
+                body = self.client.process()
+            except Exception:
+                logging.exception("I/O thread: unexpected error")
+                self.client.err_count += 1
+                self.client.stop()
+                continue
+            if body is not None:
+                self.__put(body)
+        self.client.stop()
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='quakealert-io')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def process(self, timeout=None):
+        '''
+        return the next alert body, or None if none arrived within
+        `timeout' sec (default: self.TIMEOUT).
+        '''
+        if timeout is None:
+            timeout = self.TIMEOUT
+        deadline = time() + timeout
+        with self.__cond:
+            while not self.__queue:
+                wait = deadline - time()
+                if wait <= 0:
+                    return None
+                self.__cond.wait(wait)
+            body = self.__queue.popleft()
+            self.__cond.notify_all()
+            return body
+
+    def depth(self):
+        return len(self.__queue)
+
+    def counters(self):
+        return dict(queue_depth=len(self.__queue),
+                    queue_max_depth=self.max_depth,
+                    queue_enqueued=self.enqueued,
+                    queue_dropped=self.dropped)
+
+    def enable_metrics(self, metrics=None, name=None):
+        metrics = self.client.enable_metrics(metrics, name)
+        metrics.add_source(self.client.metrics_name, self.counters,
+                           self.client.metrics_labels(),
+                           ('queue_enqueued', 'queue_dropped'))
+        return metrics
+
+    def stats(self):
+        st = self.client.stats()
+        if self.client.metrics is None:
+            st['counters'].update(self.counters())
+        return st
+
+    def stop(self):
+        # same as QAClient.stop(): drop the session, the I/O thread
+        # reconnects
+        self.__stop.set()
+
+    def shutdown(self):
+        self.__running = False
+        with self.__cond:
+            self.__cond.notify_all()
+        if self.__thread is None:
+            self.client.stop()
+        else:
+            self.__thread.join(self.client.TIMEOUT)
+            self.__thread = None
+        if self.client.standby is not None:
+            self.client.standby.close()
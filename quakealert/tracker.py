@@ -0,0 +1,124 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import logging
+from collections import OrderedDict
+from time import time
+
+TRACKED_FIELDS = ('magnitude', 'depth', 'geo', 'max_seismic')
+
+def ebi_areas(ebi):
+    # area code -> (seismic, reached) of a Parser.ebi() list
+    areas = {}
+    if ebi:
+        for e in ebi:
+            if 'location_code' in e:
+                areas[e['location_code']] = (tuple(e['seismic']),
+                                             e.get('reached'))
+    return areas
+
+
+# per earthquake state kept across the 1..N reports of one event.
+#
+# reports are applied incrementally by Parser.id(); a report whose alert_seq
+# is not newer than the last applied one is ignored.  update() returns only
+# the fields which have changed:
+#
+#   {'id': '20110311144640', 'alert_seq': 3, 'is_first': False,
+#    'is_last': False, 'changed': {'magnitude': '7.9',
+#                                  'ebi': {'222': (('6+', '5+'), True)}}}
+#
+# areas dropped from the EBI list are reported with a value of None.  the
+# number of events is bounded (LRU) and events not updated for `ttl' sec
+# are evicted, so the memory stays flat on a long running process.
+class EventTracker(object):
+    def __init__(self, max_events=256, ttl=3600):
+        self.max_events = max_events
+        self.ttl = ttl
+        self.ignored = 0
+        self.evicted = 0
+        self.__events = OrderedDict()
+
+    def __len__(self):
+        return len(self.__events)
+
+    def __contains__(self, eid):
+        return eid in self.__events
+
+    def event(self, eid):
+        return self.__events.get(eid)
+
+    def __expire(self, now):
+        while self.__events:
+            eid, ev = next(self.__events.iteritems())
+            if len(self.__events) <= self.max_events and \
+               now - ev['updated'] < self.ttl:
+                break
+            del self.__events[eid]
+            self.evicted += 1
+
+    def update(self, p, now=None):
+        '''
+        apply one report (a Parser or its dump()) and return the delta,
+        or None if the report is stale or a duplicate.
+        '''
+        if now is None:
+            now = time()
+        d = p.dump() if hasattr(p, 'dump') else p
+        eid = d['id']
+        seq = d['alert_seq']
+        if eid is None or seq is None:
+            logging.debug('report without id/alert_seq, ignored')
+            self.ignored += 1
+            return None
+        ev = self.__events.get(eid)
+        if ev is not None and (seq <= ev['alert_seq'] or ev['closed']):
+            # left in place: the events stay in the order of their last
+            # update, which __expire() relies on
+            logging.debug('event %s: report #%s ignored (last #%s)',
+                    eid, seq, ev['alert_seq'])
+            self.ignored += 1
+            return None
+        if ev is None:
+            ev = dict(id=eid, alert_seq=0, closed=False, ebi={})
+            for f in TRACKED_FIELDS:
+                ev[f] = None
+        else:
+            del self.__events[eid]
+        changed = {}
+        for f in TRACKED_FIELDS:
+            if d[f] != ev[f]:
+                changed[f] = ev[f] = d[f]
+        areas = ebi_areas(d.get('ebi'))
+        if areas != ev['ebi']:
+            delta = {}
+            for code, value in areas.iteritems():
+                if ev['ebi'].get(code) != value:
+                    delta[code] = value
+            for code in ev['ebi']:
+                if code not in areas:
+                    delta[code] = None
+            changed['ebi'] = delta
+            ev['ebi'] = areas
+        ev['alert_seq'] = seq
+        ev['closed'] = bool(d['is_last'])
+        ev['updated'] = now
+        self.__events[eid] = ev
+        self.__expire(now)
+        return dict(id=eid, alert_seq=seq, is_first=d['is_first'],
+                    is_last=d['is_last'], changed=changed)
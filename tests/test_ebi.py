@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import unittest
+from datetime import datetime
+
+from quakealert import EBITable, ebi_parser
+
+BASE = datetime(2013, 8, 8, 16, 56, 50)
+
+class EBITableTest(unittest.TestCase):
+    def check(self, ebistr):
+        table = EBITable(ebistr, BASE)
+        self.assertEqual(table.records(), ebi_parser(ebistr, BASE).ebi)
+        return table
+
+    def test_conditions(self):
+        # one and two digit conditions, and not given
+        t = self.check('222 S0504 165705 0 221 S0504 165707 1 '
+                       '220 S05-04 165710 10 211 S0404 ////// 11 '
+                       '212 S0403 165712 //')
+        self.assertEqual([t.get(c)['condition'] for c in
+                          ('222', '221', '220', '211', '212')],
+                         [0, 1, 10, 11, None])
+        self.assertFalse('reached' in t.get('221'))
+        self.assertEqual(t.get('211')['reached'], True)
+
+    def test_irregular_records(self):
+        # partial records are kept, bad conditions dropped as ebi_parser()
+        t = self.check('22A S0504 165705 10 1234 S0504 165705 11 '
+                       '222 X0504 165705 10 223 S1x04 165705 01 '
+                       '224 S5-5+ 165705 1x 225 S0707 165705 +1')
+        self.assertEqual(len(t), 5)
+        self.assertEqual(t.skipped, 1)
+        self.assertFalse('1234' in t)
+        self.assertEqual(t.areas_at_least('5-'), ['225'])
+
+    def test_get_copy(self):
+        t = self.check('222 S0504 165705 10')
+        t.get('222')['condition'] = 99
+        self.assertEqual(t.get('222')['condition'], 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import random
+import unittest
+
+from quakealert import GeoIndex
+from quakealert.geoindex import distance
+
+class GeoIndexTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(1)
+        self.index = GeoIndex(cell=1.0)
+        self.points = {}
+        for key in xrange(5000):
+            # longitudes beyond +-180 as well
+            lat, lon = rnd.uniform(-90, 90), rnd.uniform(-200, 200)
+            self.points[key] = (lat, lon)
+            self.index.insert(key, lat, lon)
+        self.rnd = rnd
+
+    def brute_force(self, lat, lon, km):
+        return set(k for k, (a, b) in self.points.iteritems()
+                   if distance(lat, lon, a, b) <= km)
+
+    def check(self, lat, lon, km):
+        keys = self.index.radius(lat, lon, km)
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertEqual(set(keys), self.brute_force(lat, lon, km),
+                         (lat, lon, km))
+
+    def test_radius_antimeridian(self):
+        self.check(68.6, 179.7, 2000)
+        self.check(10.0, -179.99, 500)
+        self.check(-30.0, 180.0, 3000)
+
+    def test_radius_pole(self):
+        self.check(89.5, 0.0, 300)
+        self.check(-88.0, 170.0, 900)
+        self.check(45.0, 0.0, 25000)
+
+    def test_radius_random(self):
+        for i in xrange(50):
+            self.check(self.rnd.uniform(-90, 90), self.rnd.uniform(-180, 180),
+                       self.rnd.uniform(10, 3000))
+
+    def test_bbox_antimeridian(self):
+        keys = set(self.index.bbox(60, 170, 70, 190))
+        self.assertEqual(keys, set(k for k, (a, b) in self.points.iteritems()
+                                   if 60 <= a <= 70 and
+                                      (b - 170) % 360 <= 20))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from quakealert import LocationDB_real, LocationDB_mmap, build_location_index
+
+LOCATIONS = {
+    '222': {'ja': {'name': u'西埼玉'},
+            'en': {'name': 'Saitama Seibu'},
+            'fr': {'name': 'Saitama Seibu'},
+            'kr': {'name': 'Saitama Seibu'}},
+    # no name but in japanese
+    '350': {'ja': {'name': u'東京湾'}},
+    '001': {'ja': {'name': u'石狩'}, 'en': {'name': 'Ishikari'}},
+}
+
+class LocationDBTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        json_file = os.path.join(self.dir, 'location.json')
+        index_file = os.path.join(self.dir, 'location.idx')
+        json.dump(LOCATIONS, open(json_file, 'w'))
+        build_location_index(json_file, index_file)
+        self.real = LocationDB_real(json_file)
+        self.mmap = LocationDB_mmap(index_file)
+
+    def tearDown(self):
+        self.mmap.close()
+        shutil.rmtree(self.dir)
+
+    def answer(self, db, code, type):
+        try:
+            return db.lookup(code, type)
+        except KeyError:
+            return KeyError
+
+    def test_same_answers(self):
+        for code in ('222', '350', '001', '999', '2220', '22', '22A',
+                     '', None):
+            for type in ('any', 'ja', 'en', 'fr', 'kr', 'xx'):
+                # twice, the second one from the cache
+                for i in range(2):
+                    self.assertEqual(self.answer(self.mmap, code, type),
+                                     self.answer(self.real, code, type),
+                                     (code, type))
+
+    def test_copies(self):
+        self.mmap.lookup('222')['ja']['name'] = 'x'
+        self.mmap.lookup('222', 'en')['name'] = 'x'
+        self.assertEqual(self.mmap.lookup('222'), self.real.lookup('222'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding:utf-8 -*-
+
+'''
+ * Copyright (c) 2011, 2013 Yojiro UO <yuo@nui.org>
+ *
+ * Permission to use, copy, modify, and distribute this software for any
+ * purpose with or without fee is hereby granted, provided that the above
+ * copyright notice and this permission notice appear in all copies.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCAIMS ALL WARRANTIES
+ * WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+ * MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ * ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+ * WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ * ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+ * OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+'''
+
+import unittest
+
+from quakealert import QAMessage, alert_key
+from quakealert.mockserver import AlertGenerator
+
+COOKIE_LEN = QAMessage.QA_COOKIE_LEN
+
+class AlertKeyTest(unittest.TestCase):
+    def other_cookie(self, body):
+        return 'X' * COOKIE_LEN + body[COOKIE_LEN:]
+
+    def test_text_message_ignores_cookie(self):
+        gen = AlertGenerator(seed=1)
+        for body in (gen.decode_message(), gen.test_message()):
+            self.assertEqual(alert_key(body),
+                             alert_key(self.other_cookie(body)))
+
+    def test_unparsable_ignores_cookie(self):
+        body = 'C' * COOKIE_LEN + '\nnot an alert\n'
+        self.assertEqual(alert_key(body), alert_key(self.other_cookie(body)))
+        self.assertNotEqual(alert_key(body),
+                            alert_key(body.replace('not', 'yet')))
+
+    def test_code_message(self):
+        gen = AlertGenerator(ebi_max=5, max_reports=2, seed=1)
+        first = gen.code_message()
+        second = gen.code_message()
+        self.assertEqual(alert_key(first), alert_key(self.other_cookie(first)))
+        self.assertNotEqual(alert_key(first), alert_key(second))
+
+if __name__ == '__main__':
+    unittest.main()